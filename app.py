@@ -1,10 +1,32 @@
 import os
+import atexit
+import hashlib
+import heapq
+import itertools
+import shutil
+import signal
+import json
+import mimetypes
+import re
+import sqlite3
 import subprocess
+import tempfile
+import threading
+import time
 import uuid
 import logging
-from flask import Flask, request, jsonify, send_from_directory
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Request, Response, request, jsonify, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
 import math # For ceiling function
 
+try:
+    import numpy as np
+except ImportError:  # Optional: only the raw frame comparison backend needs NumPy
+    np = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -20,18 +42,252 @@ OUTPUT_FOLDER = 'outputs'
 # *** Added 'webm' to allowed extensions ***
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'webm'}
 TARGET_HEIGHT = 480 # Target height for scaling (keeps aspect ratio)
+# Output resolution tiers (name -> height); 'proxy' is a tiny rendition for instant previews
+RESOLUTION_TIERS = {'proxy': 144, '240': 240, '480': 480, '720': 720, '1080': 1080}
+DEFAULT_RESOLUTION = os.environ.get('DEFAULT_RESOLUTION', str(TARGET_HEIGHT))
+# Scaler algorithm for comparisons; the proxy tier always uses the cheapest one
+SCALER_FLAGS = os.environ.get('SCALER_FLAGS', 'bilinear')
+PROXY_SCALER_FLAGS = 'fast_bilinear'
 FFMPEG_PATH = 'ffmpeg' # Path to ffmpeg executable
+FFPROBE_PATH = 'ffprobe' # Path to ffprobe executable
+FFPROBE_TIMEOUT_SECONDS = 15
+# Persistent index of ffprobe summaries keyed by input content hash (empty path disables it)
+PROBE_INDEX_PATH = os.environ.get('PROBE_INDEX_PATH', 'probe_index.sqlite3')
+PROBE_INDEX_MAX_ENTRIES = int(os.environ.get('PROBE_INDEX_MAX_ENTRIES', 10000))
 QUICK_TEST_FILE_1 = os.path.join(UPLOAD_FOLDER, 'old.mp4')
 QUICK_TEST_FILE_2 = os.path.join(UPLOAD_FOLDER, 'new.mp4')
 # Methods that benefit from pre-comparison tinting
 TINTING_METHODS = {'difference_blend', 'subtract_blend', 'opacity_blend'}
+# Pre-comparison tint of input 0 (bluer) and input 1 (greener)
+TINT_FILTERS = ["colorbalance=bs=0.1", "colorbalance=gs=0.1"]
 # Methods that benefit from post-comparison brightness boost
 BRIGHTNESS_BOOST_METHODS = {'difference_blend', 'subtract_blend'}
+# All comparison methods understood by get_ffmpeg_command
+COMPARISON_METHODS = {
+    'side_by_side', 'vertical_stack', 'difference_blend', 'subtract_blend',
+    'opacity_blend', 'interleave', 'color_channel_mix',
+}
+# Analysis methods produce a JSON report; changed_segments also encodes a highlight reel of the differing ranges
+ANALYSIS_METHODS = {'frame_metrics', 'changed_segments'}
+# Number of most divergent frames listed in a frame_metrics report
+METRICS_TOP_N = 10
+# changed_segments: height of the cheap difference scan, mean absolute luma difference (0-255) that counts
+# as changed, seconds of context kept around each change, and the method the reel is rendered with
+CHANGED_SEGMENTS_SCAN_HEIGHT = 144
+CHANGED_SEGMENTS_THRESHOLD = float(os.environ.get('CHANGED_SEGMENTS_THRESHOLD', 2.0))
+CHANGED_SEGMENTS_PADDING_SECONDS = float(os.environ.get('CHANGED_SEGMENTS_PADDING_SECONDS', 1.0))
+CHANGED_SEGMENTS_METHOD = 'difference_blend'
+# Comparison backends: 'ffmpeg' runs blend filters; 'numpy' pipes raw frames through NumPy kernels
+COMPARISON_BACKENDS = {'ffmpeg', 'numpy'}
+DEFAULT_COMPARISON_BACKEND = os.environ.get('DEFAULT_COMPARISON_BACKEND', 'ffmpeg')
+# Methods only the raw frame (NumPy) backend implements
+RAW_FRAME_METHODS = {'heatmap', 'threshold_mask', 'channel_difference'}
+# Luma difference (0-255) above which threshold_mask marks a pixel
+RAW_MASK_THRESHOLD = 16
+# Longest accepted interleave blink period, in frames or milliseconds
+BLINK_MAX_PERIOD_FRAMES = 600
+BLINK_MAX_PERIOD_MS = 10000
+# Named video encoder profiles (the selected profile's settings are part of the result cache key)
+ENCODE_PROFILES = {
+    # Balanced default for browser playback
+    'standard': ['-c:v', 'libx264', '-crf', '23', '-preset', 'veryfast', '-pix_fmt', 'yuv420p'],
+    # Fastest turnaround for interactive previews
+    'preview': ['-c:v', 'libx264', '-crf', '30', '-preset', 'ultrafast', '-tune', 'zerolatency', '-pix_fmt', 'yuv420p'],
+    # Bit-exact after scaling, for forensic diffs (High 4:4:4; most browsers cannot play it, download instead)
+    'lossless': ['-c:v', 'libx264', '-qp', '0', '-preset', 'ultrafast', '-pix_fmt', 'yuv444p'],
+    # Every frame is a keyframe for frame-accurate scrubbing
+    'intra': ['-c:v', 'libx264', '-crf', '20', '-preset', 'veryfast', '-g', '1', '-pix_fmt', 'yuv420p'],
+}
+DEFAULT_ENCODE_PROFILE = os.environ.get('DEFAULT_ENCODE_PROFILE', 'standard')
+ENCODER_SETTINGS = ENCODE_PROFILES[DEFAULT_ENCODE_PROFILE]
+# Outputs are fragmented MP4 so playback can start while later fragments are still being encoded
+FRAGMENT_SECONDS = float(os.environ.get('FRAGMENT_SECONDS', 2))
+FRAGMENTED_MP4_OPTIONS = ['-movflags', '+frag_keyframe+empty_moov+default_base_moof']
+# Thumbnail sprite sheets (request field thumbnails=true): tile width, grid columns, most tiles per
+# sheet and shortest interval between tiles (seconds of output playback)
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_COLUMNS = 10
+THUMBNAIL_MAX_COUNT = 100
+THUMBNAIL_MIN_INTERVAL_SECONDS = 1.0
+THUMBNAIL_ENCODER_SETTINGS = ['-c:v', 'mjpeg', '-q:v', '5', '-frames:v', '1']
+# Poll interval while streaming an output that is still being written (seconds)
+PARTIAL_OUTPUT_POLL_SECONDS = 0.25
+# How long a request for an announced output waits for ffmpeg to create its partial file before it is
+# answered 503 with Retry-After (seconds)
+PARTIAL_OUTPUT_WAIT_SECONDS = 5
+# How finished outputs reach the client: 'direct' (the app sends the file; under gunicorn this is
+# sendfile(2), Range requests included), 'x-accel' (nginx X-Accel-Redirect to OUTPUT_ACCEL_PREFIX)
+# or 'x-sendfile' (Apache/lighttpd X-Sendfile with the absolute path)
+OUTPUT_SERVE_MODES = {'direct', 'x-accel', 'x-sendfile'}
+OUTPUT_SERVE_MODE = os.environ.get('OUTPUT_SERVE_MODE', 'direct')
+OUTPUT_ACCEL_PREFIX = os.environ.get('OUTPUT_ACCEL_PREFIX', '/protected-outputs/')
+# Output names are derived from their content key, so a name always denotes the same video
+OUTPUT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+if OUTPUT_SERVE_MODE not in OUTPUT_SERVE_MODES:
+    raise ValueError(f"Invalid OUTPUT_SERVE_MODE: {OUTPUT_SERVE_MODE}. Allowed: " + ", ".join(sorted(OUTPUT_SERVE_MODES)))
+# Result cache bounds for the outputs directory (least recently used outputs are evicted first)
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+RESULT_CACHE_MAX_AGE_SECONDS = int(os.environ.get('RESULT_CACHE_MAX_AGE_SECONDS', 7 * 24 * 3600))
+# Background lifecycle sweep of outputs/ and proxies/: how often it runs, how many directory
+# entries each pass examines, and how old a file unknown to the cache must be before removal
+OUTPUT_SWEEP_INTERVAL_SECONDS = float(os.environ.get('OUTPUT_SWEEP_INTERVAL_SECONDS', 60))
+OUTPUT_SWEEP_BATCH = int(os.environ.get('OUTPUT_SWEEP_BATCH', 500))
+OUTPUT_ORPHAN_GRACE_SECONDS = int(os.environ.get('OUTPUT_ORPHAN_GRACE_SECONDS', 6 * 3600))
+# Input proxies: inputs scaled to a comparison height, constant frame rate, all-intra and tuned for fast decoding.
+# They replace the sources for every method and profile (lossless included), so they are lossless (-qp 0)
+# in the scaled frames' own pixel format: a comparison decodes the same pixels from a proxy as from its source.
+# An input is captured as a proxy once it has been compared this many times at the same height.
+INPUT_PROXY_FOLDER = os.environ.get('INPUT_PROXY_FOLDER', 'proxies')
+INPUT_PROXY_CACHE_MAX_BYTES = int(os.environ.get('INPUT_PROXY_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+INPUT_PROXY_BUILD_AFTER_USES = int(os.environ.get('INPUT_PROXY_BUILD_AFTER_USES', 2))
+INPUT_PROXY_ENCODER_SETTINGS = ['-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'fastdecode', '-g', '1',
+                                '-qp', '0']
+# Alignment: frame rates further apart than this (fps) are resampled to a common rate before comparing
+ALIGN_FPS_TOLERANCE = 0.01
+# Automatic time offset detection: correlates tiny luma signatures of the first ALIGN_SIGNATURE_SECONDS
+# of both inputs over lags of up to ALIGN_MAX_OFFSET_SECONDS; weaker matches than ALIGN_MIN_CORRELATION are ignored
+ALIGN_SIGNATURE_SECONDS = float(os.environ.get('ALIGN_SIGNATURE_SECONDS', 30))
+ALIGN_MAX_OFFSET_SECONDS = float(os.environ.get('ALIGN_MAX_OFFSET_SECONDS', 5))
+ALIGN_SIGNATURE_WIDTH = 32
+ALIGN_MIN_CORRELATION = 0.5
+# Largest number of (reference, candidate) pairs a single /batch request may queue
+BATCH_MAX_PAIRS = int(os.environ.get('BATCH_MAX_PAIRS', 200))
+# Number of ffmpeg runners draining the job queue (one ffmpeg process each)
+FFMPEG_WORKERS = int(os.environ.get('FFMPEG_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+# Admission control: new jobs are refused (429) once their predicted wait for a runner exceeds
+# ADMISSION_MAX_WAIT_SECONDS (0 disables admission control), or while the client already has
+# ADMISSION_MAX_CLIENT_JOBS jobs queued
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get('ADMISSION_MAX_WAIT_SECONDS', 120))
+ADMISSION_MAX_CLIENT_JOBS = int(os.environ.get('ADMISSION_MAX_CLIENT_JOBS', 8))
+# Job cost model: megapixel-frames one runner processes per second (initial guess, recalibrated from
+# finished jobs), the cost assumed for inputs that cannot be probed, and the relative cost of each
+# method per output pixel (stacked outputs are twice as large, blends and NumPy kernels add filter work)
+ADMISSION_MPIXEL_FRAMES_PER_SECOND = float(os.environ.get('ADMISSION_MPIXEL_FRAMES_PER_SECOND', 100))
+ADMISSION_UNKNOWN_JOB_SECONDS = 60.0
+METHOD_COST_WEIGHTS = {
+    'side_by_side': 2.0, 'vertical_stack': 2.0, 'difference_blend': 1.3, 'subtract_blend': 1.3,
+    'opacity_blend': 1.2, 'color_channel_mix': 1.2, 'interleave': 1.0, 'heatmap': 1.5,
+    'threshold_mask': 1.5, 'channel_difference': 1.5, 'frame_metrics': 1.5, 'changed_segments': 1.0,
+}
+# Encode mode used when a request does not ask for one: 'auto', 'single' or 'parallel'
+DEFAULT_ENCODE_MODE = os.environ.get('DEFAULT_ENCODE_MODE', 'auto')
+ENCODE_MODES = {'auto', 'single', 'parallel'}
+# Segment-parallel encoding: maximum segments per job and minimum segment length
+PARALLEL_SEGMENTS = int(os.environ.get('PARALLEL_SEGMENTS', max(2, (os.cpu_count() or 2) // FFMPEG_WORKERS)))
+PARALLEL_MIN_SEGMENT_SECONDS = float(os.environ.get('PARALLEL_MIN_SEGMENT_SECONDS', 10))
+# In 'auto' mode, only outputs at least this long (seconds) are split into segments
+PARALLEL_AUTO_MIN_DURATION = float(os.environ.get('PARALLEL_AUTO_MIN_DURATION', 60))
+# Seconds between keepalive comments on idle /jobs/<id>/events streams
+SSE_KEEPALIVE_SECONDS = 15
+# How long finished jobs stay queryable via /jobs/<id> (seconds)
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 3600))
+# Wall-clock limit of a running job in seconds (0 = none): the largest METHOD_TIME_LIMITS entry
+# ('method=seconds,...') among its methods, else JOB_TIME_LIMIT_SECONDS. A job over its limit is
+# cancelled and keeps a playable partial output.
+JOB_TIME_LIMIT_SECONDS = float(os.environ.get('JOB_TIME_LIMIT_SECONDS', 1800))
+METHOD_TIME_LIMITS = {method.strip(): float(limit) for method, _, limit in
+                      (item.partition('=') for item in os.environ.get('METHOD_TIME_LIMITS', '').split(',')) if limit}
+# Queued or running jobs that nobody has polled, streamed or followed for this long are cancelled
+# (0 disables); batch jobs are exempt. Checked every JOB_WATCHDOG_INTERVAL_SECONDS.
+JOB_ABANDON_SECONDS = float(os.environ.get('JOB_ABANDON_SECONDS', 300))
+JOB_WATCHDOG_INTERVAL_SECONDS = 5
 
 # Set Flask configuration
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 
+# --- Metrics ---
+# In-process counters and histograms rendered in the Prometheus text format on /metrics.
+# Stage timings cover the request path (upload receive, save, probe, hash, serve) and the
+# job path (queue wait, ffmpeg, whole job); ffmpeg passes also report CPU time and peak RSS.
+
+METRICS_PREFIX = 'tin_eye'
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+BYTES_BUCKETS = tuple(4 ** exponent * 1024 for exponent in range(3, 15, 1))  # 64 KiB .. 256 GiB
+
+
+class MetricsRegistry:
+    """Thread-safe labelled counters and histograms with Prometheus text exposition."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = OrderedDict()  # name -> {"type", "help", "buckets", "series": {labels: value}}
+
+    def describe(self, name, metric_type, help_text, buckets=None):
+        self.metrics[name] = {"type": metric_type, "help": help_text, "buckets": buckets, "series": {}}
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.metrics[name]["series"]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            metric = self.metrics[name]
+            series = metric["series"].get(key)
+            if series is None:
+                series = metric["series"][key] = {"counts": [0] * len(metric["buckets"]), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(metric["buckets"]):
+                if value <= bound:
+                    series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self, gauges=()):
+        """
+        Renders every metric, followed by gauges: (name, help, [(labels dict, value)])
+        tuples sampled by the caller at scrape time.
+        """
+        lines = []
+        with self.lock:
+            for name, metric in self.metrics.items():
+                lines.append(f"# HELP {METRICS_PREFIX}_{name} {metric['help']}")
+                lines.append(f"# TYPE {METRICS_PREFIX}_{name} {metric['type']}")
+                for key, series in metric["series"].items():
+                    if metric["type"] == 'counter':
+                        lines.append(f"{METRICS_PREFIX}_{name}{_format_labels(key)} {series}")
+                        continue
+                    for bound, count in zip(metric["buckets"], series["counts"]):
+                        lines.append(f"{METRICS_PREFIX}_{name}_bucket{_format_labels(key + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{METRICS_PREFIX}_{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                    lines.append(f"{METRICS_PREFIX}_{name}_sum{_format_labels(key)} {series['sum']:.6f}")
+                    lines.append(f"{METRICS_PREFIX}_{name}_count{_format_labels(key)} {series['count']}")
+        for name, help_text, samples in gauges:
+            lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} gauge")
+            for labels, value in samples:
+                lines.append(f"{METRICS_PREFIX}_{name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+
+metrics = MetricsRegistry()
+metrics.describe('stage_seconds', 'histogram', 'Time spent per request/job stage.', SECONDS_BUCKETS)
+metrics.describe('ffmpeg_seconds', 'histogram', 'Wall time of ffmpeg passes by method.', SECONDS_BUCKETS)
+metrics.describe('ffmpeg_cpu_seconds', 'histogram', 'User+system CPU time of ffmpeg passes by method.', SECONDS_BUCKETS)
+metrics.describe('ffmpeg_max_rss_bytes', 'histogram', 'Peak resident set size of ffmpeg passes by method.', BYTES_BUCKETS)
+metrics.describe('job_seconds', 'histogram', 'Run time of finished jobs by method and status.', SECONDS_BUCKETS)
+metrics.describe('output_bytes', 'histogram', 'Size of rendered outputs by method.', BYTES_BUCKETS)
+metrics.describe('bytes_in_total', 'counter', 'Bytes received in uploads.')
+metrics.describe('bytes_out_total', 'counter', 'Bytes sent from /outputs.')
+metrics.describe('ffmpeg_runs_total', 'counter', 'ffmpeg passes by method and outcome.')
+metrics.describe('admission_rejections_total', 'counter', 'Jobs refused with 429 by reason.')
+metrics.describe('jobs_cancelled_total', 'counter', 'Cancelled jobs by reason.')
+
+
+def methods_label(methods):
+    """Metrics label for a set of methods rendered by one pass (e.g. 'difference_blend,side_by_side')."""
+    return ",".join(sorted(set(methods)))
+
+
 # --- Helper Functions ---
 
 def allowed_file(filename):
@@ -43,7 +299,8 @@ def create_directories():
     """Creates upload and output directories if they don't exist."""
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-    logging.info(f"Ensured directories '{UPLOAD_FOLDER}' and '{OUTPUT_FOLDER}' exist.")
+    os.makedirs(INPUT_PROXY_FOLDER, exist_ok=True)
+    logging.info(f"Ensured directories '{UPLOAD_FOLDER}', '{OUTPUT_FOLDER}' and '{INPUT_PROXY_FOLDER}' exist.")
 
 def cleanup_files(files_to_delete):
     """Attempts to delete a list of files, logging any errors."""
@@ -60,13 +317,8 @@ def cleanup_files(files_to_delete):
              logging.warning(f"Attempted to cleanup non-existent file: {file_path}")
 
 
-def get_ffmpeg_command(method, input1, input2, output, target_height=None, playback_speed=1.0):
-    """
-    Constructs the FFMPEG command with scaling, tinting, comparison, brightness boost,
-    and video speed adjustment. Audio processing is removed.
-    Uses component expressions blend for color_channel_mix.
-    Uses overlay for interleave/blinking.
-    """
+def parse_playback_speed(playback_speed):
+    """Converts a requested playback speed to a positive float, defaulting to 1.0."""
     try:
         playback_speed = float(playback_speed)
         if playback_speed <= 0:
@@ -75,27 +327,193 @@ def get_ffmpeg_command(method, input1, input2, output, target_height=None, playb
     except (ValueError, TypeError):
         logging.warning("Invalid playback speed value, defaulting to 1.0")
         playback_speed = 1.0
+    return playback_speed
+
+
+def get_ffprobe_command(path):
+    """ffprobe command printing a file's format and stream metadata as JSON."""
+    return [FFPROBE_PATH, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path]
+
+
+def parse_ffprobe_output(path, returncode, stdout, stderr):
+    """Parsed ffprobe JSON, or None if ffprobe rejected the file or printed something else."""
+    if returncode != 0:
+        logging.warning(f"ffprobe rejected {path}: {stderr.strip()[:200]}")
+        return None
+    try:
+        return json.loads(stdout)
+    except ValueError:
+        return None
+
+
+def ffprobe_media(path):
+    """
+    Runs ffprobe on a file and returns its parsed format/stream metadata.
+    Returns None if the file cannot be parsed as media; raises FileNotFoundError
+    if ffprobe itself is not installed.
+    """
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(get_ffprobe_command(path), capture_output=True, text=True,
+                                timeout=FFPROBE_TIMEOUT_SECONDS, check=False)
+    except subprocess.TimeoutExpired:
+        logging.warning(f"ffprobe timed out on {path}")
+        return None
+    finally:
+        metrics.observe('stage_seconds', time.perf_counter() - started, stage='probe')
+    return parse_ffprobe_output(path, result.returncode, result.stdout, result.stderr)
+
+
+def has_video_stream(probe):
+    """True if ffprobe metadata describes at least one video stream."""
+    return bool(probe) and any(stream.get('codec_type') == 'video' for stream in probe.get('streams', []))
+
+
+def scaler_flags_for(height):
+    """Scaler algorithm used when scaling to the given output height."""
+    return PROXY_SCALER_FLAGS if height and height <= RESOLUTION_TIERS['proxy'] else SCALER_FLAGS
+
+
+def get_ffmpeg_command(method, input1, input2, output, target_height=None, playback_speed=1.0,
+                       start_time=None, input_duration=None, frame_offset=0, output_options=None,
+                       encoder_settings=None, blink_period=1, blink_vfr=False):
+    """
+    Constructs the FFMPEG command with scaling, tinting, comparison, brightness boost,
+    and video speed adjustment. Audio processing is removed.
+    Uses component expressions blend for color_channel_mix.
+    Uses frame selection for interleave/blinking: whole frames alternate between the
+    inputs every blink_period frames; blink_vfr drops repeated static frames.
+    start_time/input_duration seek both inputs to the same time window, and
+    frame_offset is the index of the window's first frame (keeps interleave parity
+    continuous when a comparison is rendered in segments).
+    encoder_settings defaults to the server's default encode profile.
+    """
+    return get_multi_ffmpeg_command([method], input1, input2, [output], target_height, playback_speed,
+                                    start_time, input_duration, frame_offset, output_options, encoder_settings,
+                                    blink_period=blink_period, blink_vfr=blink_vfr)
+
 
-    base_command = [ FFMPEG_PATH, '-i', input1, '-i', input2 ]
+def _fan_out(filter_complex_parts, source_tag, count, label):
+    """Splits one filter graph stream into count copies (no-op for a single consumer)."""
+    if count == 1:
+        return [source_tag]
+    tags = [f"[{label}_{index}]" for index in range(count)]
+    filter_complex_parts.append(f"{source_tag}split={count}{''.join(tags)}")
+    return tags
+
+
+def get_multi_ffmpeg_command(methods, input1, input2, outputs, target_height=None, playback_speed=1.0,
+                             start_time=None, input_duration=None, frame_offset=0, output_options=None,
+                             encoder_settings=None, output_heights=None, proxy_outputs=None, alignment=None,
+                             blink_period=1, blink_vfr=False, thumbnail_output=None):
+    """
+    Constructs one FFMPEG command that renders several comparison methods for the same
+    pair: both inputs are decoded and scaled once, then split into one branch per method
+    (tinted once and split again for the tinting methods), and each branch is mapped
+    to its own output file. outputs[i] receives methods[i]. output_options are
+    extra per-output options (e.g. -frames:v) applied to every output.
+    output_heights (parallel to outputs) requests renditions below target_height: a
+    method listed more than once is compared once and each copy is downscaled.
+    proxy_outputs maps an input index (0 or 1) to (path, fps): that input is also
+    written, after scaling, as a constant frame rate input proxy.
+    alignment (see plan_alignment) adds per-input seek offsets, a timestamp reset and
+    a common frame rate so the comparison sees exactly one frame pair per output frame.
+    blink_period and blink_vfr configure the interleave method (see _append_comparison_filters).
+    thumbnail_output is (output index, sprite path, plan): that output's frames are also
+    tiled into a sprite sheet (see plan_thumbnails).
+    """
+    playback_speed = parse_playback_speed(playback_speed)
+    for method in methods:
+        if method not in COMPARISON_METHODS:
+            logging.error(f"Invalid comparison method requested: {method}")
+            return None
+
+    # Machine-readable progress on stdout (parsed by run_ffmpeg); no interactive stats on stderr
+    base_command = [ FFMPEG_PATH, '-nostats', '-progress', 'pipe:1', '-y',
+                     *get_input_options(0, start_time, input_duration, alignment), '-i', input1,
+                     *get_input_options(1, start_time, input_duration, alignment), '-i', input2 ]
     filter_complex_parts = []
     video_inputs = ["[0:v]", "[1:v]"] # Initial video stream identifiers
 
-    # --- 1. Scaling (if target_height is set) ---
+    # --- 1. Alignment and Scaling (if target_height is set) ---
+    prepare_filters = get_alignment_filters(alignment)
+    if start_time and not (alignment and alignment["reset_pts"]):
+        # The seek leaves the first frame up to half a frame past zero; start the window at 0
+        prepare_filters.insert(0, "setpts=PTS-STARTPTS")
     if target_height:
-        scale_filter = f"scale=w=-2:h={target_height}"
-        filter_complex_parts.append(f"{video_inputs[0]}{scale_filter}[scaled0]")
-        filter_complex_parts.append(f"{video_inputs[1]}{scale_filter}[scaled1]")
+        prepare_filters.append(f"scale=w=-2:h={target_height}:flags={scaler_flags_for(target_height)}")
+    if prepare_filters:
+        filter_complex_parts.append(f"{video_inputs[0]}{','.join(prepare_filters)}[scaled0]")
+        filter_complex_parts.append(f"{video_inputs[1]}{','.join(prepare_filters)}[scaled1]")
         video_inputs = ["[scaled0]", "[scaled1]"]
 
-    # --- 2. Tinting (Optional, before certain blend modes) ---
-    tinted_video_inputs = list(video_inputs) # Copy the list
-    if method in TINTING_METHODS:
-        filter_complex_parts.append(f"{video_inputs[0]}colorbalance=bs=0.1[tinted0]")
-        filter_complex_parts.append(f"{video_inputs[1]}colorbalance=gs=0.1[tinted1]")
-        tinted_video_inputs = ["[tinted0]", "[tinted1]"]
+    # --- 2. Fan-out and Tinting (tint is applied once, before certain blend modes) ---
+    unique_methods = list(dict.fromkeys(methods))
+    tinted_methods = [method for method in unique_methods if method in TINTING_METHODS]
+    plain_methods = [method for method in unique_methods if method not in TINTING_METHODS]
+    branch_inputs = {method: [] for method in unique_methods}
+    proxy_groups = []
+    for index, source_tag in enumerate(video_inputs):
+        proxy_output = (proxy_outputs or {}).get(index)
+        copy_count = len(plain_methods) + (1 if tinted_methods else 0) + (1 if proxy_output else 0)
+        copies = _fan_out(filter_complex_parts, source_tag, copy_count, f"copy{index}")
+        if proxy_output:
+            proxy_path, proxy_fps = proxy_output
+            filter_complex_parts.append(f"{copies.pop()}fps=fps={proxy_fps:.6f}[proxy{index}]")
+            proxy_groups.append(['-map', f"[proxy{index}]", *INPUT_PROXY_ENCODER_SETTINGS, '-an', proxy_path])
+        for method, tag in zip(plain_methods, copies):
+            branch_inputs[method].append(tag)
+        if tinted_methods:
+            filter_complex_parts.append(f"{copies[-1]}{TINT_FILTERS[index]}[tinted{index}]")
+            for method, tag in zip(tinted_methods, _fan_out(filter_complex_parts, f"[tinted{index}]", len(tinted_methods), f"tinted{index}")):
+                branch_inputs[method].append(tag)
+
+    # --- 3-4. One comparison branch per method, split into its renditions ---
+    output_tags = [None] * len(outputs)
+    for method in unique_methods:
+        suffix = "" if len(unique_methods) == 1 else f"_{method}"
+        final_video_tag = _append_comparison_filters(filter_complex_parts, method, branch_inputs[method],
+                                                     suffix, playback_speed, frame_offset, blink_period, blink_vfr)
+        consumers = [index for index, output_method in enumerate(methods) if output_method == method]
+        for index, tag in zip(consumers, _fan_out(filter_complex_parts, final_video_tag, len(consumers), f"rendition{suffix}")):
+            height = output_heights[index] if output_heights else None
+            if height and target_height and height < target_height:
+                # Relative scale so stacked layouts (twice the height) shrink by the same factor
+                filter_complex_parts.append(f"{tag}scale=w=-2:h=trunc(ih*{height}/{target_height}/2)*2"
+                                            f":flags={scaler_flags_for(height)}[out{index}]")
+                tag = f"[out{index}]"
+            output_tags[index] = tag
+
+    sprite_groups = []
+    if thumbnail_output:
+        index, sprite_path, plan = thumbnail_output
+        filter_complex_parts.append(f"{output_tags[index]}split=2[thumbnail_enc][thumbnail_src]")
+        filter_complex_parts.append(f"[thumbnail_src]{get_thumbnail_filter(plan)}[sprite]")
+        output_tags[index] = "[thumbnail_enc]"
+        sprite_groups.append(['-map', "[sprite]", *THUMBNAIL_ENCODER_SETTINGS, sprite_path])
 
+    output_groups = []
+    for final_video_tag, output, method in zip(output_tags, outputs, methods):
+        # Map only the final video stream of this branch
+        # -vsync rather than -fps_mode: the image's ffmpeg 4.4 predates -fps_mode (later releases accept both)
+        frame_rate_options = ['-vsync', 'vfr'] if method == 'interleave' and blink_vfr else []
+        output_groups.append(['-map', final_video_tag, *(encoder_settings or ENCODER_SETTINGS),
+                              '-an', # Explicitly disable audio recording
+                              '-shortest', *frame_rate_options, *(output_options or []), output])
+
+    # --- 5. Combine Command ---
+    filter_complex_string = ";".join(filter_complex_parts)
+    full_command = base_command + ['-filter_complex', filter_complex_string]
+    for output_group in output_groups + proxy_groups + sprite_groups:
+        full_command.extend(output_group)
+    return full_command
+
+
+def _append_comparison_filters(filter_complex_parts, method, video_inputs, suffix, playback_speed, frame_offset=0,
+                               blink_period=1, blink_vfr=False):
+    """Appends the comparison, brightness boost and speed filters for one method; returns its output tag."""
     # --- 3. Main Comparison Filter ---
-    comparison_output_tag = "[comp_out]"
+    comparison_output_tag = f"[comp_out{suffix}]"
     post_comparison_tag = comparison_output_tag # Tag after comparison, before brightness boost
 
     if method == 'side_by_side':
@@ -103,204 +521,3594 @@ def get_ffmpeg_command(method, input1, input2, output, target_height=None, playb
     elif method == 'vertical_stack':
         filter_complex_parts.append(f"{video_inputs[0]}{video_inputs[1]}vstack=inputs=2{comparison_output_tag}")
     elif method == 'difference_blend':
-        filter_complex_parts.append(f"{tinted_video_inputs[0]}{tinted_video_inputs[1]}blend=all_mode=difference{comparison_output_tag}")
+        filter_complex_parts.append(f"{video_inputs[0]}{video_inputs[1]}blend=all_mode=difference{comparison_output_tag}")
     elif method == 'subtract_blend':
-        filter_complex_parts.append(f"{tinted_video_inputs[0]}{tinted_video_inputs[1]}blend=all_mode=subtract{comparison_output_tag}")
+        filter_complex_parts.append(f"{video_inputs[0]}{video_inputs[1]}blend=all_mode=subtract{comparison_output_tag}")
     elif method == 'opacity_blend':
-        filter_complex_parts.append(f"{tinted_video_inputs[0]}{tinted_video_inputs[1]}blend=all_mode=average{comparison_output_tag}")
+        filter_complex_parts.append(f"{video_inputs[0]}{video_inputs[1]}blend=all_mode=average{comparison_output_tag}")
     elif method == 'interleave':
-        # *** FIX: Use overlay with enable='mod(n,2)' for blinking effect ***
-        # Shows input 0 on even frames (n=0, 2, 4...), overlays input 1 on odd frames (n=1, 3, 5...)
-        filter_complex_parts.append(f"{video_inputs[0]}{video_inputs[1]}overlay=enable='mod(n,2)'{comparison_output_tag}")
+        # Blink by picking whole frames: input 0 for blink_period frames, then input 1, and so on.
+        # Each input keeps only its own phase and interleave merges the two by timestamp, so no
+        # frame is composited. scale2ref matches input 1 to input 0's size (a no-op when equal).
+        phase = f"mod(floor((n+{frame_offset})/{blink_period}),2)"
+        filter_complex_parts.append(f"{video_inputs[1]}{video_inputs[0]}scale2ref=w=main_w:h=main_h[blink_b{suffix}][blink_ref{suffix}]")
+        filter_complex_parts.append(f"[blink_ref{suffix}]select='eq({phase},0)'[blink_0{suffix}]")
+        filter_complex_parts.append(f"[blink_b{suffix}]select='eq({phase},1)'[blink_1{suffix}]")
+        blink_tag = comparison_output_tag if not blink_vfr else f"[blink{suffix}]"
+        filter_complex_parts.append(f"[blink_0{suffix}][blink_1{suffix}]interleave=nb_inputs=2{blink_tag}")
+        if blink_vfr:
+            # Drop frames that repeat the previous one (static content); the output is written as VFR
+            filter_complex_parts.append(f"{blink_tag}mpdecimate{comparison_output_tag}")
     elif method == 'color_channel_mix':
         # Use component expressions
         blend_options = "c0_expr='A':c1_expr='(A+B)/2':c2_expr='B'"
         filter_complex_parts.append(f"{video_inputs[0]}{video_inputs[1]}blend={blend_options}{comparison_output_tag}")
-    else:
-        logging.error(f"Invalid comparison method requested: {method}")
-        return None
 
     # --- 3.5 Brightness Boost (Optional, after difference/subtract) ---
     boosted_output_tag = post_comparison_tag # Start with the output from comparison
     if method in BRIGHTNESS_BOOST_METHODS:
         boost_filter = "lutyuv=y=val*4" # Multiply luma by 4 (adjust multiplier as needed)
-        boosted_output_tag = "[boosted]"
+        boosted_output_tag = f"[boosted{suffix}]"
         filter_complex_parts.append(f"{post_comparison_tag}{boost_filter}{boosted_output_tag}")
 
-
     # --- 4. Speed Adjustment (Video Only) ---
     final_video_tag = boosted_output_tag # Use the potentially boosted output tag
 
     if not math.isclose(playback_speed, 1.0):
         speed_factor = 1.0 / playback_speed
         # Apply setpts to the video stream coming from the comparison/boost stage
-        filter_complex_parts.append(f"{boosted_output_tag}setpts={speed_factor}*PTS[final_v]")
-        final_video_tag = "[final_v]" # Update the tag for the final video stream
+        filter_complex_parts.append(f"{boosted_output_tag}setpts={speed_factor}*PTS[final_v{suffix}]")
+        final_video_tag = f"[final_v{suffix}]" # Update the tag for the final video stream
 
-    # --- 5. Combine Command ---
-    filter_complex_string = ";".join(filter_complex_parts)
-    full_command = base_command + ['-filter_complex', filter_complex_string]
+    return final_video_tag
 
-    # Map only the final video stream
-    full_command.extend(['-map', final_video_tag])
-
-    # Output options
-    full_command.extend([
-        '-c:v', 'libx264',
-        '-crf', '23',
-        '-preset', 'veryfast',
-        '-pix_fmt', 'yuv420p',
-        '-an', # Explicitly disable audio recording
-        '-shortest',
-        '-y',
-        output
-    ])
-    return full_command
 
-# --- Route Handlers ---
+def parse_frame_rate(rate):
+    """Converts an ffprobe rate string such as '30000/1001' to a float (None if unknown)."""
+    try:
+        numerator, _, denominator = str(rate).partition('/')
+        value = float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return value if value > 0 else None
 
-def process_request(method, input1_path, input2_path, playback_speed, is_local=False):
-    """Shared logic for processing video comparison."""
-    unique_id = str(uuid.uuid4())
-    output_prefix = "local" if is_local else "upload"
-    speed_str = str(playback_speed).replace('.', 'p') # Format speed for filename
-    output_filename = f"{unique_id}_{method}_{output_prefix}_s{speed_str}x_output.mp4"
-    output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
 
-    # Construct and Run FFMPEG Command
-    ffmpeg_command = get_ffmpeg_command(method, input1_path, input2_path, output_path, TARGET_HEIGHT, playback_speed)
+def get_video_info(path):
+    """
+    Summarises the first video stream of a file as a dict with duration, fps, width,
+    height, codec, vfr (average and nominal frame rates differ) and start_delay
+    (seconds the video stream starts after the container). Returns None if the file
+    cannot be probed. Summaries are kept in the probe index under the file's content
+    hash, so each unique input is probed once.
+    """
+    try:
+        content_hash = hash_file(path)
+    except OSError:
+        return None
+    info = probe_index.get(content_hash)
+    if info is not None:
+        return info
+    try:
+        probe = ffprobe_media(path)
+    except FileNotFoundError:
+        logging.warning("ffprobe not found; media metadata unavailable.")
+        return None
+    info = summarize_video_probe(probe)
+    if info is not None:
+        probe_index.put(content_hash, info)
+    return info
 
-    if not ffmpeg_command:
-        return jsonify({"error": f"Invalid comparison method: {method}"}), 400
 
-    mode = "local" if is_local else "upload"
-    logging.info(f"Running FFMPEG command ({mode}): {' '.join(ffmpeg_command)}")
-    process = subprocess.run(ffmpeg_command, capture_output=True, text=True, check=False)
+def summarize_video_probe(probe):
+    """get_video_info summary of ffprobe_media output (None without a video stream)."""
+    if not has_video_stream(probe):
+        return None
+    stream = next(stream for stream in probe['streams'] if stream.get('codec_type') == 'video')
+    duration = stream.get('duration') or probe.get('format', {}).get('duration')
+    try:
+        duration = float(duration)
+    except (TypeError, ValueError):
+        duration = None
+    try:
+        start_delay = float(stream['start_time']) - float(probe.get('format', {}).get('start_time', 0))
+    except (KeyError, TypeError, ValueError):
+        start_delay = 0.0
+    avg_fps, nominal_fps = parse_frame_rate(stream.get('avg_frame_rate')), parse_frame_rate(stream.get('r_frame_rate'))
+    return {
+        "duration": duration,
+        "fps": avg_fps or nominal_fps,
+        "width": stream.get('width'),
+        "height": stream.get('height'),
+        "codec": stream.get('codec_name'),
+        "vfr": bool(avg_fps and nominal_fps and abs(avg_fps - nominal_fps) > ALIGN_FPS_TOLERANCE),
+        "start_delay": round(start_delay, 6),
+    }
 
-    # Handle FFMPEG Result
-    if process.returncode != 0:
-        error_message = f"FFMPEG failed ({mode} method: {method}). Code: {process.returncode}. Error: {process.stderr}"
-        logging.error(error_message)
-        logging.error(f"Failed command: {' '.join(ffmpeg_command)}") # Log the exact command
-        return jsonify({"error": f"Video processing failed ({mode}). Check server logs. Details: {process.stderr[:500]}..."}), 500
-    else:
-        logging.info(f"FFMPEG processing successful ({mode} method: {method}). Output: {output_path}")
-        output_url = f"/outputs/{output_filename}"
-        return jsonify({"output_url": output_url, "output_filename": output_filename}), 200
 
+def estimate_output_duration(info1, info2, playback_speed=1.0):
+    """
+    Predicts the comparison output duration in seconds (shortest input, stretched by
+    the playback speed) from get_video_info results. Returns None if unknown.
+    """
+    if not info1 or not info2 or not info1["duration"] or not info2["duration"]:
+        return None
+    return min(info1["duration"], info2["duration"]) / parse_playback_speed(playback_speed)
 
-@app.route('/compare', methods=['POST'])
-def compare_videos():
-    """Handles video uploads, runs comparison, returns result path. Cleans up uploads."""
-    logging.info("Received request to /compare (upload)")
-    input1_path, input2_path = None, None
-    files_to_cleanup = []
 
-    try:
-        # Validate request parts
-        if 'video1' not in request.files or 'video2' not in request.files:
-            return jsonify({"error": "Missing video file(s) in request"}), 400
-        if 'comparison_method' not in request.form or 'playback_speed' not in request.form:
-             return jsonify({"error": "Missing 'comparison_method' or 'playback_speed' in request form"}), 400
+def blink_period_frames(options, fps, playback_speed=1.0):
+    """
+    Interleave blink period in source frames. A period in milliseconds is playback time,
+    so slowed-down outputs blink at the same on-screen rate.
+    """
+    period = (options or {}).get("blink_period") or {"frames": 1}
+    if "frames" in period:
+        return period["frames"]
+    return max(1, int(round(period["ms"] / 1000.0 * (fps or 30.0) * parse_playback_speed(playback_speed))))
 
-        video1 = request.files['video1']
-        video2 = request.files['video2']
-        method = request.form['comparison_method']
-        speed = request.form['playback_speed']
 
-        # Validate files
-        if video1.filename == '' or video2.filename == '':
-            return jsonify({"error": "No selected file or empty filename"}), 400
-        if not (allowed_file(video1.filename) and allowed_file(video2.filename)):
-            # Log the actual filename and extension for debugging
-            logging.warning(f"Invalid file type submitted. Files: {video1.filename}, {video2.filename}. Allowed: {ALLOWED_EXTENSIONS}")
-            return jsonify({"error": "Invalid file type. Allowed: " + ", ".join(ALLOWED_EXTENSIONS)}), 400
+def segment_output_frames(frame_count, playback_speed=1.0):
+    """
+    Output frames of a segment of frame_count source frames. setpts stretches the
+    timeline by 1/playback_speed while the output keeps the source frame rate, so at
+    0.5x every source frame is written twice.
+    """
+    return int(math.ceil(frame_count / parse_playback_speed(playback_speed) - 1e-6))
 
-        # Save Uploaded Files
-        unique_id = str(uuid.uuid4())
-        ext1 = video1.filename.rsplit('.', 1)[1].lower() if '.' in video1.filename else ''
-        ext2 = video2.filename.rsplit('.', 1)[1].lower() if '.' in video2.filename else ''
-        input1_filename = f"{unique_id}_1.{ext1}" if ext1 else f"{unique_id}_1"
-        input2_filename = f"{unique_id}_2.{ext2}" if ext2 else f"{unique_id}_2"
-        input1_path = os.path.join(app.config['UPLOAD_FOLDER'], input1_filename)
-        input2_path = os.path.join(app.config['UPLOAD_FOLDER'], input2_filename)
 
-        files_to_cleanup.extend([input1_path, input2_path]) # Mark for cleanup
-        video1.save(input1_path)
-        video2.save(input2_path)
-        logging.info(f"Saved input videos: {input1_path}, {input2_path}")
+def segments_match_single_pass(playback_speed=1.0, alignment=None):
+    """
+    True if segments joined end to end are frame-identical to a single pass: every
+    source frame must become a whole number of output frames (1x, 0.5x, 0.25x, ...).
+    At other speeds the frames dropped or repeated depend on where a segment starts.
+    Aligned inputs are never segmented: segment boundaries are planned on the source
+    frames of input 1, so resampled or offset inputs would pick different frames at
+    each cut than a single pass does.
+    """
+    if not alignment_is_identity(alignment):
+        return False
+    repeats = 1.0 / parse_playback_speed(playback_speed)
+    return round(repeats) >= 1 and math.isclose(repeats, round(repeats), rel_tol=1e-6)
 
-        # Process and get response
-        return process_request(method, input1_path, input2_path, speed, is_local=False)
 
-    except Exception as e:
-        logging.exception("An unexpected error occurred during /compare request.")
-        return jsonify({"error": f"An unexpected server error occurred: {str(e)}"}), 500
-    finally:
-        # Cleanup Uploaded Files
-        cleanup_files(files_to_cleanup)
-        logging.info("Cleanup attempt finished for upload request.")
+def plan_segments(info1, info2, max_segments=None, min_segment_seconds=None):
+    """
+    Splits the common duration of two inputs into frame-aligned segments for parallel
+    encoding. Boundaries are whole multiples of the first input's frame duration
+    (the frame rate the comparison filters output at). Returns a list of
+    (first_frame, frame_count) tuples, where the last frame_count is None (run to
+    the end), or None if the inputs are too short or could not be probed.
+    """
+    if not info1 or not info2 or not info1["fps"] or not info1["duration"] or not info2["duration"]:
+        return None
+    max_segments = max_segments or PARALLEL_SEGMENTS
+    min_segment_seconds = min_segment_seconds or PARALLEL_MIN_SEGMENT_SECONDS
+    fps = info1["fps"]
+    total_frames = int(min(info1["duration"], info2["duration"]) * fps)
+    segment_count = min(max_segments, int(total_frames / (min_segment_seconds * fps)))
+    if segment_count < 2:
+        return None
+    frames_per_segment = total_frames // segment_count
+    segments = [(index * frames_per_segment, frames_per_segment) for index in range(segment_count)]
+    segments[-1] = (segments[-1][0], None)
+    return segments
 
 
-@app.route('/compare_local', methods=['POST'])
-def compare_local_videos():
-    """Runs comparison using predefined local files. Expects JSON body."""
-    logging.info("Received request to /compare_local (quick test)")
-    try:
-        # Validate request JSON
-        data = request.get_json()
-        if not data or 'comparison_method' not in data or 'playback_speed' not in data:
-             return jsonify({"error": "Missing 'comparison_method' or 'playback_speed' in request JSON body"}), 400
+def read_ffmpeg_progress(stream):
+    """
+    Parses ffmpeg '-progress' key=value output incrementally, yielding one snapshot
+    dict (frame, fps, out_time, speed, done) per completed progress block.
+    """
+    block = {}
+    for raw_line in stream:
+        line = raw_line.decode('utf-8', 'replace').strip() if isinstance(raw_line, bytes) else raw_line.strip()
+        if '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        block[key] = value.strip()
+        if key != 'progress':
+            continue
 
-        method = data['comparison_method']
-        speed = data['playback_speed']
-        input1_path = QUICK_TEST_FILE_1
-        input2_path = QUICK_TEST_FILE_2
+        snapshot = {"frame": 0, "fps": 0.0, "out_time": 0.0, "speed": None, "done": value == 'end'}
+        try:
+            snapshot["frame"] = int(block.get('frame', 0))
+        except ValueError:
+            pass
+        try:
+            snapshot["fps"] = float(block.get('fps', 0.0))
+        except ValueError:
+            pass
+        try:
+            snapshot["out_time"] = max(0.0, int(block.get('out_time_us', 0)) / 1_000_000)
+        except ValueError:
+            pass
+        speed = block.get('speed', '').rstrip('x').strip()
+        try:
+            snapshot["speed"] = float(speed)
+        except ValueError:
+            pass
+        block = {}
+        yield snapshot
 
-        # Check if predefined files exist
-        if not os.path.exists(input1_path) or not os.path.exists(input2_path):
-            logging.error(f"Quick test files not found: {input1_path}, {input2_path}")
-            return jsonify({"error": f"Sample files not found on server at {input1_path} and {input2_path}"}), 404
 
-        logging.info(f"Using local files for quick test: {input1_path}, {input2_path}")
+_ffmpeg_processes = set()  # running ffmpeg processes, killed if this process exits first
+_ffmpeg_processes_lock = threading.Lock()
 
-        # Process and get response
-        return process_request(method, input1_path, input2_path, speed, is_local=True)
 
-    except Exception as e:
-        logging.exception("An unexpected error occurred during /compare_local request.")
-        return jsonify({"error": f"An unexpected server error occurred: {str(e)}"}), 500
-    # No finally/cleanup needed for local files
+def start_ffmpeg(command, job=None, **popen_args):
+    """
+    Starts an ffmpeg process as the leader of a new process group, so cancelling its
+    job kills it together with anything it spawned, and registers it with job (if
+    given). A job that is already being cancelled has the process killed right away.
+    """
+    process = subprocess.Popen(command, start_new_session=True, **popen_args)
+    with _ffmpeg_processes_lock:
+        _ffmpeg_processes.add(process)
+    if job is not None:
+        with jobs_lock:
+            job["processes"].append(process)
+            if job["cancel_reason"] is not None:
+                kill_process_group(process)
+    return process
 
 
-# --- Static File Serving ---
+def release_ffmpeg(process, job=None):
+    """Unregisters a process started by start_ffmpeg; call it before reaping, while its group id is still reserved."""
+    with _ffmpeg_processes_lock:
+        _ffmpeg_processes.discard(process)
+    if job is not None:
+        with jobs_lock:
+            if process in job["processes"]:
+                job["processes"].remove(process)
 
-@app.route('/outputs/<filename>')
-def serve_output_video(filename):
-    """Serves the generated video files from the output directory."""
-    logging.info(f"Serving output file: {filename}")
+
+def kill_process_group(process):
     try:
-        return send_from_directory(app.config['OUTPUT_FOLDER'], filename, as_attachment=False)
-    except FileNotFoundError:
-        logging.error(f"Requested output file not found: {filename}")
-        return jsonify({"error": "File not found"}), 404
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass  # already exited
 
 
-@app.route('/health')
-def health_check():
-    """Health check endpoint for Google Cloud Run."""
-    try:
-        # Quick check that FFMPEG is available
-        result = subprocess.run(['ffmpeg', '-version'], 
-                              capture_output=True, 
-                              text=True, 
-                              timeout=5)
-        if result.returncode == 0:
-            return jsonify({"status": "healthy", "ffmpeg": "available"}), 200
-        else:
-            return jsonify({"status": "unhealthy", "error": "ffmpeg not available"}), 500
-    except Exception as e:
-        return jsonify({"status": "unhealthy", "error": str(e)}), 500
+@atexit.register
+def kill_running_ffmpeg():
+    """ffmpeg runs in its own session, so it would otherwise outlive a worker that exits mid-encode."""
+    with _ffmpeg_processes_lock:
+        for process in _ffmpeg_processes:
+            kill_process_group(process)
+
+
+def run_ffmpeg(command, on_progress=None, label='other', job=None):
+    """
+    Runs an ffmpeg command that was built with '-progress pipe:1', calling
+    on_progress(snapshot) for each progress block as it arrives. stderr is spooled to
+    a temporary file rather than held in memory. Returns (returncode, stderr_text).
+    The process is reaped with os.wait4 so its wall time, CPU time and peak RSS are
+    recorded under the metrics method label. Cancelling job kills the process.
+    """
+    with tempfile.TemporaryFile() as stderr_file:
+        started = time.perf_counter()
+        process = start_ffmpeg(command, job, stdout=subprocess.PIPE, stderr=stderr_file, stdin=subprocess.DEVNULL)
+        try:
+            for snapshot in read_ffmpeg_progress(process.stdout):
+                if on_progress:
+                    on_progress(snapshot)
+        finally:
+            process.stdout.close()
+            release_ffmpeg(process, job)
+            returncode = reap_ffmpeg(process, started, label)
+        stderr_file.seek(0)
+        stderr_text = stderr_file.read().decode('utf-8', 'replace')
+    return returncode, stderr_text
+
+
+def reap_ffmpeg(process, started, label):
+    """
+    Waits for an ffmpeg process with os.wait4 and records its wall time (since the
+    perf_counter value started), CPU time and peak RSS under label. Returns the exit code.
+    """
+    _, status, usage = os.wait4(process.pid, 0)
+    returncode = process.returncode = os.waitstatus_to_exitcode(status)
+    metrics.observe('ffmpeg_seconds', time.perf_counter() - started, method=label)
+    metrics.observe('ffmpeg_cpu_seconds', usage.ru_utime + usage.ru_stime, method=label)
+    metrics.observe('ffmpeg_max_rss_bytes', usage.ru_maxrss * 1024, method=label)  # ru_maxrss is KiB on Linux
+    metrics.inc('ffmpeg_runs_total', method=label, outcome='ok' if returncode == 0 else 'error')
+    return returncode
+
+
+# --- Thumbnails ---
+# An optional sprite sheet of evenly spaced comparison frames plus a WebVTT track that
+# points each time range at its tile (#xywh media fragments), for scrubbing previews.
+# The sheet is a branch of the graph that encodes the output, so it costs no extra decode.
+
+def thumbnail_keys(cache_key):
+    """Result cache keys of the sprite sheet and WebVTT track rendered alongside an output."""
+    return tuple(hashlib.sha256(f"{cache_key}:{kind}".encode('utf-8')).hexdigest() for kind in ('sprite', 'thumbnails'))
+
+
+def thumbnail_filenames(cache_key):
+    """(sprite sheet, WebVTT track) filenames for an output's cache key."""
+    sprite_key, track_key = thumbnail_keys(cache_key)
+    return f"{sprite_key}_sprite.jpg", f"{track_key}_thumbnails.vtt"
+
+
+def comparison_frame_size(method, info1, info2, height):
+    """Approximate (width, height) of a method's frames when both inputs are scaled to height."""
+    widths = [round(info["width"] * height / info["height"] / 2) * 2 if info and info["width"] and info["height"]
+              else round(height * 16 / 9 / 2) * 2 for info in (info1, info2)]
+    if method == 'side_by_side':
+        return widths[0] + widths[1], height
+    if method == 'vertical_stack':
+        return widths[0], height * 2
+    return widths[0], height
+
+
+def plan_thumbnails(output_duration, frame_width, frame_height):
+    """
+    Sprite sheet layout for an output of output_duration seconds: one tile every
+    interval seconds (at most THUMBNAIL_MAX_COUNT tiles), THUMBNAIL_WIDTH wide with
+    the frame's aspect ratio, THUMBNAIL_COLUMNS per row. None if the duration is unknown.
+    """
+    if not output_duration or not frame_width or not frame_height:
+        return None
+    interval = max(THUMBNAIL_MIN_INTERVAL_SECONDS, output_duration / THUMBNAIL_MAX_COUNT)
+    count = max(1, math.ceil(output_duration / interval - 1e-6))
+    columns = min(THUMBNAIL_COLUMNS, count)
+    return {
+        "duration": output_duration,
+        "interval": interval,
+        "count": count,
+        "width": THUMBNAIL_WIDTH,
+        "height": max(2, round(THUMBNAIL_WIDTH * frame_height / frame_width / 2) * 2),
+        "columns": columns,
+        "rows": math.ceil(count / columns),
+    }
+
+
+def get_thumbnail_filter(plan):
+    """Filter chain turning an output's frames into its sprite sheet (a single tiled frame)."""
+    return (f"fps=fps=1/{plan['interval']:.6f},scale=w={plan['width']}:h={plan['height']}:flags=fast_bilinear,"
+            f"tile={plan['columns']}x{plan['rows']},format=yuvj420p")
+
+
+def format_vtt_timestamp(seconds):
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    return f"{hours:02d}:{minutes:02d}:{milliseconds / 1000:06.3f}"
+
+
+def write_thumbnail_track(path, sprite_filename, plan):
+    """Writes the WebVTT track mapping each interval of the output to its tile of the sprite sheet."""
+    cues = ["WEBVTT", ""]
+    for index in range(plan["count"]):
+        start = index * plan["interval"]
+        end = min(start + plan["interval"], plan["duration"])
+        x, y = index % plan["columns"] * plan["width"], index // plan["columns"] * plan["height"]
+        cues += [f"{format_vtt_timestamp(start)} --> {format_vtt_timestamp(end)}",
+                 f"{sprite_filename}#xywh={x},{y},{plan['width']},{plan['height']}", ""]
+    with open(path, 'w') as track_file:
+        track_file.write("\n".join(cues))
+
+
+# --- Raw Frame Backend ---
+# ffmpeg decodes, aligns and scales both inputs once and writes them stacked as raw
+# frames to a pipe. NumPy kernels compare each frame pair into preallocated buffers, and
+# one ffmpeg process per output encodes the results from its stdin. Kernels work plane by
+# plane like ffmpeg's blend filter. The filter graph tints with colorbalance, which only
+# takes RGB, so its tinted blends run on RGB planes; tinted pairs therefore come from a
+# second decoder as gbrp frames, and their encoders do the conversion (and the luma boost)
+# exactly as the filter graph would. color_channel_mix and the raw-only methods (heatmap,
+# threshold_mask, channel_difference) work on yuv420p.
+
+RAW_FRAME_PROGRESS_SECONDS = 0.5  # Minimum interval between progress updates
+MASK_YUV = (81, 90, 240)  # Pure red (BT.601, limited range) marks changed pixels
+
+
+def _rgb_to_yuv(red, green, blue):
+    """BT.601 limited range conversion of 0-255 RGB values (scalars or arrays)."""
+    return (16 + (65.481 * red + 128.553 * green + 24.966 * blue) / 255,
+            128 + (-37.797 * red - 74.203 * green + 112.0 * blue) / 255,
+            128 + (112.0 * red - 93.786 * green - 18.214 * blue) / 255)
+
+
+def _build_heatmap_lut():
+    """Y, U and V lookup tables mapping a luma difference to black-blue-red-yellow-white (x4 boosted)."""
+    stops = np.array([0.0, 0.25, 0.5, 0.75, 1.0])
+    colors = np.array([[0, 0, 0], [0, 0, 255], [255, 0, 0], [255, 255, 0], [255, 255, 255]], dtype=np.float64)
+    level = np.minimum(np.arange(256) * 4, 255) / 255.0
+    rgb = [np.interp(level, stops, colors[:, channel]) for channel in range(3)]
+    return [np.clip(np.round(plane), 0, 255).astype(np.uint8) for plane in _rgb_to_yuv(*rgb)]
+
+
+BOOST_LUT = np.minimum(np.arange(256) * 4, 255).astype(np.uint8) if np is not None else None  # lutyuv=y=val*4
+HEATMAP_LUT = _build_heatmap_lut() if np is not None else None
+
+
+def raw_plane_shapes(width, height, pix_fmt='yuv420p'):
+    """(height, width) of the three planes of a raw frame: yuv420p (Y, U, V) or gbrp (G, B, R)."""
+    chroma_shape = (height // 2, width // 2) if pix_fmt == 'yuv420p' else (height, width)
+    return [(height, width), chroma_shape, chroma_shape]
+
+
+def raw_frame_bytes(width, height, pix_fmt='yuv420p'):
+    return sum(rows * columns for rows, columns in raw_plane_shapes(width, height, pix_fmt))
+
+
+class RawFrameScratch:
+    """Per-run work buffers shaped like one frame's planes, so kernels never allocate."""
+
+    def __init__(self, width, height, pix_fmt='yuv420p'):
+        luma_shape, chroma_shape = (height, width), (height // 2, width // 2)
+        self.planes = [np.empty(shape, np.uint8) for shape in raw_plane_shapes(width, height, pix_fmt)]
+        self.luma_diff = np.empty(luma_shape, np.uint8)
+        self.chroma_diff = np.empty(chroma_shape, np.uint8)
+        self.luma_mask = np.empty(luma_shape, bool)
+        self.chroma_mask = np.empty(chroma_shape, bool)
+        self.wide = np.empty(chroma_shape, np.int16)
+
+
+def raw_frame_planes(buffer, width, height, slots=1, pix_fmt='yuv420p'):
+    """Splits a buffer of `slots` vertically stacked raw frames into per-slot 3-plane array views."""
+    planes, offset = [], 0
+    for rows, columns in raw_plane_shapes(width, height, pix_fmt):
+        planes.append((rows, np.frombuffer(buffer, np.uint8, rows * columns * slots, offset)
+                       .reshape(slots * rows, columns)))
+        offset += rows * columns * slots
+    return [tuple(plane[slot * rows:(slot + 1) * rows] for rows, plane in planes) for slot in range(slots)]
+
+
+def _absolute_difference(a, b, out, scratch):
+    np.maximum(a, b, out=out)
+    np.minimum(a, b, out=scratch)
+    np.subtract(out, scratch, out=out)
+
+
+def _average(a, b, out, scratch):
+    # (a + b) // 2 without widening: a//2 + b//2 + (a & b & 1)
+    np.right_shift(a, 1, out=out)
+    np.right_shift(b, 1, out=scratch)
+    np.add(out, scratch, out=out)
+    np.bitwise_and(a, b, out=scratch)
+    np.bitwise_and(scratch, 1, out=scratch)
+    np.add(out, scratch, out=out)
+
+
+def _max_pool_chroma(luma, out):
+    """2x2 max of a luma-sized plane into a chroma-sized plane."""
+    np.maximum(luma[0::2, 0::2], luma[1::2, 0::2], out=out)
+    np.maximum(out, luma[0::2, 1::2], out=out)
+    np.maximum(out, luma[1::2, 1::2], out=out)
+
+
+def kernel_difference(a, b, out, scratch, options):
+    for plane in range(3):
+        _absolute_difference(a[plane], b[plane], out[plane], scratch.planes[plane])
+
+
+def kernel_subtract(a, b, out, scratch, options):
+    for plane in range(3):
+        np.maximum(a[plane], b[plane], out=out[plane])  # max(a - b, 0) == max(a, b) - b
+        np.subtract(out[plane], b[plane], out=out[plane])
+
+
+def kernel_average(a, b, out, scratch, options):
+    for plane in range(3):
+        _average(a[plane], b[plane], out[plane], scratch.planes[plane])
+
+
+def kernel_channel_mix(a, b, out, scratch, options):
+    # Same as blend c0_expr='A':c1_expr='(A+B)/2':c2_expr='B'
+    np.copyto(out[0], a[0])
+    _average(a[1], b[1], out[1], scratch.planes[1])
+    np.copyto(out[2], b[2])
+
+
+def kernel_heatmap(a, b, out, scratch, options):
+    _absolute_difference(a[0], b[0], scratch.luma_diff, scratch.planes[0])
+    np.take(HEATMAP_LUT[0], scratch.luma_diff, out=out[0])
+    _max_pool_chroma(scratch.luma_diff, scratch.chroma_diff)
+    np.take(HEATMAP_LUT[1], scratch.chroma_diff, out=out[1])
+    np.take(HEATMAP_LUT[2], scratch.chroma_diff, out=out[2])
+
+
+def kernel_threshold_mask(a, b, out, scratch, options):
+    threshold = options.get("diff_threshold", RAW_MASK_THRESHOLD)
+    _absolute_difference(a[0], b[0], scratch.luma_diff, scratch.planes[0])
+    # Greyscale, dimmed reference with changed pixels painted red
+    np.right_shift(a[0], 1, out=out[0])
+    np.add(out[0], 8, out=out[0])
+    np.greater(scratch.luma_diff, threshold, out=scratch.luma_mask)
+    np.copyto(out[0], MASK_YUV[0], where=scratch.luma_mask)
+    _max_pool_chroma(scratch.luma_diff, scratch.chroma_diff)
+    np.greater(scratch.chroma_diff, threshold, out=scratch.chroma_mask)
+    for plane in (1, 2):
+        out[plane].fill(128)
+        np.copyto(out[plane], MASK_YUV[plane], where=scratch.chroma_mask)
+
+
+def kernel_channel_difference(a, b, out, scratch, options):
+    # Luma: boosted absolute difference. Chroma: signed difference x2 around neutral grey, so colour shifts show as colour
+    _absolute_difference(a[0], b[0], scratch.luma_diff, scratch.planes[0])
+    np.take(BOOST_LUT, scratch.luma_diff, out=out[0])
+    for plane in (1, 2):
+        np.subtract(a[plane], b[plane], out=scratch.wide, dtype=np.int16)
+        np.multiply(scratch.wide, 2, out=scratch.wide)
+        np.add(scratch.wide, 128, out=scratch.wide)
+        np.clip(scratch.wide, 0, 255, out=scratch.wide)
+        np.copyto(out[plane], scratch.wide, casting='unsafe')
+
+
+# method -> kernel; built-in methods keep their tint (TINTING_METHODS) and boost (BRIGHTNESS_BOOST_METHODS)
+RAW_FRAME_KERNELS = {
+    'difference_blend': kernel_difference,
+    'subtract_blend': kernel_subtract,
+    'opacity_blend': kernel_average,
+    'color_channel_mix': kernel_channel_mix,
+    'heatmap': kernel_heatmap,
+    'threshold_mask': kernel_threshold_mask,
+    'channel_difference': kernel_channel_difference,
+}
+
+
+def raw_frame_variant(method, backend, options):
+    """Cache key variant of a video method: which backend rendered it and, for masks, the threshold."""
+    if backend != 'numpy':
+        return {}
+    variant = {} if method in RAW_FRAME_METHODS else {"backend": "numpy"}
+    if method in TINTING_METHODS:
+        variant["planes"] = "gbrp"  # tinted blends on RGB planes, as in the filter graph
+    if method == 'threshold_mask':
+        variant["threshold"] = options.get("diff_threshold", RAW_MASK_THRESHOLD)
+    return variant
+
+
+def comparison_backend(methods, options=None):
+    """'numpy' if the video methods of a job run on the raw frame backend, else 'ffmpeg'."""
+    video_methods = [method for method in methods if method not in ANALYSIS_METHODS]
+    if any(method in RAW_FRAME_METHODS for method in video_methods):
+        return 'numpy'
+    requested = (options or {}).get("backend")
+    if requested:
+        return requested
+    if DEFAULT_COMPARISON_BACKEND == 'numpy' and np is not None and video_methods and \
+            all(method in RAW_FRAME_KERNELS for method in video_methods):
+        return 'numpy'
+    return 'ffmpeg'
+
+
+def raw_frame_size(info, height):
+    """Even frame size of an input scaled to height, as ffmpeg's scale=w=-2 computes it."""
+    width = int(round(info["width"] * height / info["height"] / 2)) * 2 if info and info["height"] else height * 16 // 9
+    return max(2, width), height
+
+
+def raw_pixel_format(tinted):
+    """Raw frame format of a decode variant: tinted pairs are RGB, like the filter graph's tinted blends."""
+    return 'gbrp' if tinted else 'yuv420p'
+
+
+def get_raw_decode_command(input1, input2, width, height, tinted=False, alignment=None):
+    """
+    ffmpeg command writing both inputs, aligned and scaled to width x height, to stdout
+    as one vertically stacked raw frame per pair (input 0 above input 1): yuv420p, or
+    tinted with TINT_FILTERS as gbrp.
+    """
+    pix_fmt = raw_pixel_format(tinted)
+    scale = f"scale=w={width}:h={height}:flags={scaler_flags_for(height)}"
+    filter_complex_parts = []
+    for index in range(2):
+        # Same order as the filter graph: scale in the source format, then tint (RGB only)
+        prepare_filters = get_alignment_filters(alignment) + [scale] + ([TINT_FILTERS[index]] if tinted else [])
+        filter_complex_parts.append(f"[{index}:v]{','.join(prepare_filters + [f'format={pix_fmt}'])}[raw{index}]")
+    filter_complex_parts.append("[raw0][raw1]vstack=inputs=2[stacked]")
+    return [FFMPEG_PATH, '-nostats', '-v', 'error',
+            *get_input_options(0, alignment=alignment), '-i', input1,
+            *get_input_options(1, alignment=alignment), '-i', input2,
+            '-filter_complex', ";".join(filter_complex_parts),
+            '-map', '[stacked]', '-f', 'rawvideo', '-pix_fmt', pix_fmt, 'pipe:1']
+
+
+def get_raw_encode_command(output, width, height, fps, playback_speed=1.0, output_height=None,
+                           encoder_settings=None, output_options=None, thumbnail_output=None, pix_fmt='yuv420p',
+                           boost=False):
+    """
+    ffmpeg command encoding raw frames (pix_fmt) of width x height read from stdin.
+    boost applies the brightness boost of BRIGHTNESS_BOOST_METHODS, as the filter graph does.
+    thumbnail_output is (sprite path, plan): the frames are also tiled into a sprite sheet.
+    """
+    filters = ["lutyuv=y=val*4"] if boost else []
+    if not math.isclose(playback_speed, 1.0):
+        filters.append(f"setpts={1.0 / playback_speed}*PTS")
+    if output_height and output_height < height:
+        filters.append(f"scale=w=-2:h={output_height}:flags={scaler_flags_for(output_height)}")
+    command = [FFMPEG_PATH, '-nostats', '-v', 'error', '-y',
+               '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-s', f"{width}x{height}", '-r', f"{fps or 30.0:.6f}",
+               '-i', 'pipe:0']
+    if thumbnail_output:
+        sprite_path, plan = thumbnail_output
+        command += ['-filter_complex', f"[0:v]{','.join(filters) or 'null'},split=2[enc][thumbnail_src];"
+                                       f"[thumbnail_src]{get_thumbnail_filter(plan)}[sprite]", '-map', '[enc]']
+    elif filters:
+        command += ['-vf', ",".join(filters)]
+    command += [*(encoder_settings or ENCODER_SETTINGS), '-an', *(output_options or []), output]
+    if thumbnail_output:
+        command += ['-map', '[sprite]', *THUMBNAIL_ENCODER_SETTINGS, sprite_path]
+    return command
+
+
+def raw_tint_variants(methods):
+    """Decode variants the methods need: untinted (False) and/or tinted (True) input pairs."""
+    return sorted({method in TINTING_METHODS for method in methods})
+
+
+def _read_frame(stream, view):
+    """Fills view from stream; False at end of stream (a trailing partial frame is dropped)."""
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            return False
+        filled += count
+    return True
+
+
+def run_raw_frame_comparison(methods, input1, input2, output_paths, width, height, fps, playback_speed=1.0,
+                             encoder_settings=None, output_heights=None, output_options=None, options=None,
+                             alignment=None, on_progress=None, thumbnail_output=None, job=None):
+    """
+    Renders methods (outputs[i] receives methods[i], at output_heights[i]) with the raw
+    frame backend: one decode process per variant (see raw_tint_variants), one NumPy
+    kernel call per method and frame into preallocated buffers, one encode process per output. thumbnail_output is
+    (output index, sprite path, plan): that output's encoder also writes a sprite sheet.
+    Returns (returncode, stderr_text) like run_ffmpeg; cancelling job kills every process.
+    """
+    options = options or {}
+    playback_speed = parse_playback_speed(playback_speed)
+    unique_methods = list(dict.fromkeys(methods))
+    # One decoder per variant (yuv420p and/or tinted gbrp), each writing its own pipe
+    variants = {}
+    for tinted in raw_tint_variants(methods):
+        pix_fmt = raw_pixel_format(tinted)
+        input_buffer = bytearray(raw_frame_bytes(width, height, pix_fmt) * 2)
+        variants[tinted] = {"pix_fmt": pix_fmt, "buffer": input_buffer,
+                            "slots": raw_frame_planes(input_buffer, width, height, 2, pix_fmt),
+                            "scratch": RawFrameScratch(width, height, pix_fmt),
+                            "command": get_raw_decode_command(input1, input2, width, height, tinted, alignment)}
+    output_buffers, output_planes = {}, {}
+    for method in unique_methods:
+        pix_fmt = raw_pixel_format(method in TINTING_METHODS)
+        output_buffers[method] = bytearray(raw_frame_bytes(width, height, pix_fmt))
+        output_planes[method] = raw_frame_planes(output_buffers[method], width, height, 1, pix_fmt)[0]
+
+    for variant in variants.values():
+        logging.info(f"Running raw frame backend ({', '.join(unique_methods)}): {' '.join(variant['command'])}")
+    with tempfile.TemporaryFile() as stderr_file:
+        started = time.perf_counter()
+        encoders = []
+        for index, (method, output_path, output_height) in enumerate(
+                zip(methods, output_paths, output_heights or [None] * len(methods))):
+            sprite = thumbnail_output[1:] if thumbnail_output and thumbnail_output[0] == index else None
+            command = get_raw_encode_command(output_path, width, height, fps, playback_speed, output_height,
+                                             encoder_settings, output_options, sprite,
+                                             raw_pixel_format(method in TINTING_METHODS),
+                                             boost=method in BRIGHTNESS_BOOST_METHODS)
+            encoders.append((method, start_ffmpeg(command, job, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                                  stderr=stderr_file)))
+        decoders = [start_ffmpeg(variant["command"], job, stdout=subprocess.PIPE, stderr=stderr_file,
+                                 stdin=subprocess.DEVNULL) for variant in variants.values()]
+        frames, kernel_seconds, last_progress = 0, 0.0, 0.0
+        try:
+            while all([_read_frame(decoder.stdout, memoryview(variant["buffer"]))
+                       for decoder, variant in zip(decoders, variants.values())]):
+                kernel_started = time.perf_counter()
+                for method in unique_methods:
+                    variant = variants[method in TINTING_METHODS]
+                    RAW_FRAME_KERNELS[method](variant["slots"][0], variant["slots"][1], output_planes[method],
+                                              variant["scratch"], options)
+                kernel_seconds += time.perf_counter() - kernel_started
+                for method, encoder in encoders:
+                    encoder.stdin.write(output_buffers[method])
+                frames += 1
+                elapsed = time.perf_counter() - started
+                if on_progress and elapsed - last_progress >= RAW_FRAME_PROGRESS_SECONDS:
+                    last_progress = elapsed
+                    on_progress({"frame": frames, "fps": round(frames / elapsed, 2),
+                                 "out_time": frames / (fps or 30.0) / playback_speed, "speed": None, "done": False})
+        except BrokenPipeError:
+            logging.error("A raw frame encoder exited early.")
+            for decoder in decoders:
+                decoder.kill()
+        finally:
+            for decoder in decoders:
+                decoder.stdout.close()
+            for _, encoder in encoders:
+                try:
+                    encoder.stdin.close()
+                except BrokenPipeError:
+                    pass
+            for process in decoders + [encoder for _, encoder in encoders]:
+                release_ffmpeg(process, job)
+            returncodes = [reap_ffmpeg(decoder, started, 'numpy_decode') for decoder in decoders]
+            returncodes += [reap_ffmpeg(encoder, started, f"numpy:{method}") for method, encoder in encoders]
+            metrics.observe('stage_seconds', kernel_seconds, stage='raw_frame_kernels')
+        stderr_file.seek(0)
+        stderr_text = stderr_file.read().decode('utf-8', 'replace')
+    if on_progress:
+        elapsed = time.perf_counter() - started
+        on_progress({"frame": frames, "fps": round(frames / elapsed, 2) if elapsed > 0 else 0.0,
+                     "out_time": frames / (fps or 30.0) / playback_speed, "speed": None, "done": True})
+    returncode = next((code for code in returncodes if code != 0), 0)
+    if returncode == 0 and frames == 0:
+        return 1, stderr_text or "No frames decoded"
+    return returncode, stderr_text
+
+
+# --- Frame Metrics ---
+# Per-frame PSNR, SSIM and mean absolute luma difference computed by ffmpeg filters
+# into null outputs: a cheap "do these renders diverge, and where?" check that
+# never runs the video encoder.
+
+FRAME_METRIC_FILTERS = {
+    'psnr': "psnr=stats_file='{stats_file}'",
+    'ssim': "ssim=stats_file='{stats_file}'",
+    'mad': "blend=all_mode=difference,signalstats,metadata=mode=print:key=lavfi.signalstats.YAVG:file='{stats_file}'",
+}
+FRAME_METRIC_PATTERNS = {
+    'psnr': re.compile(r'psnr_avg:(\S+)'),
+    'ssim': re.compile(r'All:(\S+)'),
+    'mad': re.compile(r'lavfi\.signalstats\.YAVG=(\S+)'),
+}
+PSNR_IDENTICAL = 100.0  # Reported instead of 'inf' for identical frames
+
+
+def get_metrics_ffmpeg_command(input1, input2, stats_files, target_height=None, target_width=None, alignment=None):
+    """
+    Constructs an FFMPEG command that aligns and scales both inputs to the same size,
+    fans them out to one filter per requested metric (stats_files maps metric -> stats
+    path) and discards the frames into null outputs.
+    """
+    filter_complex_parts = []
+    video_inputs = ["[0:v]", "[1:v]"]
+    prepare_filters = get_alignment_filters(alignment)
+    if target_height:
+        prepare_filters.append(f"scale=w={target_width or -2}:h={target_height}")
+    if prepare_filters:
+        filter_complex_parts.append(f"{video_inputs[0]}{','.join(prepare_filters)}[scaled0]")
+        filter_complex_parts.append(f"{video_inputs[1]}{','.join(prepare_filters)}[scaled1]")
+        video_inputs = ["[scaled0]", "[scaled1]"]
+
+    metric_names = list(stats_files)
+    copies = [_fan_out(filter_complex_parts, tag, len(metric_names), f"copy{index}")
+              for index, tag in enumerate(video_inputs)]
+    command = [FFMPEG_PATH, '-nostats', '-progress', 'pipe:1', *get_input_options(0, alignment=alignment), '-i', input1,
+               *get_input_options(1, alignment=alignment), '-i', input2]
+    output_groups = []
+    for index, metric in enumerate(metric_names):
+        metric_filter = FRAME_METRIC_FILTERS[metric].format(stats_file=stats_files[metric])
+        filter_complex_parts.append(f"{copies[0][index]}{copies[1][index]}{metric_filter}[{metric}_out]")
+        output_groups.extend(['-map', f"[{metric}_out]", '-f', 'null', '-'])
+    return command + ['-filter_complex', ";".join(filter_complex_parts)] + output_groups
+
+
+def parse_metric_stats(metric, stats_path):
+    """Reads one per-frame series (in frame order) from an ffmpeg stats/metadata file."""
+    series = []
+    pattern = FRAME_METRIC_PATTERNS[metric]
+    with open(stats_path) as stats_file:
+        for line in stats_file:
+            match = pattern.search(line)
+            if not match:
+                continue
+            try:
+                value = float(match.group(1))
+            except ValueError:
+                continue
+            if math.isinf(value):
+                value = PSNR_IDENTICAL
+            series.append(round(value, 4))
+    return series
+
+
+def compute_frame_metrics(input1, input2, target_height=TARGET_HEIGHT, target_width=None,
+                          metric_names=('psnr', 'ssim', 'mad'), on_progress=None, alignment=None, label='frame_metrics',
+                          job=None):
+    """
+    Runs the metrics graph and returns (series, error): series maps each metric to a
+    list of per-frame values, error is None on success or ffmpeg's stderr tail.
+    label is the metrics method label of the ffmpeg pass, which belongs to job.
+    """
+    stats_dir = tempfile.mkdtemp(prefix='.metrics_', dir=app.config['OUTPUT_FOLDER'])
+    try:
+        stats_files = {metric: os.path.join(stats_dir, f"{metric}.log") for metric in metric_names}
+        command = get_metrics_ffmpeg_command(input1, input2, stats_files, target_height, target_width, alignment)
+        logging.info(f"Running FFMPEG metrics command: {' '.join(command)}")
+        returncode, stderr_text = run_ffmpeg(command, on_progress=on_progress, label=label, job=job)
+        if returncode != 0:
+            return None, stderr_text[-500:]
+        return {metric: parse_metric_stats(metric, path) for metric, path in stats_files.items()}, None
+    finally:
+        shutil.rmtree(stats_dir, ignore_errors=True)
+
+
+def summarize_frame_metrics(series, fps=None, top_n=METRICS_TOP_N):
+    """
+    Builds the frame_metrics report: the per-frame series, their mean/min/max, and
+    the top_n most divergent frames ranked by mean absolute difference (or, when
+    that is unavailable, by lowest SSIM/PSNR).
+    """
+    frame_count = min(len(values) for values in series.values()) if series else 0
+    summary = {}
+    for metric, values in series.items():
+        values = values[:frame_count]
+        if values:
+            summary[metric] = {"mean": round(sum(values) / len(values), 4), "min": min(values), "max": max(values)}
+
+    if 'mad' in series:
+        ranking = sorted(range(frame_count), key=lambda frame: series['mad'][frame], reverse=True)
+    else:
+        metric = 'ssim' if 'ssim' in series else 'psnr'
+        ranking = sorted(range(frame_count), key=lambda frame: series[metric][frame])
+    top_divergent = []
+    for frame in ranking[:top_n]:
+        entry = {"frame": frame, "time": round(frame / fps, 4) if fps else None}
+        entry.update({metric: values[frame] for metric, values in series.items()})
+        top_divergent.append(entry)
+
+    return {
+        "frames": frame_count,
+        "fps": fps,
+        "summary": summary,
+        "top_divergent": top_divergent,
+        "series": {metric: values[:frame_count] for metric, values in series.items()},
+    }
+
+
+def find_changed_ranges(differences, fps, threshold, padding_seconds=0.0):
+    """
+    Turns a per-frame difference series into frame ranges where it exceeds threshold,
+    padded by padding_seconds on both sides; ranges that touch after padding are merged.
+    Returns a list of dicts with first_frame, frame_count, changed_frames and the
+    peak/mean difference of the changed frames.
+    """
+    padding = int(round(padding_seconds * fps))
+    ranges = []
+    for frame, value in enumerate(differences):
+        if value <= threshold:
+            continue
+        start, end = max(0, frame - padding), min(len(differences), frame + padding + 1)
+        if ranges and start <= ranges[-1]["end"]:
+            ranges[-1]["end"] = max(ranges[-1]["end"], end)
+            ranges[-1]["values"].append(value)
+        else:
+            ranges.append({"start": start, "end": end, "values": [value]})
+    return [{
+        "first_frame": changed["start"],
+        "frame_count": changed["end"] - changed["start"],
+        "changed_frames": len(changed["values"]),
+        "peak_difference": max(changed["values"]),
+        "mean_difference": round(sum(changed["values"]) / len(changed["values"]), 4),
+    } for changed in ranges]
+
+
+def highlight_reel_key(cache_key):
+    """Cache key of the highlight reel that belongs to a changed_segments index."""
+    return hashlib.sha256(f"{cache_key}:reel".encode('utf-8')).hexdigest()
+
+
+# --- Alignment ---
+# Inputs with different frame rates, variable timing or a start offset are normalized
+# before the comparison filters, which otherwise pair frames by timestamp and
+# duplicate or drop frames internally.
+
+def plan_alignment(info1, info2, time_offset=0.0):
+    """
+    Decides how two inputs (get_video_info results) are normalized before comparison.
+    time_offset is how many seconds input 2 lags input 1 (negative when it leads).
+    Returns a dict with the seek applied to each input ("offsets"), the common constant
+    frame rate ("fps", None when both inputs already share one) and whether timestamps
+    are reset to start at zero ("reset_pts").
+    """
+    fps = None
+    if info1 and info2 and info1["fps"] and info2["fps"]:
+        if abs(info1["fps"] - info2["fps"]) > ALIGN_FPS_TOLERANCE or info1["vfr"] or info2["vfr"]:
+            # Resample to the lower rate so no compared frame is a duplicate
+            fps = round(min(info1["fps"], info2["fps"]), 6)
+    start_delays = [info["start_delay"] if info else 0.0 for info in (info1, info2)]
+    return {
+        "offsets": [max(0.0, -time_offset), max(0.0, time_offset)],
+        "fps": fps,
+        "reset_pts": bool(fps or time_offset or abs(start_delays[0] - start_delays[1]) > 0.001),
+        "time_offset": time_offset,
+    }
+
+
+def alignment_is_identity(alignment):
+    """True if an alignment plan leaves both inputs untouched."""
+    return not alignment or not (alignment["fps"] or alignment["reset_pts"] or any(alignment["offsets"]))
+
+
+def aligned_video_info(info, alignment, index):
+    """get_video_info result for an input as the comparison sees it after alignment."""
+    if not info or alignment_is_identity(alignment):
+        return info
+    aligned = dict(info, fps=alignment["fps"] or info["fps"], vfr=False, start_delay=0.0)
+    if info["duration"]:
+        aligned["duration"] = max(0.0, info["duration"] - alignment["offsets"][index])
+    return aligned
+
+
+def get_input_options(index, start_time=None, input_duration=None, alignment=None):
+    """Seek (-ss) and duration (-t) input options for input index of a comparison."""
+    seek = (start_time or 0.0) + (alignment["offsets"][index] if alignment else 0.0)
+    options = ['-ss', f"{seek:.6f}"] if seek else []
+    if input_duration:
+        options += ['-t', f"{input_duration:.6f}"]
+    return options
+
+
+def get_alignment_filters(alignment):
+    """Per-input filters (timestamp reset, common frame rate) applied before scaling."""
+    filters = []
+    if alignment and alignment["reset_pts"]:
+        filters.append("setpts=PTS-STARTPTS")
+    if alignment and alignment["fps"]:
+        filters.append(f"fps=fps={alignment['fps']:.6f}")
+    return filters
+
+
+def compute_luma_signatures(input1, input2, fps, seconds=ALIGN_SIGNATURE_SECONDS, job=None):
+    """
+    Decodes the first seconds of both inputs once, at fps and ALIGN_SIGNATURE_WIDTH pixels
+    wide, and returns (signatures, error): the mean luma of every frame of each input.
+    """
+    stats_dir = tempfile.mkdtemp(prefix='.align_', dir=app.config['OUTPUT_FOLDER'])
+    try:
+        stats_files = [os.path.join(stats_dir, f"luma{index}.log") for index in range(2)]
+        signature_filter = (f"setpts=PTS-STARTPTS,fps=fps={fps:.6f},"
+                            f"scale=w={ALIGN_SIGNATURE_WIDTH}:h=-2:flags=fast_bilinear,signalstats,"
+                            "metadata=mode=print:key=lavfi.signalstats.YAVG:file='{stats_file}'")
+        filter_complex = ";".join(f"[{index}:v]{signature_filter.format(stats_file=path)}[luma{index}]"
+                                  for index, path in enumerate(stats_files))
+        command = [FFMPEG_PATH, '-nostats', '-progress', 'pipe:1',
+                   '-t', f"{seconds:.6f}", '-i', input1, '-t', f"{seconds:.6f}", '-i', input2,
+                   '-filter_complex', filter_complex,
+                   '-map', '[luma0]', '-f', 'null', '-', '-map', '[luma1]', '-f', 'null', '-']
+        logging.info(f"Running FFMPEG luma signature command: {' '.join(command)}")
+        returncode, stderr_text = run_ffmpeg(command, label='alignment', job=job)
+        if returncode != 0:
+            return None, stderr_text[-500:]
+        # Same YAVG metadata format as the 'mad' frame metric
+        return [parse_metric_stats('mad', path) for path in stats_files], None
+    finally:
+        shutil.rmtree(stats_dir, ignore_errors=True)
+
+
+def estimate_time_offset(signature1, signature2, fps, max_offset_seconds=ALIGN_MAX_OFFSET_SECONDS):
+    """
+    Finds the lag at which two luma signatures match best, correlating their
+    frame-to-frame changes (robust to brightness and contrast differences). Returns
+    (time_offset, correlation) with time_offset in seconds (positive when input 2 lags
+    input 1), or (0.0, correlation) when no lag matches at least ALIGN_MIN_CORRELATION.
+    """
+    changes1 = [after - before for before, after in zip(signature1, signature1[1:])]
+    changes2 = [after - before for before, after in zip(signature2, signature2[1:])]
+    min_overlap = max(10, min(len(changes1), len(changes2)) // 2)
+    max_lag = int(max_offset_seconds * fps)
+    best_lag, best_correlation = 0, None
+    # Smallest lags first, so ties (e.g. periodic content) resolve to the smallest offset
+    for lag in sorted(range(-max_lag, max_lag + 1), key=abs):
+        # Frame i of input 1 is paired with frame i + lag of input 2
+        first = changes1[max(0, -lag):]
+        second = changes2[max(0, lag):]
+        overlap = min(len(first), len(second))
+        if overlap < min_overlap:
+            continue
+        first, second = first[:overlap], second[:overlap]
+        mean1, mean2 = sum(first) / overlap, sum(second) / overlap
+        covariance = sum((a - mean1) * (b - mean2) for a, b in zip(first, second))
+        spread = math.sqrt(sum((a - mean1) ** 2 for a in first) * sum((b - mean2) ** 2 for b in second))
+        if spread == 0:
+            continue
+        correlation = covariance / spread
+        if best_correlation is None or correlation > best_correlation:
+            best_lag, best_correlation = lag, correlation
+    if best_correlation is None:
+        return 0.0, None
+    if best_correlation < ALIGN_MIN_CORRELATION:
+        return 0.0, round(best_correlation, 4)
+    return round(best_lag / fps, 6), round(best_correlation, 4)
+
+
+def align_job_inputs(job, info1, info2):
+    """
+    Plans the alignment of a job's inputs, detecting the time offset first when the
+    request asked for time_offset=auto. Records the plan on the job and returns it.
+    """
+    time_offset = job["options"].get("time_offset", 0.0)
+    correlation = None
+    if time_offset == 'auto':
+        time_offset = 0.0
+        fps = min(info["fps"] for info in (info1, info2)) if info1 and info2 and info1["fps"] and info2["fps"] else None
+        if fps:
+            signatures, error = compute_luma_signatures(job["input1_path"], job["input2_path"], fps, job=job)
+            if error is not None:
+                logging.warning(f"Offset detection failed (job {job['job_id']}); comparing without offset: {error}")
+            else:
+                time_offset, correlation = estimate_time_offset(signatures[0], signatures[1], fps)
+    alignment = plan_alignment(info1, info2, time_offset)
+    update_job(job, alignment=dict(alignment, correlation=correlation))
+    return alignment
+
+
+# --- Streaming Uploads ---
+# Multipart file parts are written straight into the upload folder while they
+# arrive (no Werkzeug temp spool followed by a second copy), hashed in flight,
+# and rejected as soon as their header or container probe shows they are not video.
+
+UPLOAD_HEADER_BYTES = 12  # Enough to recognise ISO BMFF, Matroska/WebM and AVI headers
+ISO_BMFF_BOX_TYPES = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot'}
+
+
+class UploadRejected(Exception):
+    """Raised while an upload is still streaming in, once it is known to be unusable."""
+
+
+def looks_like_video_header(header):
+    """Checks the leading bytes of a file against the container formats we accept."""
+    if len(header) < UPLOAD_HEADER_BYTES:
+        return False
+    if header[4:8] in ISO_BMFF_BOX_TYPES:  # mp4 / mov
+        return True
+    if header[:4] == b'\x1a\x45\xdf\xa3':  # mkv / webm (EBML)
+        return True
+    if header[:4] == b'RIFF' and header[8:12] == b'AVI ':  # avi
+        return True
+    return False
+
+
+class StreamingUpload:
+    """
+    Writable file object handed to Werkzeug's multipart parser for one file part.
+    Writes go directly to disk and into a sha256 digest; the header is validated
+    after the first UPLOAD_HEADER_BYTES and the container is probed once the
+    parser rewinds the completed part, unless the probe index already knows its content.
+    """
+
+    def __init__(self, path, filename=None):
+        self.path = path
+        self.filename = filename  # the client's name for the part
+        self.bytes_written = 0
+        self._file = open(path, 'w+b')
+        self._digest = hashlib.sha256()
+        self._header = b''
+        self._finished = False
+        self._started = time.perf_counter()
+        self._write_seconds = 0.0
+        self.sha256 = None
+        self.info = None
+
+    def write(self, data):
+        if len(self._header) < UPLOAD_HEADER_BYTES:
+            self._header += data[:UPLOAD_HEADER_BYTES - len(self._header)]
+            if len(self._header) == UPLOAD_HEADER_BYTES and not looks_like_video_header(self._header):
+                self._reject("File content is not a recognised video container")
+        self._digest.update(data)
+        self.bytes_written += len(data)
+        write_started = time.perf_counter()
+        written = self._file.write(data)
+        self._write_seconds += time.perf_counter() - write_started
+        return written
+
+    def seek(self, offset, whence=0):
+        # The multipart parser rewinds a file part exactly once, when it is complete
+        if not self._finished:
+            self._finish()
+        return self._file.seek(offset, whence)
+
+    def _finish(self):
+        self.finish_receive()
+        if self.info is None:
+            try:
+                probe = ffprobe_media(self.path)
+            except FileNotFoundError:
+                logging.warning("ffprobe not found; skipping container probe for uploads.")
+            else:
+                self.accept_probe(probe)
+
+    def finish_receive(self):
+        """
+        Ends the receive phase of a complete part: records upload metrics, checks the
+        header and looks the content hash up in the probe index (sets info on a hit).
+        """
+        self._finished = True
+        self._file.flush()
+        # receive covers the whole part as it arrived; save is the share spent writing to disk
+        metrics.observe('stage_seconds', time.perf_counter() - self._started, stage='upload_receive')
+        metrics.observe('stage_seconds', self._write_seconds, stage='upload_save')
+        metrics.inc('bytes_in_total', self.bytes_written)
+        if not looks_like_video_header(self._header):
+            self._reject("File content is not a recognised video container")
+        self.sha256 = self._digest.hexdigest()
+        remember_file_hash(self.path, self.sha256)
+        self.info = probe_index.get(self.sha256)
+
+    def accept_probe(self, probe):
+        """Validates the ffprobe output of a part the probe index did not know and records it."""
+        self.info = summarize_video_probe(probe)
+        if self.info is None:
+            self._reject("File could not be parsed as a video by ffprobe")
+        probe_index.put(self.sha256, self.info)
+
+    def _reject(self, reason):
+        self._file.close()
+        cleanup_files(self.path)
+        raise UploadRejected(reason)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class StreamingUploadRequest(Request):
+    """Request class that streams multipart file parts into UPLOAD_FOLDER."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.streamed_upload_paths = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not filename:
+            raise UploadRejected("No selected file or empty filename")
+        if not allowed_file(filename):
+            raise UploadRejected("Invalid file type. Allowed: " + ", ".join(ALLOWED_EXTENSIONS))
+        ext = filename.rsplit('.', 1)[1].lower()
+        path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}.{ext}")
+        self.streamed_upload_paths.append(path)
+        return StreamingUpload(path)
+
+
+app.request_class = StreamingUploadRequest
+
+
+# --- Result Cache ---
+# Outputs are content-addressed: the cache key covers both input hashes and every
+# parameter that influences the rendered video, so repeat requests reuse the file.
+
+_file_hash_memo = OrderedDict()  # (path, size, mtime_ns) -> sha256 hex digest
+_file_hash_memo_lock = threading.Lock()
+FILE_HASH_MEMO_SIZE = 256
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Returns the sha256 hex digest of a file, memoized on path, size and mtime."""
+    stat = os.stat(path)
+    memo_key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    with _file_hash_memo_lock:
+        if memo_key in _file_hash_memo:
+            _file_hash_memo.move_to_end(memo_key)
+            return _file_hash_memo[memo_key]
+
+    started = time.perf_counter()
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    hex_digest = digest.hexdigest()
+    metrics.observe('stage_seconds', time.perf_counter() - started, stage='hash')
+
+    with _file_hash_memo_lock:
+        _file_hash_memo[memo_key] = hex_digest
+        while len(_file_hash_memo) > FILE_HASH_MEMO_SIZE:
+            _file_hash_memo.popitem(last=False)
+    return hex_digest
+
+
+def remember_file_hash(path, hex_digest):
+    """Seeds the hash memo with a digest computed elsewhere (e.g. while streaming an upload)."""
+    stat = os.stat(path)
+    with _file_hash_memo_lock:
+        _file_hash_memo[(os.path.realpath(path), stat.st_size, stat.st_mtime_ns)] = hex_digest
+        while len(_file_hash_memo) > FILE_HASH_MEMO_SIZE:
+            _file_hash_memo.popitem(last=False)
+
+
+def compute_result_key(input1_hash, input2_hash, method, playback_speed, target_height=TARGET_HEIGHT, variant=None,
+                       encoder_settings=None):
+    """
+    Builds the content-addressed cache key for a comparison output. variant holds
+    any further request options that change the output (e.g. report size).
+    """
+    key_fields = {
+        "inputs": [input1_hash, input2_hash],
+        "method": method,
+        "playback_speed": parse_playback_speed(playback_speed),
+        "target_height": target_height,
+        "encoder": encoder_settings or ENCODER_SETTINGS,
+        "variant": variant or {},
+    }
+    return hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+CACHE_KEY_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+class DiskLRUCache:
+    """
+    Tracks cached files in a directory and evicts them least-recently-used first
+    once the total size exceeds max_bytes or an entry goes unused for max_age_seconds.
+    Files are named '<key>_<suffix>' so the index can be rebuilt after a restart.
+    Lookups and served downloads count as uses; sweep() enforces the bounds without
+    waiting for a new entry, adopts cache files written by other processes and removes
+    leftovers that are not cache files.
+    """
+
+    def __init__(self, folder, max_bytes, max_age_seconds):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.entries = OrderedDict()  # key -> {"filename", "size", "last_access"}; oldest first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.orphans_removed = 0
+        self.reclaimed_bytes = 0
+        self.lock = threading.Lock()
+        self._loaded = False
+        self._scan = None  # directory iterator, resumed by each sweep
+
+    @staticmethod
+    def cache_key_of(filename):
+        """The key of a finished cache file named '<64 hex digit key>_<suffix>', else None."""
+        key, separator, _ = filename.partition('_')
+        if not separator or '.part.' in filename or not CACHE_KEY_PATTERN.fullmatch(key):
+            return None
+        return key
+
+    def _load_existing(self):
+        """Indexes cache files already present in the folder (called with the lock held)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.isdir(self.folder):
+            return
+        found = []
+        for entry in os.scandir(self.folder):
+            key = self.cache_key_of(entry.name)
+            if key and entry.is_file():
+                stat = entry.stat()
+                found.append((stat.st_atime, key, entry.name, stat.st_size))
+        for last_access, key, filename, size in sorted(found):
+            self.entries[key] = {"filename": filename, "size": size, "last_access": last_access}
+            self.total_bytes += size
+
+    def _adopt(self, key, filename, size, last_access):
+        """
+        Indexes a cache file another process wrote, at its place in the recency order,
+        so an old file is not kept as if just used (called with the lock held).
+        """
+        self.entries[key] = {"filename": filename, "size": size, "last_access": last_access}
+        self.total_bytes += size
+        for other in [other for other, entry in self.entries.items() if entry["last_access"] > last_access]:
+            self.entries.move_to_end(other)
+
+    def get(self, key):
+        """Returns the cached filename for key (marking it recently used), or None."""
+        with self.lock:
+            self._load_existing()
+            entry = self.entries.get(key)
+            if entry is not None and not os.path.exists(os.path.join(self.folder, entry["filename"])):
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            entry["last_access"] = time.time()
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["filename"]
+
+    def touch(self, filename):
+        """Marks a cached file as just used (e.g. served); its access time survives restarts."""
+        key = filename.split('_', 1)[0]
+        with self.lock:
+            self._load_existing()
+            entry = self.entries.get(key)
+            if entry is None or entry["filename"] != filename:
+                return
+            entry["last_access"] = time.time()
+            self.entries.move_to_end(key)
+        try:
+            path = os.path.join(self.folder, filename)
+            os.utime(path, (entry["last_access"], os.stat(path).st_mtime))
+        except OSError:
+            pass
+
+    def put(self, key, filename):
+        """Registers a file that now exists in the folder, then enforces the bounds."""
+        size = os.path.getsize(os.path.join(self.folder, filename))
+        with self.lock:
+            self._load_existing()
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = {"filename": filename, "size": size, "last_access": time.time()}
+            self.total_bytes += size
+            self._evict()
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry["size"]
+        return entry
+
+    def _evict(self):
+        """Removes expired entries, then least recently used ones until under budget."""
+        cutoff = time.time() - self.max_age_seconds
+        while self.entries:
+            oldest_key, oldest = next(iter(self.entries.items()))
+            if self.total_bytes <= self.max_bytes and oldest["last_access"] >= cutoff:
+                break
+            self._drop(oldest_key)
+            self.evictions += 1
+            self.reclaimed_bytes += oldest["size"]
+            cleanup_files(os.path.join(self.folder, oldest["filename"]))
+
+    def sweep(self, max_entries=OUTPUT_SWEEP_BATCH, orphan_grace_seconds=OUTPUT_ORPHAN_GRACE_SECONDS):
+        """
+        One incremental lifecycle pass: evicts expired and over-budget entries, then
+        examines up to max_entries directory entries, resuming where the previous pass
+        stopped. Finished cache files the index does not know about (written by another
+        worker process sharing the folder, or before a restart) are adopted into it;
+        other files and temporary directories whose last write is older than
+        orphan_grace_seconds are removed as orphans (stale .part files, leftovers of
+        crashed encodes). Returns bytes reclaimed.
+        """
+        with self.lock:
+            self._load_existing()
+            reclaimed_before = self.reclaimed_bytes
+            self._evict()
+            evicted_bytes = self.reclaimed_bytes - reclaimed_before
+        if not os.path.isdir(self.folder):
+            return evicted_bytes
+
+        cutoff = time.time() - orphan_grace_seconds
+        orphans, orphan_bytes = 0, 0
+        for _ in range(max_entries):
+            if self._scan is None:
+                self._scan = os.scandir(self.folder)
+            entry = next(self._scan, None)
+            if entry is None:
+                self._scan.close()
+                self._scan = None
+                break
+            key = self.cache_key_of(entry.name)
+            with self.lock:
+                indexed = key in self.entries and self.entries[key]["filename"] == entry.name
+            if indexed:
+                continue
+            try:
+                size, last_write = _path_usage(entry)
+                if key and entry.is_file(follow_symlinks=False):
+                    last_access = entry.stat().st_atime
+                    with self.lock:
+                        adopted = key not in self.entries
+                        if adopted:
+                            self._adopt(key, entry.name, size, last_access)
+                    if adopted:
+                        logging.info(f"Adopted cache file {entry.path} ({size} bytes)")
+                        continue
+            except OSError:
+                continue  # removed meanwhile
+            if last_write >= cutoff:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                cleanup_files(entry.path)
+            logging.info(f"Removed orphaned {entry.path} ({size} bytes)")
+            orphans += 1
+            orphan_bytes += size
+        with self.lock:
+            self.orphans_removed += orphans
+            self.reclaimed_bytes += orphan_bytes
+        return evicted_bytes + orphan_bytes
+
+    def stats(self):
+        """Returns hit/miss counters and current occupancy."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "orphans_removed": self.orphans_removed,
+                "reclaimed_bytes": self.reclaimed_bytes,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _path_usage(entry):
+    """(bytes, newest modification time) of a directory entry; directories are summed recursively."""
+    stat = entry.stat(follow_symlinks=False)
+    if not entry.is_dir(follow_symlinks=False):
+        return stat.st_size, stat.st_mtime
+    size, last_write = 0, stat.st_mtime
+    for root, _, files in os.walk(entry.path):
+        for name in files:
+            file_stat = os.stat(os.path.join(root, name))
+            size += file_stat.st_size
+            last_write = max(last_write, file_stat.st_mtime)
+    return size, last_write
+
+
+result_cache = DiskLRUCache(OUTPUT_FOLDER, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_AGE_SECONDS)
+
+
+# --- Probe Index ---
+# get_video_info summaries persisted in SQLite under the input's sha256, so the same
+# content is probed once across jobs, batches, re-uploads, restarts and gunicorn workers.
+
+PROBE_INDEX_SCHEMA_VERSION = 1  # Bump when the get_video_info summary changes shape
+PROBE_INDEX_PRUNE_EVERY = 100  # Inserts between trims back to max_entries
+
+
+class ProbeIndex:
+    """
+    Content hash -> video info map in a SQLite file. Each row records when it was
+    last used; beyond max_entries the least recently used rows are dropped. The
+    index is an optimisation only: database errors are logged and treated as misses.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+        self._inserts = 0
+
+    def _connect(self):
+        # Connected lazily and per process: a connection must not cross the gunicorn fork
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            if connection.execute('PRAGMA user_version').fetchone()[0] != PROBE_INDEX_SCHEMA_VERSION:
+                connection.execute('DROP TABLE IF EXISTS probes')
+                connection.execute(f'PRAGMA user_version = {PROBE_INDEX_SCHEMA_VERSION}')
+            connection.execute('CREATE TABLE IF NOT EXISTS probes (content_hash TEXT PRIMARY KEY, '
+                               'info TEXT NOT NULL, probed_at REAL NOT NULL, used_at REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS probes_used_at ON probes (used_at)')
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def get(self, content_hash):
+        """Stored video info for a content hash, or None."""
+        if not self.path:
+            return None
+        with self.lock:
+            try:
+                connection = self._connect()
+                row = connection.execute('SELECT info FROM probes WHERE content_hash = ?', (content_hash,)).fetchone()
+                if row is not None:
+                    connection.execute('UPDATE probes SET used_at = ? WHERE content_hash = ?', (time.time(), content_hash))
+            except sqlite3.Error as e:
+                logging.warning(f"Probe index lookup failed: {e}")
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, content_hash, info):
+        """Records the video info of a content hash."""
+        if not self.path or info is None:
+            return
+        now = time.time()
+        with self.lock:
+            try:
+                connection = self._connect()
+                connection.execute('INSERT OR REPLACE INTO probes (content_hash, info, probed_at, used_at) '
+                                   'VALUES (?, ?, ?, ?)', (content_hash, json.dumps(info), now, now))
+                self._inserts += 1
+                if self._inserts % PROBE_INDEX_PRUNE_EVERY == 0:
+                    connection.execute('DELETE FROM probes WHERE content_hash IN (SELECT content_hash FROM probes '
+                                       'ORDER BY used_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+            except sqlite3.Error as e:
+                logging.warning(f"Probe index update failed: {e}")
+
+    def stats(self):
+        with self.lock:
+            entries = None
+            if self.path:
+                try:
+                    entries = self._connect().execute('SELECT COUNT(*) FROM probes').fetchone()[0]
+                except sqlite3.Error:
+                    pass
+            lookups = self.hits + self.misses
+            return {
+                "enabled": bool(self.path),
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+probe_index = ProbeIndex(PROBE_INDEX_PATH, PROBE_INDEX_MAX_ENTRIES)
+
+
+# --- Input Proxy Cache ---
+
+input_proxy_cache = DiskLRUCache(INPUT_PROXY_FOLDER, INPUT_PROXY_CACHE_MAX_BYTES, RESULT_CACHE_MAX_AGE_SECONDS)
+input_proxy_uses = OrderedDict()  # proxy key -> comparisons that decoded the source at that height
+input_proxy_building = set()  # proxy keys being captured by a running encode
+input_proxy_lock = threading.Lock()
+INPUT_PROXY_USES_MEMO_SIZE = 1024
+
+
+def compute_input_proxy_key(input_hash, height):
+    """Builds the cache key of an input's proxy at a given comparison height."""
+    key_fields = {
+        "input": input_hash,
+        "height": height,
+        "scaler": scaler_flags_for(height),
+        "encoder": INPUT_PROXY_ENCODER_SETTINGS,
+    }
+    return hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def resolve_input_proxies(input_paths, infos, height, allow_build=True):
+    """
+    Picks the file each input of a comparison at the given height is decoded from: its
+    cached proxy if there is one, else the source. Returns (paths, builds); builds maps
+    an input index to (key, partial path, fps) for sources that have now been used
+    INPUT_PROXY_BUILD_AFTER_USES times and should be captured by this encode.
+    """
+    paths, builds = [], {}
+    for index, (path, info) in enumerate(zip(input_paths, infos)):
+        if not height:
+            paths.append(path)
+            continue
+        key = compute_input_proxy_key(hash_file(path), height)
+        filename = input_proxy_cache.get(key)
+        if filename:
+            paths.append(os.path.join(INPUT_PROXY_FOLDER, filename))
+            continue
+        paths.append(path)
+        if not allow_build or not info or not info["fps"]:
+            continue
+        with input_proxy_lock:
+            input_proxy_uses[key] = input_proxy_uses.get(key, 0) + 1
+            input_proxy_uses.move_to_end(key)
+            while len(input_proxy_uses) > INPUT_PROXY_USES_MEMO_SIZE:
+                input_proxy_uses.popitem(last=False)
+            if input_proxy_uses[key] < INPUT_PROXY_BUILD_AFTER_USES or key in input_proxy_building:
+                continue
+            input_proxy_building.add(key)
+        os.makedirs(INPUT_PROXY_FOLDER, exist_ok=True)
+        builds[index] = (key, os.path.join(INPUT_PROXY_FOLDER, f"{key}_{height}p.part.mkv"), info["fps"])
+    return paths, builds
+
+
+def expect_input_reuse(path, heights):
+    """Marks an input about to be compared repeatedly, so its first encode at each height captures a proxy."""
+    input_hash = hash_file(path)
+    with input_proxy_lock:
+        for height in heights:
+            key = compute_input_proxy_key(input_hash, height)
+            input_proxy_uses[key] = max(input_proxy_uses.get(key, 0), INPUT_PROXY_BUILD_AFTER_USES - 1)
+            input_proxy_uses.move_to_end(key)
+
+
+def finish_input_proxies(builds, succeeded):
+    """Publishes proxies captured by a successful encode, or discards them after a failure."""
+    for key, partial_path, _ in builds.values():
+        try:
+            if succeeded and os.path.exists(partial_path):
+                filename = os.path.basename(partial_path).replace('.part.', '.')
+                os.replace(partial_path, os.path.join(INPUT_PROXY_FOLDER, filename))
+                input_proxy_cache.put(key, filename)
+                logging.info(f"Cached input proxy {filename}")
+            else:
+                cleanup_files([partial_path])
+        finally:
+            with input_proxy_lock:
+                input_proxy_building.discard(key)
+                input_proxy_uses.pop(key, None)
+
+
+# --- Output Lifecycle ---
+# A background thread sweeps both caches every OUTPUT_SWEEP_INTERVAL_SECONDS, so the
+# quota and TTL hold even when no new outputs arrive and crash leftovers get removed.
+
+_output_sweeper = None
+_output_sweeper_lock = threading.Lock()
+
+
+def sweep_caches():
+    """Runs one incremental sweep of the result and input proxy caches; returns bytes reclaimed."""
+    reclaimed = 0
+    for name, cache in (("outputs", result_cache), ("input proxies", input_proxy_cache)):
+        cache_reclaimed = cache.sweep()
+        if cache_reclaimed:
+            logging.info(f"Lifecycle sweep reclaimed {cache_reclaimed} bytes from {name}.")
+        reclaimed += cache_reclaimed
+    return reclaimed
+
+
+def _output_sweeper_loop():
+    while True:
+        time.sleep(OUTPUT_SWEEP_INTERVAL_SECONDS)
+        try:
+            sweep_caches()
+        except Exception:
+            logging.exception("Output lifecycle sweep failed.")
+
+
+def ensure_output_sweeper():
+    """Starts the lifecycle sweeper thread on first use (after gunicorn has forked)."""
+    global _output_sweeper
+    with _output_sweeper_lock:
+        if _output_sweeper is None:
+            _output_sweeper = threading.Thread(target=_output_sweeper_loop, name="output-sweeper", daemon=True)
+            _output_sweeper.start()
+
+
+# --- Admission Control ---
+# Every new job gets a cost estimate in runner seconds. The queue orders jobs by
+# self-clocked fair queueing, and a request is refused with 429 when its job would
+# wait longer than ADMISSION_MAX_WAIT_SECONDS for a runner.
+
+class AdmissionRejected(Exception):
+    """Raised by submit_comparison when a new job is refused; carries the Retry-After seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class FairJobQueue:
+    """
+    Job queue with self-clocked fair queueing across clients. A job's virtual finish
+    tag is its client's previous tag (or the current virtual time, if later) plus its
+    estimated cost; the smallest tag runs next. Short jobs overtake long ones, a client
+    with a deep backlog mostly delays itself, and long jobs still run once virtual time
+    catches up with them. Throughput is recalibrated from finished jobs.
+    """
+
+    def __init__(self, workers, mpixel_frames_per_second):
+        self.workers = workers
+        self.mpixel_frames_per_second = mpixel_frames_per_second
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.heap = []  # (finish tag, sequence, job_id, client, cost seconds)
+        self.sequence = itertools.count()
+        self.virtual_time = 0.0
+        self.client_finish = {}  # client -> finish tag of its latest queued job
+        self.running = {}  # job_id -> (monotonic start, cost seconds)
+
+    def cost_seconds(self, units):
+        """Converts a cost in megapixel-frames to runner seconds at the calibrated throughput."""
+        return ADMISSION_UNKNOWN_JOB_SECONDS if units is None else units / self.mpixel_frames_per_second
+
+    def _finish_tag(self, cost_seconds, client):
+        return max(self.virtual_time, self.client_finish.get(client, 0.0)) + cost_seconds
+
+    def put(self, job_id, cost_seconds, client):
+        with self.lock:
+            finish = self._finish_tag(cost_seconds, client)
+            self.client_finish[client] = finish
+            heapq.heappush(self.heap, (finish, next(self.sequence), job_id, client, cost_seconds))
+            self.not_empty.notify()
+
+    def get(self):
+        """Blocks until a job is queued, then returns the id of the job with the smallest finish tag."""
+        with self.lock:
+            while not self.heap:
+                self.not_empty.wait()
+            finish, _, job_id, _, cost_seconds = heapq.heappop(self.heap)
+            self.virtual_time = max(self.virtual_time, finish)
+            self.client_finish = {client: tag for client, tag in self.client_finish.items() if tag > self.virtual_time}
+            self.running[job_id] = (time.monotonic(), cost_seconds)
+            return job_id
+
+    def done(self, job_id, units=None, run_seconds=None):
+        """Marks a job finished; its measured run time recalibrates the throughput estimate."""
+        with self.lock:
+            self.running.pop(job_id, None)
+            if units and run_seconds and run_seconds >= 1.0:
+                self.mpixel_frames_per_second = 0.8 * self.mpixel_frames_per_second + 0.2 * units / run_seconds
+
+    def discard(self, job_id):
+        """Removes a job that has not started yet; returns False if it is no longer queued."""
+        with self.lock:
+            remaining = [entry for entry in self.heap if entry[2] != job_id]
+            if len(remaining) == len(self.heap):
+                return False
+            self.heap = remaining
+            heapq.heapify(self.heap)
+            return True
+
+    def qsize(self):
+        with self.lock:
+            return len(self.heap)
+
+    def expected_wait(self, cost_seconds, client):
+        """
+        Seconds until a new job from client would start: the queued work ordered ahead
+        of it plus what is left of the running jobs, spread over the runners.
+        """
+        with self.lock:
+            finish = self._finish_tag(cost_seconds, client)
+            ahead = [entry[4] for entry in self.heap if entry[0] <= finish]
+            now = time.monotonic()
+            remaining = [max(0.0, cost - (now - started)) for started, cost in self.running.values()]
+        if len(ahead) + len(remaining) < self.workers:
+            return 0.0
+        return (sum(ahead) + sum(remaining)) / self.workers
+
+    def admission_delay(self, cost_seconds, client):
+        """None if a job may be queued now, else (reason, Retry-After seconds)."""
+        if ADMISSION_MAX_WAIT_SECONDS <= 0:
+            return None
+        with self.lock:
+            client_jobs = [entry[4] for entry in self.heap if entry[3] == client]
+        if len(client_jobs) >= ADMISSION_MAX_CLIENT_JOBS:
+            return "client_limit", max(1, math.ceil(min(client_jobs) / self.workers))
+        wait = self.expected_wait(cost_seconds, client)
+        if wait > ADMISSION_MAX_WAIT_SECONDS:
+            return "saturated", max(1, math.ceil(wait - ADMISSION_MAX_WAIT_SECONDS))
+        return None
+
+    def queued_seconds(self):
+        with self.lock:
+            return round(sum(entry[4] for entry in self.heap), 1)
+
+
+def estimate_job_cost(outputs, info1, info2, playback_speed):
+    """
+    Estimated work of a job in megapixel-frames: decoding both inputs plus rendering
+    every output not yet cached at its height, weighted by METHOD_COST_WEIGHTS. Slower
+    playback repeats frames, so outputs cost more. None if the inputs are not probed.
+    """
+    if not all(info and info["duration"] and info["width"] and info["height"] for info in (info1, info2)):
+        return None
+    input_frames = min(info1["duration"], info2["duration"]) * (info1["fps"] or 30.0)
+    units = input_frames * (info1["width"] * info1["height"] + info2["width"] * info2["height"]) / 1e6
+    aspect = info1["width"] / info1["height"]
+    max_height = min(info1["height"], info2["height"])
+    for output in outputs:
+        if output["cached"]:
+            continue
+        height = min(RESOLUTION_TIERS.get(output["resolution"]) or TARGET_HEIGHT, max_height)
+        # Analysis reports cover each source frame once, whatever the playback speed
+        frames = input_frames if output["method"] == 'frame_metrics' else input_frames / parse_playback_speed(playback_speed)
+        units += frames * height * height * aspect / 1e6 * METHOD_COST_WEIGHTS.get(output["method"], 1.0)
+    return units
+
+
+def client_id_for(req):
+    """Fairness key of a request: the first X-Forwarded-For hop (Cloud Run, nginx) or the peer address."""
+    forwarded = req.headers.get('X-Forwarded-For', '')
+    return forwarded.split(',')[0].strip() or req.remote_addr or 'unknown'
+
+
+# --- Job Queue ---
+# Comparisons run on a bounded pool of ffmpeg runner threads so that request
+# handlers return immediately and /health, /jobs and /outputs stay responsive.
+
+JOB_FINAL_STATUSES = ("completed", "failed", "cancelled")
+CANCEL_MESSAGES = {
+    "client": "Cancelled by the client.",
+    "time_limit": "Cancelled after exceeding the job time limit.",
+    "abandoned": "Cancelled because no client was following the job any more.",
+}
+
+jobs = {}  # job_id -> job dict (see create_job)
+inflight_results = {}  # result cache key -> job_id of the queued/running job producing it
+batches = {}  # batch_id -> batch dict (see create_batch)
+jobs_lock = threading.Lock()
+jobs_changed = threading.Condition(jobs_lock)  # notified on every job update (drives /jobs/<id>/events)
+job_queue = FairJobQueue(FFMPEG_WORKERS, ADMISSION_MPIXEL_FRAMES_PER_SECOND)
+_job_workers = []
+_job_workers_lock = threading.Lock()
+
+
+def output_filename_for(cache_key, method, playback_speed, resolution=None):
+    """Names a comparison output after its result cache key, method, resolution tier and speed."""
+    if method in ANALYSIS_METHODS:
+        return f"{cache_key}_{method}.json"
+    speed_str = str(parse_playback_speed(playback_speed)).replace('.', 'p') # Format speed for filename
+    resolution_str = f"_{resolution}" if resolution else ""
+    return f"{cache_key}_{method}{resolution_str}_s{speed_str}x_output.mp4"
+
+
+def primary_output(outputs):
+    """The output a job's output_url points at: the first method at its highest resolution."""
+    return max(outputs, key=lambda output: RESOLUTION_TIERS.get(output.get("resolution"), 0))
+
+
+def partial_output_path(output_path):
+    """Temporary path an output is encoded to before being renamed into place."""
+    stem, ext = os.path.splitext(output_path)
+    return f"{stem}.part{ext}"
+
+
+def create_job(methods, input1_path, input2_path, playback_speed, is_local=False, cleanup_paths=None, cache_key=None,
+               options=None, outputs=None):
+    """
+    Registers a new queued comparison job and returns its dict. outputs holds one
+    entry per method and resolution (method, resolution, cache_key, output_filename,
+    output_url, cached);
+    entries that already have an output_url are not rendered again.
+    """
+    job_id = str(uuid.uuid4())
+    job = {
+        "job_id": job_id,
+        "cache_key": cache_key,  # set for single-method jobs so identical requests can share them
+        "cached": False,
+        "status": "queued",
+        "progress": 0.0,
+        "methods": list(methods),
+        "outputs": [dict(output) for output in outputs or []],
+        "playback_speed": playback_speed,
+        "options": dict(options or {}),
+        "encode_profile": (options or {}).get("encode_profile", DEFAULT_ENCODE_PROFILE),
+        "mode": "local" if is_local else "upload",
+        "input1_path": input1_path,
+        "input2_path": input2_path,
+        "cleanup_paths": list(cleanup_paths or []),
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "output_url": None,
+        "output_filename": None,
+        "partial_url": None,  # playable while the first output is still being encoded
+        "preview_url": None,  # lowest resolution rendition, finished ahead of the others
+        "thumbnails_url": None,  # WebVTT sprite track of the primary output, if requested
+        "encode": None,  # latest ffmpeg progress snapshot: frame, fps, out_time, speed
+        "encode_fps": None,
+        "segments": None,  # number of parallel segments, if the job was split
+        "alignment": None,  # input normalization plan (see plan_alignment), once the job runs
+        "client": None,  # fairness key of the submitting client (see client_id_for)
+        "cost_units": None,  # estimated megapixel-frames (see estimate_job_cost)
+        "estimated_seconds": None,  # runner seconds predicted at submission
+        "last_seen": time.time(),  # last poll, event or partial output read by a client (see JOB_ABANDON_SECONDS)
+        "followers": {},  # client -> identical requests attached to the job (see cancel_job)
+        "cancel_reason": None,  # 'client', 'time_limit' or 'abandoned' once cancellation was requested
+        "keep_partial": False,  # publish what a cancelled encode wrote (see finalize_partial_output)
+        "partial_result_url": None,  # playable prefix of the primary output of a cancelled job
+        "processes": [],  # running ffmpeg processes (see start_ffmpeg)
+        "error": None,
+        "version": 0,
+    }
+    with jobs_lock:
+        jobs[job_id] = job
+    return job
+
+
+def update_job(job, **fields):
+    """
+    Applies field updates to a job under the jobs lock and wakes progress listeners.
+    A job whose ffmpeg processes were killed by cancellation is recorded as cancelled
+    rather than failed.
+    """
+    with jobs_lock:
+        if job["cancel_reason"] is not None and fields.get("status") == "failed":
+            fields.update(status="cancelled", error=CANCEL_MESSAGES[job["cancel_reason"]])
+        job.update(fields)
+        job["version"] += 1
+        jobs_changed.notify_all()
+
+
+def get_job_status(job_id):
+    """Returns the public (JSON-safe) view of a job, or None if unknown. Counts as the client following the job."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+        job["last_seen"] = time.time()
+        return _public_job_view(job)
+
+
+def touch_job(job):
+    """Records that a client is still following a job (see JOB_ABANDON_SECONDS)."""
+    with jobs_lock:
+        job["last_seen"] = time.time()
+
+
+JOB_PUBLIC_FIELDS = ("job_id", "status", "progress", "cached", "methods", "playback_speed", "options", "mode",
+                     "created_at", "started_at", "finished_at", "output_url", "output_filename", "partial_url", "preview_url", "thumbnails_url", "outputs",
+                     "encode_profile", "encode", "encode_fps", "segments", "alignment", "estimated_seconds", "cancel_reason",
+                     "partial_result_url", "error")
+
+
+def _public_job_view(job):
+    """Copies the JSON-safe fields of a job (caller holds jobs_lock)."""
+    view = {field: job[field] for field in JOB_PUBLIC_FIELDS}
+    view["followers"] = sum(job["followers"].values())
+    view["options"] = dict(view["options"])
+    view["methods"] = list(view["methods"])
+    view["outputs"] = [dict(output) for output in view["outputs"]]
+    if view["alignment"] is not None:
+        view["alignment"] = dict(view["alignment"])
+    if view["encode"] is not None:
+        view["encode"] = dict(view["encode"])
+    return view
+
+
+def iter_job_updates(job_id, keepalive_seconds=SSE_KEEPALIVE_SECONDS):
+    """
+    Yields the public view of a job every time it changes, ending after the job
+    reaches a final state. Yields None when nothing changed for keepalive_seconds.
+    """
+    last_version = -1
+    while True:
+        with jobs_changed:
+            job = jobs.get(job_id)
+            if job is not None and job["version"] == last_version:
+                jobs_changed.wait(timeout=keepalive_seconds)
+                job = jobs.get(job_id)
+            if job is None:
+                return
+            job["last_seen"] = time.time()
+            if job["version"] == last_version:
+                view = None
+            else:
+                last_version = job["version"]
+                view = _public_job_view(job)
+        yield view
+        if view is not None and view["status"] in JOB_FINAL_STATUSES:
+            return
+
+
+def poll_job_update(job_id, last_version=-1):
+    """
+    Non-blocking counterpart of iter_job_updates (used by the ASGI server): returns
+    (version, view), where view is the public job view if the job changed since
+    last_version and None otherwise, or None if the job is unknown.
+    """
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+        job["last_seen"] = time.time()
+        return job["version"], (_public_job_view(job) if job["version"] != last_version else None)
+
+
+def get_queue_stats():
+    """Returns counts of jobs per status plus the configured worker count."""
+    with jobs_lock:
+        statuses = [job["status"] for job in jobs.values()]
+    return {
+        "queued": statuses.count("queued"),
+        "running": statuses.count("running"),
+        "workers": FFMPEG_WORKERS,
+        "queued_seconds": job_queue.queued_seconds(),
+        "mpixel_frames_per_second": round(job_queue.mpixel_frames_per_second, 1),
+    }
+
+
+def prune_finished_jobs():
+    """Forgets finished jobs older than JOB_RETENTION_SECONDS."""
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    with jobs_lock:
+        expired = [job_id for job_id, job in jobs.items()
+                   if job["finished_at"] is not None and job["finished_at"] < cutoff]
+        for job_id in expired:
+            del jobs[job_id]
+        expired_batches = [batch_id for batch_id, batch in batches.items()
+                           if batch["finished_at"] is not None and batch["finished_at"] < cutoff]
+        for batch_id in expired_batches:
+            del batches[batch_id]
+    if expired:
+        logging.info(f"Pruned {len(expired)} finished job(s) from the job table.")
+
+
+def ensure_job_workers():
+    """Starts the ffmpeg runner threads on first use (after gunicorn has forked)."""
+    with _job_workers_lock:
+        while len(_job_workers) < FFMPEG_WORKERS:
+            worker = threading.Thread(target=_job_worker_loop, name=f"ffmpeg-runner-{len(_job_workers)}", daemon=True)
+            worker.start()
+            _job_workers.append(worker)
+
+
+def enqueue_job(job):
+    """Places a job on the queue, starting the runner pool if needed."""
+    ensure_output_sweeper()
+    ensure_job_workers()
+    prune_finished_jobs()
+    ensure_job_watchdog()
+    job_queue.put(job["job_id"], job["estimated_seconds"] or ADMISSION_UNKNOWN_JOB_SECONDS, job["client"])
+    logging.info(f"Queued job {job['job_id']} ({job['mode']} methods: {', '.join(job['methods'])}, "
+                 f"~{job['estimated_seconds'] or 0:.0f}s). Queue depth: {job_queue.qsize()}")
+
+
+def _job_worker_loop():
+    """Runner thread body: drains the job queue one ffmpeg process at a time."""
+    while True:
+        job_id = job_queue.get()
+        with jobs_lock:
+            job = jobs.get(job_id)
+        try:
+            if job is not None and job["cancel_reason"] is not None:
+                # Cancelled while the runner was picking it up
+                update_job(job, status="cancelled", error=CANCEL_MESSAGES[job["cancel_reason"]], finished_at=time.time())
+            elif job is not None:
+                run_comparison_job(job)
+        except Exception as e:
+            logging.exception(f"Unexpected error while running job {job_id}.")
+            update_job(job, status="failed", error=f"An unexpected server error occurred: {str(e)}",
+                       finished_at=time.time())
+        finally:
+            if job is not None:
+                record_job_metrics(job)
+                release_job(job)
+                run_seconds = (job["finished_at"] or time.time()) - job["started_at"] if job["started_at"] else None
+                job_queue.done(job_id, job["cost_units"] if job["status"] == "completed" else None, run_seconds)
+            else:
+                job_queue.done(job_id)
+
+
+def release_job(job):
+    """Removes a finished job's uploads, lets identical requests start a new job and settles its batch."""
+    cleanup_files(job["cleanup_paths"])
+    with jobs_lock:
+        if inflight_results.get(job["cache_key"]) == job["job_id"]:
+            del inflight_results[job["cache_key"]]
+    release_finished_batches()
+
+
+class CancelRefused(Exception):
+    """Raised by cancel_job when the client asking to cancel a job does not follow it."""
+
+
+def cancel_job(job_id, reason, keep_partial=False, client=None):
+    """
+    Cancels a queued or running job for reason (a CANCEL_MESSAGES key). A queued job
+    leaves the queue and finishes at once. A running job has its ffmpeg process groups
+    killed, which frees its runner as soon as the encode returns; the runner then
+    records it as cancelled, publishing the playable part of its output first if
+    keep_partial is set. Returns the job's public view, or None if it is unknown.
+    A job shared by identical requests is reference-counted: a cancel on behalf of
+    client only detaches one of that client's requests, and the job is cancelled once
+    no request follows it any more. CancelRefused is raised if client follows none of them.
+    """
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+        if job["status"] in JOB_FINAL_STATUSES or job["cancel_reason"] is not None:
+            return _public_job_view(job)
+        followers = job["followers"]
+        if client is not None and followers:
+            if not followers.get(client):
+                raise CancelRefused(f"Job {job_id} was not requested by this client")
+            followers[client] -= 1
+            if not followers[client]:
+                del followers[client]
+            job["version"] += 1
+            jobs_changed.notify_all()
+            if followers:
+                logging.info(f"Detached {client} from job {job_id}; {sum(followers.values())} request(s) still follow it")
+                return _public_job_view(job)
+        job.update(cancel_reason=reason, keep_partial=keep_partial)
+        job["version"] += 1
+        jobs_changed.notify_all()
+        if inflight_results.get(job["cache_key"]) == job_id:
+            del inflight_results[job["cache_key"]]  # identical requests start a fresh job from now on
+        # Killed under the lock, so release_ffmpeg cannot let a process be reaped (and its group id reused) first
+        for process in job["processes"]:
+            kill_process_group(process)
+        status = job["status"]
+    metrics.inc('jobs_cancelled_total', reason=reason)
+    logging.info(f"Cancelling {status} job {job_id} ({reason}{', keeping partial output' if keep_partial else ''})")
+    if job_queue.discard(job_id):
+        update_job(job, status="cancelled", error=CANCEL_MESSAGES[reason], finished_at=time.time())
+        release_job(job)
+    with jobs_lock:
+        return _public_job_view(job)
+
+
+def job_time_limit(methods):
+    """Wall-clock limit in seconds of a job rendering methods (see METHOD_TIME_LIMITS), or None for no limit."""
+    limits = [METHOD_TIME_LIMITS.get(method, JOB_TIME_LIMIT_SECONDS) for method in methods]
+    return max(limits) if limits and min(limits) > 0 else None
+
+
+def check_job_limits():
+    """
+    Cancels running jobs past their time limit and jobs no client has followed for
+    JOB_ABANDON_SECONDS. Every request sharing a job refreshes the same last_seen, so a
+    shared job is only abandoned once all of its followers have stopped following it.
+    """
+    now = time.time()
+    with jobs_lock:
+        active = [dict(job) for job in jobs.values()
+                  if job["status"] in ("queued", "running") and job["cancel_reason"] is None]
+    for job in active:
+        limit = job_time_limit(job["methods"])
+        if job["status"] == "running" and job["started_at"] and limit and now - job["started_at"] > limit:
+            logging.warning(f"Job {job['job_id']} exceeded its {limit:g}s time limit.")
+            cancel_job(job["job_id"], "time_limit", keep_partial=True)
+        elif (JOB_ABANDON_SECONDS > 0 and not (job["client"] or "").startswith("batch:")
+              and now - job["last_seen"] > JOB_ABANDON_SECONDS):
+            logging.warning(f"Job {job['job_id']} has not been followed for {now - job['last_seen']:.0f}s.")
+            cancel_job(job["job_id"], "abandoned")
+
+
+_job_watchdog = None
+_job_watchdog_lock = threading.Lock()
+
+
+def _job_watchdog_loop():
+    while True:
+        time.sleep(JOB_WATCHDOG_INTERVAL_SECONDS)
+        try:
+            check_job_limits()
+        except Exception:
+            logging.exception("Job watchdog check failed.")
+
+
+def ensure_job_watchdog():
+    """Starts the thread enforcing job time limits and abandonment on first use (after gunicorn has forked)."""
+    global _job_watchdog
+    with _job_watchdog_lock:
+        if _job_watchdog is None:
+            _job_watchdog = threading.Thread(target=_job_watchdog_loop, name="job-watchdog", daemon=True)
+            _job_watchdog.start()
+
+
+def record_job_metrics(job):
+    """Records a finished job's queue wait and run time."""
+    if job["started_at"] is not None:
+        metrics.observe('stage_seconds', job["started_at"] - job["created_at"], stage='queue_wait')
+        metrics.observe('job_seconds', (job["finished_at"] or time.time()) - job["started_at"],
+                        method=methods_label(job["methods"]), status=job["status"])
+
+
+def run_comparison_job(job):
+    """
+    Runs ffmpeg for a queued job and records the outcome on the job. All outputs still
+    missing from the result cache are rendered by a single ffmpeg process, except that
+    when several resolutions are pending the lowest one is rendered first as a preview.
+    """
+    if job["methods"] == ['frame_metrics']:
+        return run_frame_metrics_job(job)
+    if job["methods"] == ['changed_segments']:
+        return run_changed_segments_job(job)
+
+    pending = [output for output in job["outputs"] if not output["output_url"]]
+    started_at = time.time()
+    update_job(job, status="running", started_at=started_at)
+    info1, info2 = get_video_info(job["input1_path"]), get_video_info(job["input2_path"])
+    alignment = align_job_inputs(job, info1, info2)
+    info1, info2 = aligned_video_info(info1, alignment, 0), aligned_video_info(info2, alignment, 1)
+    output_duration = estimate_output_duration(info1, info2, job["playback_speed"])
+
+    # Never upscale: no rendition is taller than the smaller input
+    source_heights = [info["height"] for info in (info1, info2) if info and info["height"]]
+    max_height = min(source_heights) // 2 * 2 if source_heights else None
+    heights = {}
+    for output in pending:
+        height = RESOLUTION_TIERS[output.get("resolution") or DEFAULT_RESOLUTION]
+        heights[output["output_filename"]] = min(height, max_height) if max_height else height
+
+    passes = [pending]
+    lowest_height = min(heights.values())
+    if any(height > lowest_height for height in heights.values()):
+        passes = [[output for output in pending if heights[output["output_filename"]] == lowest_height],
+                  [output for output in pending if heights[output["output_filename"]] > lowest_height]]
+
+    for pass_index, pass_outputs in enumerate(passes):
+        span = (pass_index / len(passes), (pass_index + 1) / len(passes))
+        rendered = render_job_outputs(job, pass_outputs, [heights[output["output_filename"]] for output in pass_outputs],
+                                      info1, info2, output_duration, span, preview=pass_index < len(passes) - 1,
+                                      alignment=alignment)
+        if rendered is None:
+            return
+        outputs = [dict(output, **rendered.get(output["output_filename"], {})) for output in job["outputs"]]
+        if pass_index < len(passes) - 1:
+            # Serve the low-resolution preview while the remaining renditions encode
+            update_job(job, outputs=outputs, preview_url=f"/outputs/{pass_outputs[0]['output_filename']}")
+
+    primary = primary_output(outputs)
+    update_job(job, status="completed", progress=1.0, finished_at=time.time(), outputs=outputs,
+               encode_fps=rendered[pass_outputs[0]["output_filename"]]["encode_fps"],
+               output_url=primary["output_url"], output_filename=primary["output_filename"], partial_url=None,
+               thumbnails_url=primary.get("thumbnails_url"))
+
+
+def render_job_outputs(job, pending, heights, info1, info2, output_duration, span=(0.0, 1.0), preview=False,
+                       alignment=None):
+    """
+    Encodes the given outputs of a job (one decode, one process or one set of segments)
+    at the given heights and publishes them to the result cache. info1/info2 describe
+    the inputs after alignment. Returns the fields to merge into each output keyed by
+    output filename, or None after marking the job failed.
+    """
+    playback_speed = job["playback_speed"]
+    mode = job["mode"]
+    methods = [output["method"] for output in pending]
+    method = ", ".join(methods)
+    output_paths = [os.path.join(app.config['OUTPUT_FOLDER'], output["output_filename"]) for output in pending]
+    # Encode under temporary names so the cache never sees a half-written file
+    partial_paths = [partial_output_path(output_path) for output_path in output_paths]
+    target_height = max(heights)
+
+    profile = job["encode_profile"]
+    encoder_settings = ENCODE_PROFILES[profile]
+
+    # The inputs may not have been probed (info1 is None); the filter graph does not need their frame rate
+    fps = info1["fps"] if info1 else None
+    blink_period = blink_period_frames(job["options"], fps, playback_speed)
+    # Variable frame rate blinks drop frames, so they cannot be cut into frame-counted segments
+    blink_vfr = bool(job["options"].get("blink_vfr")) and 'interleave' in methods
+
+    # The raw frame backend is one decode feeding one encoder per output; it is never segmented
+    raw_backend = comparison_backend(methods, job["options"]) == 'numpy'
+    if raw_backend and not fps:
+        update_job(job, status="failed", finished_at=time.time(), error="Could not read the frame rate of the inputs.")
+        return None
+
+    # The sprite sheet is a branch of this encode; it needs the whole timeline, so it is never segmented
+    thumbnail_index = next((index for index, output in enumerate(pending) if output.get("thumbnails")), None)
+    thumbnail_plan = sprite_path = track_path = thumbnail_output = None
+    if thumbnail_index is not None:
+        if raw_backend:
+            frame_size = raw_frame_size(info1, heights[thumbnail_index])
+        else:
+            frame_size = comparison_frame_size(methods[thumbnail_index], info1, info2, heights[thumbnail_index])
+        thumbnail_plan = plan_thumbnails(output_duration, *frame_size)
+        if thumbnail_plan is None:
+            logging.warning(f"Output duration unknown; skipping thumbnails for job {job['job_id']}.")
+            thumbnail_index = None
+        else:
+            sprite_filename, track_filename = thumbnail_filenames(pending[thumbnail_index]["cache_key"])
+            sprite_path = os.path.join(app.config['OUTPUT_FOLDER'], sprite_filename)
+            track_path = os.path.join(app.config['OUTPUT_FOLDER'], track_filename)
+            thumbnail_output = (thumbnail_index, partial_output_path(sprite_path), thumbnail_plan)
+
+    encode_mode = job["options"].get("encode_mode", DEFAULT_ENCODE_MODE)
+    segments = None
+    # Segments must join into exactly the frames of a single pass, which only holds for unaligned
+    # inputs played at 1x, 0.5x, 0.25x, ...
+    if not preview and not blink_vfr and not raw_backend and not thumbnail_output and (encode_mode == 'parallel' or
+                                          (encode_mode == 'auto' and (output_duration or 0) >= PARALLEL_AUTO_MIN_DURATION)):
+        if not alignment_is_identity(alignment):
+            logging.info(f"Not segmenting job {job['job_id']}: its inputs are aligned.")
+        elif segments_match_single_pass(playback_speed):
+            segments = plan_segments(info1, info2)
+        else:
+            logging.info(f"Not segmenting job {job['job_id']}: playback speed {playback_speed} is not 1/n.")
+
+    # Decode cached input proxies instead of the sources; single-pass encodes of unaligned inputs capture new ones
+    input_paths, proxy_builds = resolve_input_proxies([job["input1_path"], job["input2_path"]], [info1, info2],
+                                                      target_height,
+                                                      allow_build=not segments and not raw_backend
+                                                      and alignment_is_identity(alignment))
+    proxy_outputs = {index: (partial_path, fps) for index, (_, partial_path, fps) in proxy_builds.items()}
+
+    # Construct and Run FFMPEG Command
+    if raw_backend:
+        frame_width, frame_height = raw_frame_size(info1, target_height)
+        ffmpeg_command = get_raw_decode_command(input_paths[0], input_paths[1], frame_width, frame_height,
+                                                raw_tint_variants(methods)[-1], alignment)
+    else:
+        ffmpeg_command = get_multi_ffmpeg_command(methods, input_paths[0], input_paths[1], partial_paths,
+                                                  target_height, playback_speed, output_options=fragmented_output_options(),
+                                                  encoder_settings=encoder_settings, output_heights=heights,
+                                                  proxy_outputs=proxy_outputs, alignment=alignment,
+                                                  blink_period=blink_period, blink_vfr=blink_vfr,
+                                                  thumbnail_output=thumbnail_output)
+    if not ffmpeg_command:
+        finish_input_proxies(proxy_builds, succeeded=False)
+        update_job(job, status="failed", error=f"Invalid comparison method: {method}", finished_at=time.time())
+        return None
+
+    started_at = time.time()
+    if segments:
+        logging.info(f"Running segment-parallel encode ({mode}, job {job['job_id']}): {len(segments)} segments")
+        update_job(job, segments=len(segments))
+        returncode, stderr_text = run_segmented_ffmpeg(job, methods, fps, segments, partial_paths,
+                                                       output_duration, encoder_settings, heights, span, input_paths,
+                                                       alignment, blink_period)
+    else:
+        logging.info(f"Running FFMPEG command ({mode}, job {job['job_id']}): {' '.join(ffmpeg_command)}")
+        # Fragments land in the .part file as they are encoded, so clients can start playing right away
+        partial_urls = {output["output_filename"]: f"/outputs/{output['output_filename']}" for output in pending}
+        update_job(job, partial_url=partial_urls[pending[0]["output_filename"]],
+                   outputs=[dict(output, partial_url=partial_urls.get(output["output_filename"]))
+                            for output in job["outputs"]])
+        if raw_backend:
+            returncode, stderr_text = run_raw_frame_comparison(
+                methods, input_paths[0], input_paths[1], partial_paths, frame_width, frame_height, fps,
+                playback_speed, encoder_settings, heights, fragmented_output_options(), job["options"], alignment,
+                on_progress=make_progress_callback(job, output_duration, span), thumbnail_output=thumbnail_output,
+                job=job)
+        else:
+            returncode, stderr_text = run_ffmpeg(ffmpeg_command,
+                                                 on_progress=make_progress_callback(job, output_duration, span),
+                                                 label=methods_label(output["method"] for output in pending), job=job)
+    elapsed = time.time() - started_at
+    finish_input_proxies(proxy_builds, succeeded=returncode == 0)
+
+    # Handle FFMPEG Result
+    if returncode != 0 and job["cancel_reason"] is not None:
+        logging.info(f"FFMPEG stopped by cancellation ({mode} method: {method}, job {job['job_id']}, "
+                     f"reason: {job['cancel_reason']})")
+        cleanup_files([thumbnail_output[1]] if thumbnail_output and os.path.exists(thumbnail_output[1]) else [])
+        record_cancelled_render(job, pending, partial_paths)
+        return None
+    if returncode != 0:
+        error_message = f"FFMPEG failed ({mode} method: {method}). Code: {returncode}. Error: {stderr_text}"
+        logging.error(error_message)
+        logging.error(f"Failed command: {' '.join(ffmpeg_command)}") # Log the exact command
+        update_job(job, status="failed", finished_at=time.time(),
+                   error=f"Video processing failed ({mode}). Check server logs. Details: {stderr_text[-500:]}...")
+        cleanup_files(partial_paths + ([thumbnail_output[1]] if thumbnail_output else []))
+        return None
+
+    frames = (job["encode"] or {}).get("frame", 0)
+    encode_fps = round(frames / elapsed, 2) if elapsed > 0 else None
+    rendered = {}
+    for output, output_path, partial_path, height in zip(pending, output_paths, partial_paths, heights):
+        os.replace(partial_path, output_path)
+        result_cache.put(output["cache_key"], output["output_filename"])
+        output_bytes = os.path.getsize(output_path)
+        record_profile_stats(profile, encode_fps, output_bytes)
+        metrics.observe('output_bytes', output_bytes, method=output["method"])
+        rendered[output["output_filename"]] = {"output_url": f"/outputs/{output['output_filename']}", "partial_url": None,
+                                               "height": height, "output_bytes": output_bytes, "encode_fps": encode_fps}
+    if thumbnail_output:
+        rendered[pending[thumbnail_index]["output_filename"]].update(publish_thumbnails(
+            pending[thumbnail_index]["cache_key"], sprite_path, track_path, thumbnail_plan))
+
+    logging.info(f"FFMPEG processing successful ({mode} method: {method}, profile: {profile}, heights: {heights}, "
+                 f"input proxies: {sum(path.startswith(INPUT_PROXY_FOLDER) for path in input_paths)}/2). "
+                 f"Outputs: {', '.join(output_paths)} ({frames} frames in {elapsed:.1f}s, {encode_fps} fps)")
+    return rendered
+
+
+def record_cancelled_render(job, pending, partial_paths):
+    """
+    Marks a job whose encode was killed by cancellation as cancelled. With keep_partial,
+    the fragments each pending output got before the kill are published (see
+    finalize_partial_output); otherwise the partial files are removed.
+    """
+    partial_results = {}
+    for output, partial_path in zip(pending, partial_paths):
+        if not os.path.exists(partial_path):
+            continue  # segment-parallel encodes only write their outputs when joining the segments
+        url = finalize_partial_output(job, output, partial_path) if job["keep_partial"] else None
+        if url:
+            partial_results[output["output_filename"]] = url
+        else:
+            cleanup_files([partial_path])
+    outputs = [dict(output, partial_url=None, partial_result_url=partial_results.get(output["output_filename"]))
+               for output in job["outputs"]]
+    partial_result_url = primary_output(outputs)["partial_result_url"] or next(iter(partial_results.values()), None)
+    update_job(job, status="cancelled", error=CANCEL_MESSAGES[job["cancel_reason"]], finished_at=time.time(),
+               outputs=outputs, partial_url=None, partial_result_url=partial_result_url)
+
+
+def last_fragment_end(path):
+    """
+    Length of the playable prefix of a fragmented MP4 whose encode was killed: the end
+    of its last complete top-level mdat box (each fragment is a moof followed by its
+    mdat, after the empty moov up front). 0 if no fragment was completed.
+    """
+    end = offset = 0
+    size = os.path.getsize(path)
+    with open(path, 'rb') as mp4_file:
+        while offset + 8 <= size:
+            mp4_file.seek(offset)
+            header = mp4_file.read(16)
+            box_size, box_type = int.from_bytes(header[:4], 'big'), header[4:8]
+            if box_size == 1 and len(header) == 16:  # 64-bit box size
+                box_size = int.from_bytes(header[8:16], 'big')
+            if box_size < 8 or offset + box_size > size:
+                break  # cut off mid-box (size 0, "up to end of file", is never written in fragmented mode)
+            offset += box_size
+            if box_type == b'mdat':
+                end = offset
+    return end
+
+
+def finalize_partial_output(job, output, partial_path):
+    """
+    Publishes what a cancelled encode wrote to partial_path, truncated to its last
+    complete fragment, under a name of its own (it is not the output its cache key
+    describes). Returns its URL, or None if not even one fragment was finished.
+    """
+    try:
+        end = last_fragment_end(partial_path)
+    except OSError as e:
+        logging.warning(f"Could not read partial output {partial_path}: {e}")
+        return None
+    if not end:
+        return None
+    partial_key = hashlib.sha256(f"{output['cache_key']}:partial:{job['job_id']}".encode('utf-8')).hexdigest()
+    filename = f"{partial_key}_{output['method']}_partial.mp4"
+    with open(partial_path, 'r+b') as partial_file:
+        partial_file.truncate(end)
+    os.replace(partial_path, os.path.join(app.config['OUTPUT_FOLDER'], filename))
+    result_cache.put(partial_key, filename)
+    logging.info(f"Kept the first {end} bytes of cancelled output {output['output_filename']} as {filename}")
+    return f"/outputs/{filename}"
+
+
+def publish_thumbnails(cache_key, sprite_path, track_path, plan):
+    """
+    Moves an encoded sprite sheet into place, writes its WebVTT track and adds both to
+    the result cache. Returns the output fields pointing at them (empty if ffmpeg wrote no sheet).
+    """
+    sprite_partial = partial_output_path(sprite_path)
+    if not os.path.exists(sprite_partial):
+        logging.warning(f"No sprite sheet was written to {sprite_partial}.")
+        return {}
+    os.replace(sprite_partial, sprite_path)
+    track_partial = partial_output_path(track_path)
+    write_thumbnail_track(track_partial, os.path.basename(sprite_path), plan)
+    os.replace(track_partial, track_path)
+    sprite_key, track_key = thumbnail_keys(cache_key)
+    result_cache.put(sprite_key, os.path.basename(sprite_path))
+    result_cache.put(track_key, os.path.basename(track_path))
+    return {"sprite_url": f"/outputs/{os.path.basename(sprite_path)}",
+            "thumbnails_url": f"/outputs/{os.path.basename(track_path)}"}
+
+
+def fragmented_output_options():
+    """Output options for fragmented MP4 with a keyframe (and so a fragment) every FRAGMENT_SECONDS."""
+    return FRAGMENTED_MP4_OPTIONS + ['-force_key_frames', f"expr:gte(t,n_forced*{FRAGMENT_SECONDS:g})"]
+
+
+def find_encoding_job(filename):
+    """Returns the queued or running job that will produce output filename, or None."""
+    with jobs_lock:
+        for job in jobs.values():
+            if job["status"] in ("queued", "running") and any(
+                    output.get("partial_url") and output["output_filename"] == filename for output in job["outputs"]):
+                return job
+    return None
+
+
+def output_is_announced(job, filename):
+    """True while job is queued or running and has announced output filename with a partial_url."""
+    return job["status"] in ("queued", "running") and any(
+        output.get("partial_url") and output["output_filename"] == filename for output in job["outputs"])
+
+
+def output_is_encoding(job, filename):
+    """
+    True while job is still writing output filename: the output is announced and its
+    partial file exists. A preview's partial file is renamed into place when the
+    preview finishes, although the job keeps running its other renditions.
+    """
+    return output_is_announced(job, filename) and \
+        os.path.exists(partial_output_path(os.path.join(app.config['OUTPUT_FOLDER'], filename)))
+
+
+def iter_growing_file(path, is_growing, chunk_size=64 * 1024, poll_seconds=PARTIAL_OUTPUT_POLL_SECONDS):
+    """
+    Yields the contents of a file that is still being written, following it until
+    is_growing() turns false and everything written so far has been sent. The open
+    handle survives the file being renamed into place when the encode finishes.
+    """
+    with open(path, 'rb') as growing_file:
+        while True:
+            chunk = growing_file.read(chunk_size)
+            if chunk:
+                yield chunk
+            elif is_growing():
+                time.sleep(poll_seconds)
+            else:
+                remainder = growing_file.read()
+                if remainder:
+                    yield remainder
+                return
+
+
+def run_frame_metrics_job(job):
+    """Computes per-frame PSNR/SSIM/difference for a job and stores the JSON report as its output."""
+    output = job["outputs"][0]
+    output_path = os.path.join(app.config['OUTPUT_FOLDER'], output["output_filename"])
+    started_at = time.time()
+    update_job(job, status="running", started_at=started_at)
+
+    info1, info2 = get_video_info(job["input1_path"]), get_video_info(job["input2_path"])
+    alignment = align_job_inputs(job, info1, info2)
+    # Compare at the first input's aspect ratio so both streams have identical dimensions
+    target_width = None
+    if info1 and info1["width"] and info1["height"]:
+        target_width = max(2, int(round(info1["width"] * TARGET_HEIGHT / info1["height"] / 2)) * 2)
+    info1, info2 = aligned_video_info(info1, alignment, 0), aligned_video_info(info2, alignment, 1)
+    series, error = compute_frame_metrics(job["input1_path"], job["input2_path"], TARGET_HEIGHT, target_width,
+                                          on_progress=make_progress_callback(job, estimate_output_duration(info1, info2)),
+                                          alignment=alignment, job=job)
+    if error is not None:
+        logging.error(f"FFMPEG metrics failed (job {job['job_id']}): {error}")
+        update_job(job, status="failed", finished_at=time.time(),
+                   error=f"Frame metrics failed. Check server logs. Details: {error}...")
+        return
+
+    report = summarize_frame_metrics(series, fps=info1["fps"] if info1 else None,
+                                     top_n=job["options"].get("top_n", METRICS_TOP_N))
+    partial_path = partial_output_path(output_path)
+    with open(partial_path, 'w') as report_file:
+        json.dump(report, report_file, separators=(',', ':'))
+    os.replace(partial_path, output_path)
+    result_cache.put(output["cache_key"], output["output_filename"])
+
+    elapsed = time.time() - started_at
+    encode_fps = round(report["frames"] / elapsed, 2) if elapsed > 0 else None
+    logging.info(f"Frame metrics complete (job {job['job_id']}): {report['frames']} frames in {elapsed:.1f}s")
+    outputs = [dict(output, output_url=f"/outputs/{output['output_filename']}")]
+    update_job(job, status="completed", progress=1.0, finished_at=time.time(), encode_fps=encode_fps, outputs=outputs,
+               output_url=outputs[0]["output_url"], output_filename=outputs[0]["output_filename"])
+
+
+def run_changed_segments_job(job):
+    """
+    Finds the time ranges where the inputs differ with a low-resolution difference scan,
+    renders only those ranges (padded) at TARGET_HEIGHT, concatenates them into a
+    highlight reel, and stores a JSON index of the ranges as the job's output.
+    """
+    output = job["outputs"][0]
+    options = job["options"]
+    index_path = os.path.join(app.config['OUTPUT_FOLDER'], output["output_filename"])
+    method = options.get("highlight_method", CHANGED_SEGMENTS_METHOD)
+    threshold = options.get("diff_threshold", CHANGED_SEGMENTS_THRESHOLD)
+    padding = options.get("padding", CHANGED_SEGMENTS_PADDING_SECONDS)
+    playback_speed = parse_playback_speed(job["playback_speed"])
+    started_at = time.time()
+    update_job(job, status="running", started_at=started_at)
+
+    info1, info2 = get_video_info(job["input1_path"]), get_video_info(job["input2_path"])
+    alignment = align_job_inputs(job, info1, info2)
+    info1, info2 = aligned_video_info(info1, alignment, 0), aligned_video_info(info2, alignment, 1)
+    if not info1 or not info1["fps"] or not info1["width"] or not info1["height"]:
+        update_job(job, status="failed", finished_at=time.time(), error="Could not read the frame rate of the inputs.")
+        return
+    fps = info1["fps"]
+    input_paths, _ = resolve_input_proxies([job["input1_path"], job["input2_path"]], [info1, info2], TARGET_HEIGHT,
+                                           allow_build=False)
+
+    # 1. Cheap difference scan (the scan's frames are the reel's frames: same inputs, alignment and rate)
+    scan_width = max(2, int(round(info1["width"] * CHANGED_SEGMENTS_SCAN_HEIGHT / info1["height"] / 2)) * 2)
+    series, error = compute_frame_metrics(input_paths[0], input_paths[1], CHANGED_SEGMENTS_SCAN_HEIGHT, scan_width,
+                                          metric_names=('mad',), alignment=alignment, label='changed_segments_scan',
+                                          job=job,
+                                          on_progress=make_progress_callback(job, estimate_output_duration(info1, info2),
+                                                                             span=(0.0, 0.25)))
+    if error is not None:
+        logging.error(f"FFMPEG difference scan failed (job {job['job_id']}): {error}")
+        update_job(job, status="failed", finished_at=time.time(),
+                   error=f"Difference scan failed. Check server logs. Details: {error}...")
+        return
+    ranges = find_changed_ranges(series['mad'], fps, threshold, padding)
+    update_job(job, progress=0.25, segments=len(ranges))
+
+    # 2. Render only the changed ranges and join them without re-encoding
+    reel_url = None
+    if ranges:
+        reel_key = highlight_reel_key(output["cache_key"])
+        reel_filename = f"{reel_key}_changed_segments_{method}_s{str(playback_speed).replace('.', 'p')}x_reel.mp4"
+        reel_path = os.path.join(app.config['OUTPUT_FOLDER'], reel_filename)
+        reel_frames = sum(changed["frame_count"] for changed in ranges)
+        logging.info(f"Rendering {len(ranges)} changed range(s), {reel_frames} of {len(series['mad'])} frames "
+                     f"(job {job['job_id']})")
+        profile = job["encode_profile"]
+        returncode, stderr_text = run_segmented_ffmpeg(
+            job, [method], fps, [(changed["first_frame"], changed["frame_count"]) for changed in ranges],
+            [partial_output_path(reel_path)], reel_frames / fps / playback_speed, ENCODE_PROFILES[profile],
+            [TARGET_HEIGHT], (0.25, 1.0), input_paths, alignment, blink_period_frames(options, fps, playback_speed))
+        if returncode != 0:
+            logging.error(f"FFMPEG highlight reel failed (job {job['job_id']}): {stderr_text}")
+            update_job(job, status="failed", finished_at=time.time(),
+                       error=f"Highlight reel failed. Check server logs. Details: {stderr_text[-500:]}...")
+            cleanup_files([partial_output_path(reel_path)])
+            return
+        os.replace(partial_output_path(reel_path), reel_path)
+        result_cache.put(reel_key, reel_filename)
+        reel_url = f"/outputs/{reel_filename}"
+
+    # 3. JSON index: source and reel time of every range
+    reel_time = 0.0
+    for changed in ranges:
+        duration = changed["frame_count"] / fps
+        changed.update(start=round(changed["first_frame"] / fps, 4), end=round(changed["first_frame"] / fps + duration, 4),
+                       reel_start=round(reel_time / playback_speed, 4),
+                       reel_end=round((reel_time + duration) / playback_speed, 4))
+        reel_time += duration
+    index = {
+        "method": method,
+        "threshold": threshold,
+        "padding": padding,
+        "fps": fps,
+        "frames": len(series['mad']),
+        "changed_frames": sum(changed["changed_frames"] for changed in ranges),
+        "reel_url": reel_url,
+        "reel_duration": round(reel_time / playback_speed, 4),
+        "ranges": ranges,
+    }
+    with open(partial_output_path(index_path), 'w') as index_file:
+        json.dump(index, index_file, separators=(',', ':'))
+    os.replace(partial_output_path(index_path), index_path)
+    result_cache.put(output["cache_key"], output["output_filename"])
+
+    elapsed = time.time() - started_at
+    logging.info(f"Changed segments complete (job {job['job_id']}): {len(ranges)} range(s), "
+                 f"{index['reel_duration']}s reel from {index['frames']} frames in {elapsed:.1f}s")
+    outputs = [dict(output, output_url=f"/outputs/{output['output_filename']}", reel_url=reel_url)]
+    update_job(job, status="completed", progress=1.0, finished_at=time.time(), outputs=outputs,
+               encode_fps=round(index["frames"] / elapsed, 2) if elapsed > 0 else None,
+               output_url=outputs[0]["output_url"], output_filename=outputs[0]["output_filename"])
+
+
+def get_segment_command(methods, input1, input2, segment_paths, fps, segment, target_height=None, playback_speed=1.0,
+                        output_options=None, encoder_settings=None, output_heights=None, alignment=None,
+                        blink_period=1):
+    """
+    Constructs the command rendering one (first_frame, frame_count) segment of a
+    comparison. Both inputs are seeked half a frame before first_frame, so float
+    rounding can never skip or repeat a boundary frame, and the window's timestamps
+    restart at zero. The output stops after the segment's frame_count source frames,
+    i.e. segment_output_frames(frame_count, playback_speed) output frames.
+    """
+    first_frame, frame_count = segment
+    start_time = max(0.0, (first_frame - 0.5) / fps) if first_frame else None
+    input_duration = (frame_count + 1) / fps if frame_count else None
+    output_options = list(output_options or []) + ['-force_key_frames', f"expr:gte(t,n_forced*{FRAGMENT_SECONDS:g})"]
+    if frame_count:
+        output_options += ['-frames:v', str(segment_output_frames(frame_count, playback_speed))]
+    return get_multi_ffmpeg_command(methods, input1, input2, segment_paths, target_height, playback_speed,
+                                    start_time=start_time, input_duration=input_duration, frame_offset=first_frame,
+                                    output_options=output_options, encoder_settings=encoder_settings,
+                                    output_heights=output_heights, alignment=alignment, blink_period=blink_period)
+
+
+def get_concat_command(concat_list_path, output_path):
+    """Joins the segment files listed in a concat demuxer list into output_path without re-encoding."""
+    return [
+        FFMPEG_PATH, '-nostats', '-progress', 'pipe:1',
+        '-f', 'concat', '-safe', '0', '-i', concat_list_path,
+        '-c', 'copy', *FRAGMENTED_MP4_OPTIONS, '-y', output_path,
+    ]
+
+
+def run_segmented_ffmpeg(job, methods, fps, segments, output_paths, output_duration=None, encoder_settings=None,
+                         output_heights=None, progress_span=(0.0, 1.0), input_paths=None, alignment=None,
+                         blink_period=1):
+    """
+    Renders comparisons as frame-aligned time segments in parallel ffmpeg processes
+    and joins each output's segments with the concat demuxer (stream copy, no re-encode).
+    Each segment is cut by source frame (see get_segment_command), so every source frame
+    lands in exactly one segment; at 1/n playback speeds the joined output is
+    frame-identical to a single pass.
+    input_paths overrides the job's inputs (e.g. with cached input proxies); fps and
+    segment boundaries are those of the aligned inputs. blink_period is the interleave
+    period in frames (its phase continues across segments).
+    Returns (returncode, stderr_text) like run_ffmpeg.
+    """
+    input1_path, input2_path = input_paths or (job["input1_path"], job["input2_path"])
+    segment_dir = tempfile.mkdtemp(prefix='.segments_', dir=app.config['OUTPUT_FOLDER'])
+    concurrency = min(len(segments), PARALLEL_SEGMENTS)
+    threads_per_segment = max(1, (os.cpu_count() or 1) // concurrency)
+    segment_progress = {}
+
+    def on_segment_progress(index, snapshot):
+        with jobs_lock:
+            segment_progress[index] = snapshot
+            totals = {
+                "frame": sum(p["frame"] for p in segment_progress.values()),
+                "fps": round(sum(p["fps"] for p in segment_progress.values()), 2),
+                "out_time": sum(p["out_time"] for p in segment_progress.values()),
+                "speed": None,
+            }
+        fields = {"encode": totals}
+        if output_duration:
+            fields["progress"] = span_progress(totals["out_time"] / output_duration, progress_span)
+        update_job(job, **fields)
+
+    def render_segment(index):
+        segment_paths = [os.path.join(segment_dir, f"{output_index:02d}_{method}_{index:04d}.mp4")
+                         for output_index, method in enumerate(methods)]
+        command = get_segment_command(methods, input1_path, input2_path, segment_paths, fps, segments[index],
+                                      max(output_heights or [TARGET_HEIGHT]), job["playback_speed"],
+                                      ['-threads', str(threads_per_segment)], encoder_settings, output_heights,
+                                      alignment, blink_period)
+        returncode, stderr_text = run_ffmpeg(command, on_progress=lambda snapshot: on_segment_progress(index, snapshot),
+                                             label=methods_label(methods), job=job)
+        return segment_paths, returncode, stderr_text
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"segment-{job['job_id'][:8]}") as pool:
+            results = list(pool.map(render_segment, range(len(segments))))
+        for index, (_, returncode, stderr_text) in enumerate(results):
+            if returncode != 0:
+                return returncode, f"Segment {index} failed: {stderr_text}"
+
+        for output_index, (method, output_path) in enumerate(zip(methods, output_paths)):
+            concat_list_path = os.path.join(segment_dir, f"{output_index:02d}_{method}_segments.txt")
+            with open(concat_list_path, 'w') as concat_list:
+                for segment_paths, _, _ in results:
+                    concat_list.write(f"file '{os.path.abspath(segment_paths[output_index])}'\n")
+            returncode, stderr_text = run_ffmpeg(get_concat_command(concat_list_path, output_path), label='concat', job=job)
+            if returncode != 0:
+                return returncode, stderr_text
+        return 0, ""
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+
+profile_stats = {}  # encode profile -> {"outputs", "encode_fps_total", "output_bytes_total"}
+profile_stats_lock = threading.Lock()
+
+
+def record_profile_stats(profile, encode_fps, output_bytes):
+    """Accumulates measured encode speed and output size per encode profile."""
+    with profile_stats_lock:
+        stats = profile_stats.setdefault(profile, {"outputs": 0, "encode_fps_total": 0.0, "output_bytes_total": 0})
+        stats["outputs"] += 1
+        stats["encode_fps_total"] += encode_fps or 0.0
+        stats["output_bytes_total"] += output_bytes
+
+
+def get_profile_stats():
+    """Returns mean encode fps and output size per encode profile."""
+    with profile_stats_lock:
+        return {
+            profile: {
+                "outputs": stats["outputs"],
+                "mean_encode_fps": round(stats["encode_fps_total"] / stats["outputs"], 2),
+                "mean_output_bytes": stats["output_bytes_total"] // stats["outputs"],
+            }
+            for profile, stats in profile_stats.items()
+        }
+
+
+def span_progress(fraction, span=(0.0, 1.0)):
+    """Maps the completed fraction of one encode pass onto its share (start, end) of the job."""
+    start, end = span
+    return round(start + (end - start) * min(fraction, 0.99), 4)
+
+
+def make_progress_callback(job, output_duration=None, span=(0.0, 1.0)):
+    """
+    Returns an on_progress callback that records ffmpeg progress snapshots on a job.
+    span is the share of overall job progress covered by this ffmpeg run.
+    """
+    def on_progress(snapshot):
+        fields = {"encode": {key: snapshot[key] for key in ("frame", "fps", "out_time", "speed")}}
+        if output_duration:
+            fields["progress"] = span_progress(snapshot["out_time"] / output_duration, span)
+        update_job(job, **fields)
+    return on_progress
+
+
+# --- Batches ---
+# A batch compares every reference against every candidate. Its uploads are shared by
+# many jobs, so the batch (not the jobs) owns them and removes them once all its jobs
+# have finished.
+
+
+def create_batch(pairs, cleanup_paths):
+    """
+    Registers a batch. pairs is a list of dicts with reference and candidate (names)
+    and job_ids (method group -> job id); returns the batch dict.
+    """
+    batch = {
+        "batch_id": str(uuid.uuid4()),
+        "created_at": time.time(),
+        "finished_at": None,
+        "pairs": pairs,
+        "cleanup_paths": list(cleanup_paths),
+    }
+    with jobs_lock:
+        batches[batch["batch_id"]] = batch
+    release_finished_batches()
+    return batch
+
+
+def release_finished_batches():
+    """Marks batches whose jobs have all finished as done and removes their uploads."""
+    finished = []
+    with jobs_lock:
+        for batch in batches.values():
+            if batch["finished_at"] is not None:
+                continue
+            batch_jobs = [jobs.get(job_id) for pair in batch["pairs"] for job_id in pair["job_ids"].values()]
+            if all(job is None or job["status"] in JOB_FINAL_STATUSES for job in batch_jobs):
+                batch["finished_at"] = max([job["finished_at"] for job in batch_jobs if job] or [time.time()])
+                finished.append(batch)
+    for batch in finished:
+        cleanup_files(batch["cleanup_paths"])
+        logging.info(f"Batch {batch['batch_id']} finished ({len(batch['pairs'])} pairs); removed its uploads.")
+
+
+def read_metrics_summary(job):
+    """Mean PSNR/SSIM/difference from a completed frame_metrics job's report (None if unavailable)."""
+    if job is None or job["status"] != "completed" or not job["output_filename"]:
+        return None
+    try:
+        with open(os.path.join(app.config['OUTPUT_FOLDER'], job["output_filename"])) as report_file:
+            summary = json.load(report_file)["summary"]
+    except (OSError, ValueError, KeyError):
+        return None
+    return {metric: values["mean"] for metric, values in summary.items()}
+
+
+def get_batch_manifest(batch_id):
+    """
+    Builds a batch's manifest: per pair its status, outputs and metrics summary, plus
+    status counts, elapsed time and throughput in pairs per minute. None if unknown.
+    """
+    with jobs_lock:
+        batch = batches.get(batch_id)
+        if batch is None:
+            return None
+        pair_jobs = [{group: jobs.get(job_id) for group, job_id in pair["job_ids"].items()} for pair in batch["pairs"]]
+        pair_views = [{group: _public_job_view(job) if job else None for group, job in groups.items()}
+                      for groups in pair_jobs]
+        created_at, finished_at = batch["created_at"], batch["finished_at"]
+
+    manifest_pairs = []
+    counts = {"queued": 0, "running": 0, "completed": 0, "failed": 0, "cancelled": 0, "expired": 0}
+    for pair, views in zip(batch["pairs"], pair_views):
+        statuses = [view["status"] if view else "expired" for view in views.values()]
+        status = next((candidate for candidate in ("failed", "cancelled", "expired", "running", "queued")
+                       if candidate in statuses),
+                      "completed")
+        counts[status] += 1
+        if "metrics_summary" not in pair and views.get("metrics") and views["metrics"]["status"] == "completed":
+            summary = read_metrics_summary(views["metrics"])
+            with jobs_lock:
+                pair["metrics_summary"] = summary
+        manifest_pairs.append({
+            "reference": pair["reference"],
+            "candidate": pair["candidate"],
+            "status": status,
+            "job_ids": dict(pair["job_ids"]),
+            "outputs": [{key: output.get(key) for key in ("method", "resolution", "output_url", "cached")}
+                        for view in views.values() if view for output in view["outputs"]],
+            "metrics": pair.get("metrics_summary"),
+            "encode_fps": views["comparison"]["encode_fps"] if views.get("comparison") else None,
+            "error": next((view["error"] for view in views.values() if view and view["error"]), None),
+        })
+
+    elapsed = (finished_at or time.time()) - created_at
+    return {
+        "batch_id": batch_id,
+        "status": "completed" if finished_at is not None else "running",
+        "pairs": manifest_pairs,
+        "counts": counts,
+        "created_at": created_at,
+        "finished_at": finished_at,
+        "elapsed_seconds": round(elapsed, 2),
+        "pairs_per_minute": round(counts["completed"] / elapsed * 60, 2) if elapsed > 0 else None,
+    }
+
+
+# --- Route Handlers ---
+
+def parse_list_field(values, name):
+    """
+    Reads a list-valued field from form or JSON values: a JSON list, a comma-separated
+    string, or a repeated form field. Returns a de-duplicated list in request order.
+    """
+    if hasattr(values, 'getlist'):
+        raw_items = values.getlist(name)
+    else:
+        raw_items = values.get(name) or []
+        if not isinstance(raw_items, list):
+            raw_items = [raw_items]
+    items = []
+    for item in raw_items:
+        items.extend(part.strip() for part in str(item).split(',') if part.strip())
+    return list(dict.fromkeys(items))
+
+
+def parse_comparison_methods(values):
+    """
+    Reads the requested comparison methods from form or JSON values: either a
+    'comparison_methods' list (or comma-separated string, or repeated form field)
+    or a single 'comparison_method'. Returns a de-duplicated list in request order.
+    """
+    methods = parse_list_field(values, 'comparison_methods')
+    if not methods and values.get('comparison_method'):
+        methods = [values.get('comparison_method')]
+    return list(dict.fromkeys(methods))
+
+
+def parse_job_options(values):
+    """
+    Extracts optional per-request comparison settings from form or JSON values.
+    Returns (options, error_message); error_message is None when all values are valid.
+    """
+    options = {}
+    top_n = values.get('top_n')
+    if top_n is not None:
+        try:
+            options['top_n'] = max(1, int(top_n))
+        except (TypeError, ValueError):
+            return None, f"Invalid top_n: {top_n}"
+    encode_profile = values.get('encode_profile')
+    if encode_profile:
+        if encode_profile not in ENCODE_PROFILES:
+            return None, f"Invalid encode_profile: {encode_profile}. Allowed: " + ", ".join(sorted(ENCODE_PROFILES))
+        options['encode_profile'] = encode_profile
+    encode_mode = values.get('encode_mode')
+    if encode_mode:
+        if encode_mode not in ENCODE_MODES:
+            return None, f"Invalid encode_mode: {encode_mode}. Allowed: " + ", ".join(sorted(ENCODE_MODES))
+        options['encode_mode'] = encode_mode
+    for name, minimum in (('diff_threshold', 0.0), ('padding', 0.0)):
+        value = values.get(name)
+        if value not in (None, ''):
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                return None, f"Invalid {name}: {value}"
+            # Checked before clamping: max() would turn NaN into the minimum
+            if not math.isfinite(number):
+                return None, f"Invalid {name}: {value}"
+            options[name] = max(minimum, number)
+    highlight_method = values.get('highlight_method')
+    if highlight_method:
+        if highlight_method not in COMPARISON_METHODS:
+            return None, f"Invalid highlight_method: {highlight_method}. Allowed: " + ", ".join(sorted(COMPARISON_METHODS))
+        options['highlight_method'] = highlight_method
+    time_offset = values.get('time_offset')
+    if time_offset not in (None, ''):
+        if time_offset != 'auto':
+            try:
+                time_offset = float(time_offset)
+            except (TypeError, ValueError):
+                return None, f"Invalid time_offset: {time_offset}. Use seconds or 'auto'"
+            if not math.isfinite(time_offset):
+                return None, f"Invalid time_offset: {time_offset}. Use seconds or 'auto'"
+        options['time_offset'] = time_offset
+    backend = values.get('backend')
+    if backend:
+        if backend not in COMPARISON_BACKENDS:
+            return None, f"Invalid backend: {backend}. Allowed: " + ", ".join(sorted(COMPARISON_BACKENDS))
+        options['backend'] = backend
+    blink_period = values.get('blink_period')
+    if blink_period not in (None, ''):
+        text = str(blink_period).strip().lower()
+        unit, limit = ('ms', BLINK_MAX_PERIOD_MS) if text.endswith('ms') else ('frames', BLINK_MAX_PERIOD_FRAMES)
+        try:
+            period = int(text[:-2] if unit == 'ms' else text)
+        except ValueError:
+            return None, f"Invalid blink_period: {blink_period}. Use a frame count or milliseconds (e.g. 250ms)"
+        if not 1 <= period <= limit:
+            return None, f"Invalid blink_period: {blink_period}. Allowed: 1-{limit} {unit}"
+        if (unit, period) != ('frames', 1):
+            options['blink_period'] = {unit: period}
+    if str(values.get('blink_vfr', '')).lower() in ('1', 'true', 'yes', 'on'):
+        options['blink_vfr'] = True
+    if str(values.get('thumbnails', '')).lower() in ('1', 'true', 'yes', 'on'):
+        options['thumbnails'] = True
+    resolutions = parse_list_field(values, 'resolution')
+    if resolutions:
+        invalid_resolutions = [resolution for resolution in resolutions if resolution not in RESOLUTION_TIERS]
+        if invalid_resolutions:
+            return None, (f"Invalid resolution: {', '.join(invalid_resolutions)}. Allowed: "
+                          + ", ".join(RESOLUTION_TIERS))
+        options['resolutions'] = sorted(resolutions, key=RESOLUTION_TIERS.get)
+    return options, None
+
+
+def changed_segments_reel_cached(cache_key, index_filename):
+    """True if a cached changed_segments index can be served: its reel (if any) is still cached."""
+    try:
+        with open(os.path.join(app.config['OUTPUT_FOLDER'], index_filename)) as index_file:
+            has_reel = json.load(index_file).get("reel_url") is not None
+    except (OSError, ValueError):
+        return False
+    return not has_reel or result_cache.get(highlight_reel_key(cache_key)) is not None
+
+
+def validate_comparison_methods(methods, options=None):
+    """Returns an error message if the requested methods cannot be run as one job, else None."""
+    invalid_methods = [method for method in methods
+                       if method not in COMPARISON_METHODS | ANALYSIS_METHODS | RAW_FRAME_METHODS]
+    if not methods or invalid_methods:
+        return f"Invalid comparison method: {', '.join(invalid_methods) or 'none given'}"
+    if len(methods) > 1 and ANALYSIS_METHODS & set(methods):
+        return f"{', '.join(sorted(ANALYSIS_METHODS & set(methods)))} cannot be combined with other comparison methods"
+    if comparison_backend(methods, options) == 'numpy' and not ANALYSIS_METHODS & set(methods):
+        if np is None:
+            return "The numpy backend (and heatmap, threshold_mask, channel_difference) requires NumPy, which is not installed"
+        unsupported = [method for method in methods if method not in RAW_FRAME_KERNELS]
+        if unsupported:
+            return f"{', '.join(unsupported)} cannot be rendered by the numpy backend"
+    return None
+
+
+def process_request(methods, input1_path, input2_path, playback_speed, is_local=False, cleanup_paths=None, options=None,
+                    client=None):
+    """
+    Shared logic for video comparison requests: validates the methods and queues one
+    job that renders every method not already in the result cache in a single pass.
+    Takes ownership of cleanup_paths; they are removed once the job finishes
+    (or immediately if the request is rejected or fully answered from the cache).
+    Answers 429 with Retry-After when admission control refuses the job.
+    """
+    error = validate_comparison_methods(methods, options)
+    if error:
+        cleanup_files(list(cleanup_paths or []))
+        return jsonify({"error": error}), 400
+    try:
+        body, cached = submit_comparison(methods, input1_path, input2_path, playback_speed, is_local, cleanup_paths,
+                                         options, client)
+    except AdmissionRejected as e:
+        return jsonify({"error": str(e), "retry_after": e.retry_after}), 429, {"Retry-After": str(e.retry_after)}
+    if cached:
+        return jsonify(body), 200
+    return jsonify(body), 202, {"Location": body["status_url"]}
+
+
+def submit_comparison(methods, input1_path, input2_path, playback_speed, is_local=False, cleanup_paths=None,
+                      options=None, client=None, admit=True):
+    """
+    Answers validated comparison methods from the result cache or queues (or joins) the
+    job rendering them. Returns (body, cached): the completed job's status when every
+    output was cached, else the queued job's id, status and status_url.
+    A new job is scheduled by its estimated cost on behalf of client; unless admit is
+    False, AdmissionRejected is raised (after cleaning up) when the queue is saturated.
+    Takes ownership of cleanup_paths like process_request.
+    """
+    options = options or {}
+    input1_hash, input2_hash = hash_file(input1_path), hash_file(input2_path)
+    alignment_variant = {"time_offset": options["time_offset"]} if options.get("time_offset") else {}
+    blink_variant = {key: options[key] for key in ('blink_period', 'blink_vfr') if key in options}
+    backend = comparison_backend(methods, options)
+    outputs = []
+    for method in methods:
+        if method == 'changed_segments':
+            # The highlight reel is a video: speed and encode profile matter, resolution tiers do not
+            variant = {"threshold": options.get("diff_threshold", CHANGED_SEGMENTS_THRESHOLD),
+                       "padding": options.get("padding", CHANGED_SEGMENTS_PADDING_SECONDS),
+                       "highlight_method": options.get("highlight_method", CHANGED_SEGMENTS_METHOD),
+                       **alignment_variant}
+            if variant["highlight_method"] == 'interleave' and 'blink_period' in options:
+                variant["blink_period"] = options["blink_period"]  # the reel is segmented, so never VFR
+            renditions = [(None, compute_result_key(
+                input1_hash, input2_hash, method, playback_speed, variant=variant,
+                encoder_settings=ENCODE_PROFILES[options.get("encode_profile", DEFAULT_ENCODE_PROFILE)]))]
+        elif method in ANALYSIS_METHODS:
+            # Analysis reports do not depend on playback speed or output resolution
+            renditions = [(None, compute_result_key(input1_hash, input2_hash, method, 1.0,
+                                                    variant={"top_n": options.get("top_n", METRICS_TOP_N),
+                                                             **alignment_variant}))]
+        else:
+            encoder_settings = ENCODE_PROFILES[options.get("encode_profile", DEFAULT_ENCODE_PROFILE)]
+            renditions = []
+            for resolution in options.get("resolutions", [DEFAULT_RESOLUTION]):
+                height = RESOLUTION_TIERS[resolution]
+                renditions.append((resolution, compute_result_key(
+                    input1_hash, input2_hash, method, playback_speed, height,
+                    variant={"scaler": scaler_flags_for(height), **alignment_variant,
+                             **(blink_variant if method == 'interleave' else {}),
+                             **raw_frame_variant(method, backend, options)},
+                    encoder_settings=encoder_settings)))
+        for resolution, cache_key in renditions:
+            cached_filename = result_cache.get(cache_key)
+            if cached_filename and method == 'changed_segments' and not changed_segments_reel_cached(cache_key, cached_filename):
+                cached_filename = None  # the index outlived its reel
+            outputs.append({
+                "method": method,
+                "resolution": resolution,
+                "cache_key": cache_key,
+                "output_filename": cached_filename or output_filename_for(cache_key, method, playback_speed, resolution),
+                "output_url": f"/outputs/{cached_filename}" if cached_filename else None,
+                "cached": bool(cached_filename),
+            })
+
+    # Thumbnails belong to the primary output; it is rendered again if they were not cached with it
+    if options.get("thumbnails") and not ANALYSIS_METHODS & set(methods):
+        primary = primary_output(outputs)
+        primary["thumbnails"] = True
+        sprite_filename, track_filename = (result_cache.get(key) for key in thumbnail_keys(primary["cache_key"]))
+        if sprite_filename and track_filename:
+            primary.update(sprite_url=f"/outputs/{sprite_filename}", thumbnails_url=f"/outputs/{track_filename}")
+        else:
+            primary.update(output_url=None, cached=False,
+                           output_filename=output_filename_for(primary["cache_key"], primary["method"], playback_speed,
+                                                               primary["resolution"]))
+
+    # Repeat request: answer from the result cache without queueing anything
+    if all(output["cached"] for output in outputs):
+        cleanup_files(list(cleanup_paths or []))
+        job = create_job(methods, input1_path, input2_path, playback_speed, is_local, options=options, outputs=outputs)
+        primary = primary_output(outputs)
+        update_job(job, status="completed", progress=1.0, cached=True, finished_at=time.time(),
+                   output_url=primary["output_url"], output_filename=primary["output_filename"],
+                   thumbnails_url=primary.get("thumbnails_url"))
+        logging.info(f"Result cache hit for {', '.join(methods)}: {', '.join(o['output_filename'] for o in outputs)}")
+        return get_job_status(job["job_id"]), True
+
+    # Single-method jobs are shared by identical requests that arrive while they are in flight
+    # (a job that also renders thumbnails is shared under its track key)
+    cache_key = outputs[0]["cache_key"] if len(outputs) == 1 else None
+    if cache_key and outputs[0].get("thumbnails"):
+        cache_key = thumbnail_keys(cache_key)[1]
+    client = client or ("local" if is_local else "anonymous")
+    # Batch jobs are followed by the client that submitted the batch
+    follower = client[len("batch:"):] if client.startswith("batch:") else client
+    with jobs_lock:
+        joins_inflight = cache_key in inflight_results
+    cost_units = cost_seconds = None
+    if not joins_inflight:
+        cost_units = estimate_job_cost(outputs, get_video_info(input1_path), get_video_info(input2_path), playback_speed)
+        cost_seconds = job_queue.cost_seconds(cost_units)
+        delay = job_queue.admission_delay(cost_seconds, client) if admit else None
+        if delay is not None:
+            reason, retry_after = delay
+            cleanup_files(list(cleanup_paths or []))
+            metrics.inc('admission_rejections_total', reason=reason)
+            logging.warning(f"Refused {', '.join(methods)} job for {client} ({reason}, ~{cost_seconds:.0f}s); "
+                            f"retry after {retry_after}s")
+            raise AdmissionRejected("Too many comparisons queued" if reason == "client_limit"
+                                    else f"Server is busy; try again in {retry_after} seconds", retry_after)
+    job = create_job(methods, input1_path, input2_path, playback_speed, is_local, cleanup_paths, cache_key, options, outputs)
+    job.update(client=client, cost_units=cost_units, estimated_seconds=round(cost_seconds, 1) if cost_seconds else None)
+    with jobs_lock:
+        inflight_job_id = inflight_results.setdefault(cache_key, job["job_id"]) if cache_key else job["job_id"]
+        is_new_job = inflight_job_id == job["job_id"]
+        if not is_new_job:
+            # Identical request already queued or running: share its job
+            del jobs[job["job_id"]]
+            job = jobs[inflight_job_id]
+            job["last_seen"] = time.time()
+        job["followers"][follower] = job["followers"].get(follower, 0) + 1
+        status_url = f"/jobs/{job['job_id']}"
+        body = {"job_id": job["job_id"], "status": job["status"], "status_url": status_url}
+
+    if is_new_job:
+        enqueue_job(job)
+    else:
+        cleanup_files(list(cleanup_paths or []))
+        logging.info(f"Attaching request to in-flight job {inflight_job_id} (key {cache_key[:12]})")
+    return body, False
+
+
+def submit_batch(references, candidates, form, client):
+    """
+    Queues a batch from uploaded (filename, path) references and candidates and the
+    request's form fields. Each reference's input proxy is captured by its first encode,
+    so later pairs skip its source decode. Returns (body, error): the batch id, pair
+    count and status_url, or a message for a 400. Raises AdmissionRejected like
+    submit_comparison. Once a body is returned the batch owns the uploads.
+    """
+    if not references or not candidates:
+        return None, "Missing 'reference' or 'candidate' file(s) in request"
+    if len(references) * len(candidates) > BATCH_MAX_PAIRS:
+        return None, f"Too many pairs: {len(references) * len(candidates)} (max {BATCH_MAX_PAIRS})"
+    if not all(filename and allowed_file(filename) for filename, _ in references + candidates):
+        return None, "Invalid file type. Allowed: " + ", ".join(ALLOWED_EXTENSIONS)
+
+    methods = parse_comparison_methods(form) or ['frame_metrics']
+    options, options_error = parse_job_options(form)
+    if options_error:
+        return None, options_error
+    methods_error = validate_comparison_methods(methods, options)
+    if methods_error:
+        return None, methods_error
+    speed = form.get('playback_speed', '1.0')
+    # Per-pair metrics come from a frame_metrics job unless that is already the requested method
+    with_metrics = form.get('metrics', 'true').lower() not in ('0', 'false', 'no')
+
+    upload_paths = [path for _, path in references + candidates]
+    if 'frame_metrics' not in methods:
+        for _, reference_path in references:
+            info = get_video_info(reference_path)
+            heights = [RESOLUTION_TIERS[tier] for tier in options.get("resolutions", [DEFAULT_RESOLUTION])]
+            if info and info["height"]:
+                heights = [min(height, info["height"] // 2 * 2) for height in heights]
+            expect_input_reuse(reference_path, heights)
+
+    # Batch jobs form their own fairness flow, so they do not hold up the client's interactive requests.
+    # Only the first job goes through admission: a saturated server refuses the batch before anything is queued.
+    batch_client = f"batch:{client}"
+    pairs = []
+    for reference_name, reference_path in references:
+        for candidate_name, candidate_path in candidates:
+            job_ids = {}
+            body, _ = submit_comparison(methods, reference_path, candidate_path, speed, options=options,
+                                        client=batch_client, admit=not pairs)
+            job_ids["metrics" if methods == ['frame_metrics'] else "comparison"] = body["job_id"]
+            if with_metrics and 'frame_metrics' not in methods:
+                body, _ = submit_comparison(['frame_metrics'], reference_path, candidate_path, speed,
+                                            options=options, client=batch_client, admit=False)
+                job_ids["metrics"] = body["job_id"]
+            pairs.append({"reference": reference_name, "candidate": candidate_name, "job_ids": job_ids})
+    batch = create_batch(pairs, upload_paths)
+
+    logging.info(f"Queued batch {batch['batch_id']}: {len(references)} reference(s) x {len(candidates)} "
+                 f"candidate(s), methods: {', '.join(methods)}")
+    return {"batch_id": batch["batch_id"], "pairs": len(pairs), "status_url": f"/batches/{batch['batch_id']}"}, None
+
+
+@app.route('/compare', methods=['POST'])
+def compare_videos():
+    """
+    Handles video uploads and queues a comparison job. Uploads are streamed to disk
+    and validated while they arrive, and cleaned up when the job finishes.
+    """
+    logging.info("Received request to /compare (upload)")
+    handed_to_job = []
+
+    try:
+        # Validate request parts (accessing request.files streams the uploads to disk)
+        if 'video1' not in request.files or 'video2' not in request.files:
+            return jsonify({"error": "Missing video file(s) in request"}), 400
+        methods = parse_comparison_methods(request.form)
+        if not methods or 'playback_speed' not in request.form:
+             return jsonify({"error": "Missing 'comparison_method' or 'playback_speed' in request form"}), 400
+
+        video1 = request.files['video1']
+        video2 = request.files['video2']
+        speed = request.form['playback_speed']
+
+        # Validate methods and options before queueing anything
+        options, options_error = parse_job_options(request.form)
+        if options_error:
+            return jsonify({"error": options_error}), 400
+        methods_error = validate_comparison_methods(methods, options)
+        if methods_error:
+            return jsonify({"error": methods_error}), 400
+
+        # Validate files
+        if video1.filename == '' or video2.filename == '':
+            return jsonify({"error": "No selected file or empty filename"}), 400
+        if not (allowed_file(video1.filename) and allowed_file(video2.filename)):
+            # Log the actual filename and extension for debugging
+            logging.warning(f"Invalid file type submitted. Files: {video1.filename}, {video2.filename}. Allowed: {ALLOWED_EXTENSIONS}")
+            return jsonify({"error": "Invalid file type. Allowed: " + ", ".join(ALLOWED_EXTENSIONS)}), 400
+
+        # Uploads were already written (and hashed/probed) by StreamingUploadRequest
+        input1_path = video1.stream.path
+        input2_path = video2.stream.path
+        logging.info(f"Received input videos: {input1_path} ({video1.stream.bytes_written} bytes), "
+                     f"{input2_path} ({video2.stream.bytes_written} bytes)")
+
+        # Queue the comparison; the job now owns the uploaded files
+        response = process_request(methods, input1_path, input2_path, speed, is_local=False,
+                                   cleanup_paths=[input1_path, input2_path], options=options,
+                                   client=client_id_for(request))
+        handed_to_job = [input1_path, input2_path]
+        return response
+
+    except UploadRejected as e:
+        logging.warning(f"Rejected upload during streaming: {e}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.exception("An unexpected error occurred during /compare request.")
+        return jsonify({"error": f"An unexpected server error occurred: {str(e)}"}), 500
+    finally:
+        # Cleanup any streamed uploads that were not handed over to a job
+        leftovers = [path for path in request.streamed_upload_paths
+                     if path not in handed_to_job and os.path.exists(path)]
+        if leftovers:
+            cleanup_files(leftovers)
+            logging.info("Cleanup attempt finished for upload request.")
+
+
+@app.route('/compare_local', methods=['POST'])
+def compare_local_videos():
+    """Queues a comparison using predefined local files. Expects JSON body."""
+    logging.info("Received request to /compare_local (quick test)")
+    try:
+        # Validate request JSON
+        data = request.get_json()
+        methods = parse_comparison_methods(data) if isinstance(data, dict) else []
+        if not methods or 'playback_speed' not in data:
+             return jsonify({"error": "Missing 'comparison_method' or 'playback_speed' in request JSON body"}), 400
+
+        speed = data['playback_speed']
+        options, options_error = parse_job_options(data)
+        if options_error:
+            return jsonify({"error": options_error}), 400
+        input1_path = QUICK_TEST_FILE_1
+        input2_path = QUICK_TEST_FILE_2
+
+        # Check if predefined files exist
+        if not os.path.exists(input1_path) or not os.path.exists(input2_path):
+            logging.error(f"Quick test files not found: {input1_path}, {input2_path}")
+            return jsonify({"error": f"Sample files not found on server at {input1_path} and {input2_path}"}), 404
+
+        logging.info(f"Using local files for quick test: {input1_path}, {input2_path}")
+
+        # Process and get response
+        return process_request(methods, input1_path, input2_path, speed, is_local=True, options=options,
+                               client=client_id_for(request))
+
+    except Exception as e:
+        logging.exception("An unexpected error occurred during /compare_local request.")
+        return jsonify({"error": f"An unexpected server error occurred: {str(e)}"}), 500
+    # No finally/cleanup needed for local files
+
+
+@app.route('/batch', methods=['POST'])
+def compare_batch():
+    """
+    Queues one comparison per (reference, candidate) pair: every 'reference' file against
+    every 'candidate' file. Files are streamed to disk and hashed once as they arrive;
+    see submit_batch. Returns the batch manifest URL.
+    """
+    logging.info("Received request to /batch (upload)")
+    handed_to_batch = []
+    try:
+        references = [(upload.filename, upload.stream.path) for upload in request.files.getlist('reference')]
+        candidates = [(upload.filename, upload.stream.path) for upload in request.files.getlist('candidate')]
+        body, error = submit_batch(references, candidates, request.form, client_id_for(request))
+        if error:
+            return jsonify({"error": error}), 400
+        handed_to_batch = [path for _, path in references + candidates]
+        return jsonify(body), 202, {"Location": body["status_url"]}
+
+    except UploadRejected as e:
+        logging.warning(f"Rejected batch upload during streaming: {e}")
+        return jsonify({"error": str(e)}), 400
+    except AdmissionRejected as e:
+        return jsonify({"error": str(e), "retry_after": e.retry_after}), 429, {"Retry-After": str(e.retry_after)}
+    except Exception as e:
+        logging.exception("An unexpected error occurred during /batch request.")
+        return jsonify({"error": f"An unexpected server error occurred: {str(e)}"}), 500
+    finally:
+        leftovers = [path for path in request.streamed_upload_paths
+                     if path not in handed_to_batch and os.path.exists(path)]
+        if leftovers:
+            cleanup_files(leftovers)
+
+
+@app.route('/batches/<batch_id>')
+def batch_status(batch_id):
+    """Returns a batch manifest: per-pair status, outputs and metrics, and overall throughput."""
+    manifest = get_batch_manifest(batch_id)
+    if manifest is None:
+        return jsonify({"error": "Batch not found"}), 404
+    return jsonify(manifest), 200
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Returns status, progress and (once finished) the output URL of a queued comparison."""
+    status = get_job_status(job_id)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status), 200
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job_request(job_id):
+    """
+    Cancels a queued or running job. With keep_partial=true, a cancelled encode's
+    fragments so far are published as the job's partial_result_url. Answers 202 while
+    a running job's ffmpeg processes are being stopped, 200 once the job is final.
+    A job that identical requests of other clients still follow is not cancelled: the
+    caller's request is detached and the job's view (with its followers) returned with 200.
+    Clients that follow none of the job's requests are refused with 403.
+    """
+    keep_partial = request.args.get('keep_partial', '').lower() in ('1', 'true', 'yes', 'on')
+    try:
+        view = cancel_job(job_id, "client", keep_partial, client=client_id_for(request))
+    except CancelRefused as e:
+        return jsonify({"error": str(e)}), 403
+    if view is None:
+        return jsonify({"error": "Job not found"}), 404
+    stopping = view["cancel_reason"] is not None and view["status"] not in JOB_FINAL_STATUSES
+    return jsonify(view), 202 if stopping else 200
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events stream of a job's status and ffmpeg progress until it finishes."""
+    if get_job_status(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def event_stream():
+        for view in iter_job_updates(job_id):
+            if view is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {view['status']}\ndata: {json.dumps(view)}\n\n"
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(event_stream(), mimetype='text/event-stream', headers=headers)
+
+
+# --- Static File Serving ---
+
+def track_output_serving(response):
+    """Records serve time (until the response is closed) and bytes sent for a finished output."""
+    started = time.perf_counter()
+    has_body = request.method != 'HEAD' and response.status_code != 304
+
+    def on_close():
+        metrics.observe('stage_seconds', time.perf_counter() - started, stage='serve')
+        metrics.inc('bytes_out_total', (response.content_length or 0) if has_body else 0)
+
+    body = response.response
+    if response.direct_passthrough and hasattr(body, 'close'):
+        # The server consumes (and closes) the file wrapper directly; Response.close is never called
+        close_body = body.close
+
+        def close():
+            try:
+                close_body()
+            finally:
+                on_close()
+
+        body.close = close
+    else:
+        response.call_on_close(on_close)
+    return response
+
+
+def output_etag(filename, size):
+    """Strong ETag of a finished output: its content-addressed name plus its size."""
+    return f"{os.path.splitext(filename)[0]}-{size}"
+
+
+def send_output_file(filename):
+    """
+    Responds with a finished output (raises NotFound if it does not exist) according to
+    OUTPUT_SERVE_MODE, with a strong ETag and an immutable Cache-Control policy.
+    Conditional requests are answered here; Range requests by the app (direct) or by
+    the proxy the file is handed to.
+    """
+    path = safe_join(app.config['OUTPUT_FOLDER'], filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+    stat = os.stat(path)
+    etag = output_etag(filename, stat.st_size)
+
+    if OUTPUT_SERVE_MODE in ('x-accel', 'x-sendfile'):
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        response.make_conditional(request)
+        if response.status_code != 304:
+            if OUTPUT_SERVE_MODE == 'x-accel':
+                response.headers['X-Accel-Redirect'] = OUTPUT_ACCEL_PREFIX + filename
+            else:
+                response.headers['X-Sendfile'] = os.path.abspath(path)
+    else:
+        response = send_from_directory(app.config['OUTPUT_FOLDER'], filename, as_attachment=False,
+                                       conditional=True, etag=etag)
+        if response.status_code == 206 and request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+            # Werkzeug serves ranges through a Python read loop; hand gunicorn the file positioned at the
+            # range start instead, so it can sendfile(2) exactly Content-Length bytes
+            response.response.close()
+            output_file = open(path, 'rb')
+            output_file.seek(response.content_range.start)
+            response.response = request.environ['wsgi.file_wrapper'](output_file)
+    response.headers['Cache-Control'] = OUTPUT_CACHE_CONTROL
+    return response
+
+
+@app.route('/outputs/<filename>')
+def serve_output_video(filename):
+    """
+    Serves the generated video files from the output directory. Finished files support
+    Range and conditional requests; an output that is still being encoded is streamed
+    from its partial file as fragments are written.
+    """
+    logging.info(f"Serving output file: {filename}")
+    ensure_output_sweeper()
+    try:
+        response = send_output_file(filename)
+        result_cache.touch(filename)  # least recently served outputs are evicted first
+        return track_output_serving(response)
+    except NotFound:
+        pass
+
+    job = find_encoding_job(filename)
+    partial_path = partial_output_path(os.path.join(app.config['OUTPUT_FOLDER'], filename))
+    deadline = time.monotonic() + PARTIAL_OUTPUT_WAIT_SECONDS
+    while job is not None and not os.path.exists(partial_path) and output_is_announced(job, filename):
+        if time.monotonic() >= deadline:
+            # Do not hold a server thread for as long as ffmpeg takes to start
+            return jsonify({"error": "Output not started yet", "status": job["status"]}), 503, \
+                {"Retry-After": str(PARTIAL_OUTPUT_WAIT_SECONDS)}
+        time.sleep(PARTIAL_OUTPUT_POLL_SECONDS)  # ffmpeg has not created the file yet
+    stream = None
+    if job is not None and output_is_encoding(job, filename):
+        stream = iter_growing_file(partial_path, lambda: output_is_encoding(job, filename))
+        try:
+            first_chunk = next(stream, b'')  # opens the file now so a finished encode cannot race the response
+        except FileNotFoundError:
+            stream = None  # renamed into place just now
+    if stream is None:
+        try:
+            response = send_output_file(filename)  # finished (or failed) since the first lookup
+        except NotFound:
+            logging.error(f"Requested output file not found: {filename}")
+            return jsonify({"error": "File not found"}), 404
+        result_cache.touch(filename)
+        return track_output_serving(response)
+
+    def generate():
+        started = time.perf_counter()
+        sent = 0
+        try:
+            for chunk in itertools.chain((first_chunk,), stream):
+                sent += len(chunk)
+                touch_job(job)  # a client reading the partial output is following the job
+                yield chunk
+        finally:
+            metrics.observe('stage_seconds', time.perf_counter() - started, stage='serve_partial')
+            metrics.inc('bytes_out_total', sent)
+
+    logging.info(f"Streaming in-progress output {filename} (job {job['job_id']})")
+    return Response(generate(), mimetype='video/mp4',
+                    headers={"Cache-Control": "no-store", "Accept-Ranges": "none"})
+
+
+def get_health_stats():
+    """
+    Queue, cache, probe index and encode profile counters reported by /health, plus the
+    comparison backends this server can run (the page hides methods it cannot render).
+    """
+    return {"jobs": get_queue_stats(), "result_cache": result_cache.stats(),
+            "input_proxy_cache": input_proxy_cache.stats(), "probe_index": probe_index.stats(),
+            "encode_profiles": get_profile_stats(),
+            "comparison_backends": ['ffmpeg', 'numpy'] if np is not None else ['ffmpeg']}
+
+
+@app.route('/health')
+def health_check():
+    """Health check endpoint for Google Cloud Run."""
+    try:
+        # Quick check that FFMPEG is available
+        result = subprocess.run(['ffmpeg', '-version'], 
+                              capture_output=True, 
+                              text=True, 
+                              timeout=5)
+        if result.returncode == 0:
+            return jsonify({"status": "healthy", "ffmpeg": "available", **get_health_stats()}), 200
+        else:
+            return jsonify({"status": "unhealthy", "error": "ffmpeg not available"}), 500
+    except Exception as e:
+        return jsonify({"status": "unhealthy", "error": str(e)}), 500
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of stage timings, ffmpeg cost per method, queue depth and cache hit rates."""
+    queue_stats = get_queue_stats()
+    gauges = [
+        ('queue_depth', 'Jobs waiting for an ffmpeg runner.', [({}, job_queue.qsize())]),
+        ('jobs', 'Known jobs by status.', [({"status": status}, queue_stats[status]) for status in ("queued", "running")]),
+        ('workers', 'Configured ffmpeg runners.', [({}, FFMPEG_WORKERS)]),
+        ('queued_work_seconds', 'Estimated runner seconds of queued jobs.', [({}, queue_stats["queued_seconds"])]),
+    ]
+    for cache_name, cache in (("result", result_cache), ("input_proxy", input_proxy_cache)):
+        stats = cache.stats()
+        gauges += [
+            (f'{cache_name}_cache_hit_rate', f'Hit rate of the {cache_name} cache.', [({}, stats["hit_rate"])]),
+            (f'{cache_name}_cache_lookups', f'Lookups of the {cache_name} cache by result.',
+             [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])]),
+            (f'{cache_name}_cache_bytes', f'Bytes held by the {cache_name} cache.', [({}, stats["bytes"])]),
+            (f'{cache_name}_cache_reclaimed_bytes', f'Bytes freed from the {cache_name} cache by eviction and orphan removal.',
+             [({}, stats["reclaimed_bytes"])]),
+        ]
+    probe_stats = probe_index.stats()
+    gauges += [
+        ('probe_index_lookups', 'Probe index lookups by result.',
+         [({"result": "hit"}, probe_stats["hits"]), ({"result": "miss"}, probe_stats["misses"])]),
+        ('probe_index_entries', 'Inputs with a stored probe summary.', [({}, probe_stats["entries"] or 0)]),
+    ]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/')
@@ -0,0 +1,622 @@
+"""
+ASGI entry point serving tin-eye from a single event loop, for deployments that hold
+many concurrent connections open: large uploads, /jobs/<id>/events streams and
+downloads of long (or still encoding) outputs.
+
+    uvicorn asgi_app:application --host 0.0.0.0 --port 8080 --workers 1
+
+/compare, /compare_local, /batch, /outputs/<filename>, /jobs/<id>, /jobs/<id>/events
+and /health are handled on the loop: uploads are parsed incrementally with Werkzeug's
+sans-IO multipart decoder and written straight to disk (file writes, hashing and probe
+index lookups run on worker threads), outputs are streamed in chunks, and the
+ffprobe/ffmpeg calls made while answering a request run as asyncio subprocesses.
+Encodes stay on app.py's ffmpeg runner pool (FFMPEG_WORKERS), so CPU-bound work keeps a
+fixed parallelism however many connections are open. Every other route is passed to the
+Flask app on a worker thread. Jobs live in process memory, so run a single worker.
+"""
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.http import http_date, parse_etags, parse_if_range_header, parse_options_header, parse_range_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.security import safe_join
+
+import app
+
+OUTPUT_CHUNK_BYTES = 256 * 1024
+FORM_FIELD_MAX_BYTES = 1024 * 1024  # Non-file multipart fields are buffered in memory
+JSON_BODY_MAX_BYTES = 1024 * 1024
+WSGI_SPOOL_BYTES = 1024 * 1024  # Request bodies passed to Flask spill to disk beyond this
+HEALTH_CHECK_TIMEOUT_SECONDS = 5
+
+
+class ClientDisconnected(Exception):
+    """Raised while reading a request body the client has stopped sending."""
+
+
+class AsgiRequest:
+    """
+    The parts of an ASGI HTTP scope the handlers need. Exposes headers and remote_addr
+    like a Flask request, so app.client_id_for works on it unchanged.
+    """
+
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']])
+        self.args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.remote_addr = (scope.get('client') or (None,))[0]
+        self.disconnected = asyncio.Event()
+        self._receive = receive
+
+    async def iter_body(self):
+        """Yields the request body as it arrives."""
+        while True:
+            message = await self._receive()
+            if message['type'] == 'http.disconnect':
+                self.disconnected.set()
+                raise ClientDisconnected()
+            yield message.get('body', b'')
+            if not message.get('more_body'):
+                return
+
+    async def read_body(self, limit):
+        """Reads the whole body; raises ValueError if it exceeds limit bytes."""
+        body = bytearray()
+        async for chunk in self.iter_body():
+            body += chunk
+            if len(body) > limit:
+                raise ValueError(f"Request body exceeds {limit} bytes")
+        return bytes(body)
+
+    def watch_disconnect(self):
+        """
+        Starts a task setting self.disconnected once the client goes away, so streaming
+        responses stop early. Only call it once the body has been read; cancel it when done.
+        """
+        async def watch():
+            while (await self._receive())['type'] != 'http.disconnect':
+                pass
+            self.disconnected.set()
+
+        return asyncio.ensure_future(watch())
+
+
+# --- Responses ---
+
+async def start_response(send, status, headers):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                            for name, value in headers.items()]})
+
+
+async def send_body(send, body=b'', more_body=False):
+    await send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+
+
+async def send_json(send, status, payload, headers=None):
+    body = json.dumps(payload).encode()
+    await start_response(send, status, {"Content-Type": "application/json", "Content-Length": len(body),
+                                        **(headers or {})})
+    await send_body(send, body)
+
+
+# --- Uploads ---
+
+async def ffprobe_media_async(path):
+    """app.ffprobe_media as an asyncio subprocess, so a probe does not hold a thread."""
+    process = await asyncio.create_subprocess_exec(*app.get_ffprobe_command(path), stdin=subprocess.DEVNULL,
+                                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), app.FFPROBE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        logging.warning(f"ffprobe timed out on {path}")
+        return None
+    return app.parse_ffprobe_output(path, process.returncode, stdout.decode(errors='replace'),
+                                    stderr.decode(errors='replace'))
+
+
+async def finish_upload(upload):
+    """
+    Completes a streamed file part: header check and probe index lookup (on a worker
+    thread, they touch the disk and SQLite), then an async ffprobe on a miss.
+    """
+    await asyncio.to_thread(upload.finish_receive)
+    if upload.info is None:
+        try:
+            probe = await ffprobe_media_async(upload.path)
+        except FileNotFoundError:
+            logging.warning("ffprobe not found; skipping container probe for uploads.")
+        else:
+            await asyncio.to_thread(upload.accept_probe, probe)
+    await asyncio.to_thread(upload.close)
+
+
+async def receive_multipart(request, uploads):
+    """
+    Parses a multipart/form-data body as it arrives. File parts are written to
+    UPLOAD_FOLDER through app.StreamingUpload (validated while streaming, probed once
+    complete) and appended to uploads. Writes and hashing run on worker threads so a
+    large upload never stalls the loop. Returns (form fields, {field name: [uploads]}).
+    """
+    mimetype, params = parse_options_header(request.headers.get('Content-Type', ''))
+    if mimetype != 'multipart/form-data' or not params.get('boundary'):
+        raise app.UploadRejected("Expected a multipart/form-data request body")
+    decoder = MultipartDecoder(params['boundary'].encode('latin-1'), FORM_FIELD_MAX_BYTES)
+    body = request.iter_body()
+    form, files = MultiDict(), MultiDict()
+    part, field_data = None, []
+
+    while True:
+        event = decoder.next_event()
+        if isinstance(event, NeedData):
+            decoder.receive_data(await anext(body, None))
+        elif isinstance(event, File):
+            if not event.filename:
+                raise app.UploadRejected("No selected file or empty filename")
+            if not app.allowed_file(event.filename):
+                raise app.UploadRejected("Invalid file type. Allowed: " + ", ".join(app.ALLOWED_EXTENSIONS))
+            ext = event.filename.rsplit('.', 1)[1].lower()
+            part = await asyncio.to_thread(app.StreamingUpload, os.path.join(app.app.config['UPLOAD_FOLDER'],
+                                                                             f"{uuid.uuid4()}.{ext}"), event.filename)
+            uploads.append(part)
+            files.add(event.name, part)
+        elif isinstance(event, Field):
+            part, field_data = event.name, []
+        elif isinstance(event, Data):
+            if isinstance(part, app.StreamingUpload):
+                await asyncio.to_thread(part.write, event.data)
+                if not event.more_data:
+                    await finish_upload(part)
+            else:
+                field_data.append(event.data)
+                if not event.more_data:
+                    form.add(part, b''.join(field_data).decode('utf-8', 'replace'))
+        elif isinstance(event, Epilogue):
+            return form, files
+
+
+async def submit(send, methods, input1_path, input2_path, playback_speed, is_local=False, cleanup_paths=None,
+                 options=None, client=None):
+    """
+    Queues validated comparison methods like app.process_request and sends the response.
+    submit_comparison hashes (and for local files may probe) its inputs, so it runs on a
+    worker thread.
+    """
+    try:
+        body, cached = await asyncio.to_thread(app.submit_comparison, methods, input1_path, input2_path,
+                                               playback_speed, is_local, cleanup_paths, options, client)
+    except app.AdmissionRejected as e:
+        await send_json(send, 429, {"error": str(e), "retry_after": e.retry_after}, {"Retry-After": e.retry_after})
+        return
+    if cached:
+        await send_json(send, 200, body)
+    else:
+        await send_json(send, 202, body, {"Location": body["status_url"]})
+
+
+# --- Routes ---
+
+async def compare_videos(request, send):
+    """Async /compare: streams both uploads to disk while they arrive and queues the comparison."""
+    logging.info("Received request to /compare (upload, asgi)")
+    uploads = []
+    handed_to_job = []
+
+    try:
+        form, files = await receive_multipart(request, uploads)
+        if 'video1' not in files or 'video2' not in files:
+            return await send_json(send, 400, {"error": "Missing video file(s) in request"})
+        methods = app.parse_comparison_methods(form)
+        if not methods or 'playback_speed' not in form:
+            return await send_json(send, 400, {"error": "Missing 'comparison_method' or 'playback_speed' in request form"})
+        options, options_error = app.parse_job_options(form)
+        if options_error:
+            return await send_json(send, 400, {"error": options_error})
+        methods_error = app.validate_comparison_methods(methods, options)
+        if methods_error:
+            return await send_json(send, 400, {"error": methods_error})
+
+        input_paths = [files['video1'].path, files['video2'].path]
+        logging.info(f"Received input videos: {input_paths[0]} ({files['video1'].bytes_written} bytes), "
+                     f"{input_paths[1]} ({files['video2'].bytes_written} bytes)")
+        await submit(send, methods, *input_paths, form['playback_speed'], cleanup_paths=input_paths,
+                     options=options, client=app.client_id_for(request))
+        handed_to_job = input_paths
+
+    except app.UploadRejected as e:
+        logging.warning(f"Rejected upload during streaming: {e}")
+        await send_json(send, 400, {"error": str(e)})
+    except ClientDisconnected:
+        logging.info("Client disconnected during upload")
+    except Exception as e:
+        logging.exception("An unexpected error occurred during /compare request.")
+        await send_json(send, 500, {"error": f"An unexpected server error occurred: {str(e)}"})
+    finally:
+        for upload in uploads:
+            upload.close()
+        leftovers = [upload.path for upload in uploads
+                     if upload.path not in handed_to_job and os.path.exists(upload.path)]
+        if leftovers:
+            app.cleanup_files(leftovers)
+            logging.info("Cleanup attempt finished for upload request.")
+
+
+async def compare_local_videos(request, send):
+    """Async /compare_local: queues a comparison of the predefined local files. Expects a JSON body."""
+    logging.info("Received request to /compare_local (quick test, asgi)")
+    try:
+        data = json.loads(await request.read_body(JSON_BODY_MAX_BYTES) or b'null')
+    except ValueError as e:
+        return await send_json(send, 400, {"error": f"Invalid JSON body: {e}"})
+    except ClientDisconnected:
+        return
+
+    methods = app.parse_comparison_methods(data) if isinstance(data, dict) else []
+    if not methods or 'playback_speed' not in data:
+        return await send_json(send, 400, {"error": "Missing 'comparison_method' or 'playback_speed' in request JSON body"})
+    options, options_error = app.parse_job_options(data)
+    if options_error:
+        return await send_json(send, 400, {"error": options_error})
+    methods_error = app.validate_comparison_methods(methods, options)
+    if methods_error:
+        return await send_json(send, 400, {"error": methods_error})
+    if not os.path.exists(app.QUICK_TEST_FILE_1) or not os.path.exists(app.QUICK_TEST_FILE_2):
+        logging.error(f"Quick test files not found: {app.QUICK_TEST_FILE_1}, {app.QUICK_TEST_FILE_2}")
+        return await send_json(send, 404, {"error": f"Sample files not found on server at {app.QUICK_TEST_FILE_1} "
+                                                    f"and {app.QUICK_TEST_FILE_2}"})
+    try:
+        await submit(send, methods, app.QUICK_TEST_FILE_1, app.QUICK_TEST_FILE_2, data['playback_speed'],
+                     is_local=True, options=options, client=app.client_id_for(request))
+    except Exception as e:
+        logging.exception("An unexpected error occurred during /compare_local request.")
+        await send_json(send, 500, {"error": f"An unexpected server error occurred: {str(e)}"})
+
+
+async def compare_batch(request, send):
+    """
+    Async /batch: streams every reference and candidate to disk once while they arrive
+    and queues the batch (app.submit_batch, on a worker thread: it probes and hashes).
+    """
+    logging.info("Received request to /batch (upload, asgi)")
+    uploads = []
+    handed_to_batch = []
+
+    try:
+        form, files = await receive_multipart(request, uploads)
+        references = [(upload.filename, upload.path) for upload in files.getlist('reference')]
+        candidates = [(upload.filename, upload.path) for upload in files.getlist('candidate')]
+        body, error = await asyncio.to_thread(app.submit_batch, references, candidates, form,
+                                              app.client_id_for(request))
+        if error:
+            return await send_json(send, 400, {"error": error})
+        handed_to_batch = [path for _, path in references + candidates]
+        await send_json(send, 202, body, {"Location": body["status_url"]})
+
+    except app.UploadRejected as e:
+        logging.warning(f"Rejected batch upload during streaming: {e}")
+        await send_json(send, 400, {"error": str(e)})
+    except app.AdmissionRejected as e:
+        await send_json(send, 429, {"error": str(e), "retry_after": e.retry_after}, {"Retry-After": e.retry_after})
+    except ClientDisconnected:
+        logging.info("Client disconnected during batch upload")
+    except Exception as e:
+        logging.exception("An unexpected error occurred during /batch request.")
+        await send_json(send, 500, {"error": f"An unexpected server error occurred: {str(e)}"})
+    finally:
+        for upload in uploads:
+            upload.close()
+        leftovers = [upload.path for upload in uploads
+                     if upload.path not in handed_to_batch and os.path.exists(upload.path)]
+        if leftovers:
+            app.cleanup_files(leftovers)
+
+
+async def job_status(request, send, job_id):
+    status = app.get_job_status(job_id)
+    if status is None:
+        return await send_json(send, 404, {"error": "Job not found"})
+    await send_json(send, 200, status)
+
+
+async def job_events(request, send, job_id):
+    """Server-Sent Events stream of a job's status and progress, polled on the loop instead of a thread per client."""
+    update = app.poll_job_update(job_id)
+    if update is None:
+        return await send_json(send, 404, {"error": "Job not found"})
+    await start_response(send, 200, {"Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+                                     "X-Accel-Buffering": "no"})
+    watcher = request.watch_disconnect()
+    try:
+        idle_seconds = 0.0
+        while update is not None and not request.disconnected.is_set():
+            version, view = update
+            if view is not None:
+                await send_body(send, f"event: {view['status']}\ndata: {json.dumps(view)}\n\n".encode(), True)
+                if view["status"] in app.JOB_FINAL_STATUSES:
+                    break
+                idle_seconds = 0.0
+            elif idle_seconds >= app.SSE_KEEPALIVE_SECONDS:
+                await send_body(send, b": keepalive\n\n", True)
+                idle_seconds = 0.0
+            await asyncio.sleep(app.PARTIAL_OUTPUT_POLL_SECONDS)
+            idle_seconds += app.PARTIAL_OUTPUT_POLL_SECONDS
+            update = app.poll_job_update(job_id, version)
+        await send_body(send)
+    finally:
+        watcher.cancel()
+
+
+def range_is_current(request, etag, mtime):
+    """Whether a Range request applies: no If-Range, or an If-Range matching the current ETag/date."""
+    if 'If-Range' not in request.headers:
+        return True
+    if_range = parse_if_range_header(request.headers['If-Range'])
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    return if_range.date is not None and int(mtime) <= if_range.date.timestamp()
+
+
+async def send_output_file(request, send, filename, path):
+    """
+    Async counterpart of app.send_output_file: the same ETag and Cache-Control policy,
+    conditional and single Range requests, and the proxy handoff headers when
+    OUTPUT_SERVE_MODE is x-accel or x-sendfile. Reads run on a worker thread.
+    """
+    stat = os.stat(path)
+    etag = app.output_etag(filename, stat.st_size)
+    headers = {"Content-Type": mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+               "ETag": f'"{etag}"', "Last-Modified": http_date(stat.st_mtime),
+               "Cache-Control": app.OUTPUT_CACHE_CONTROL}
+    if parse_etags(request.headers.get('If-None-Match')).contains_weak(etag):
+        del headers["Content-Type"]
+        await start_response(send, 304, headers)
+        return await send_body(send)
+
+    if app.OUTPUT_SERVE_MODE in ('x-accel', 'x-sendfile'):
+        if app.OUTPUT_SERVE_MODE == 'x-accel':
+            headers['X-Accel-Redirect'] = app.OUTPUT_ACCEL_PREFIX + filename
+        else:
+            headers['X-Sendfile'] = os.path.abspath(path)
+        await start_response(send, 200, {**headers, "Content-Length": 0})
+        return await send_body(send)
+
+    status, start, stop = 200, 0, stat.st_size
+    headers["Accept-Ranges"] = "bytes"
+    byte_ranges = parse_range_header(request.headers.get('Range'))
+    if byte_ranges is not None and len(byte_ranges.ranges) == 1 and range_is_current(request, etag, stat.st_mtime):
+        requested = byte_ranges.range_for_length(stat.st_size)
+        if requested is None:
+            await start_response(send, 416, {"Content-Range": f"bytes */{stat.st_size}", "Content-Length": 0})
+            return await send_body(send)
+        status, (start, stop) = 206, requested
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{stat.st_size}"
+    headers["Content-Length"] = stop - start
+    await start_response(send, status, headers)
+    if request.method == 'HEAD':
+        return await send_body(send)
+
+    started = time.perf_counter()
+    sent = 0
+    try:
+        with open(path, 'rb') as output_file:
+            output_file.seek(start)
+            while sent < stop - start and not request.disconnected.is_set():
+                chunk = await asyncio.to_thread(output_file.read, min(OUTPUT_CHUNK_BYTES, stop - start - sent))
+                if not chunk:
+                    break
+                sent += len(chunk)
+                await send_body(send, chunk, True)
+        await send_body(send)
+    finally:
+        app.metrics.observe('stage_seconds', time.perf_counter() - started, stage='serve')
+        app.metrics.inc('bytes_out_total', sent)
+
+
+async def stream_growing_output(request, send, growing_file, job, filename):
+    """Streams an output that is still being encoded, following its partial file until that output is written."""
+    await start_response(send, 200, {"Content-Type": "video/mp4", "Cache-Control": "no-store", "Accept-Ranges": "none"})
+    started = time.perf_counter()
+    sent = 0
+    finishing = False
+    try:
+        with growing_file:
+            while not request.disconnected.is_set():
+                chunk = await asyncio.to_thread(growing_file.read, OUTPUT_CHUNK_BYTES)
+                if chunk:
+                    sent += len(chunk)
+                    app.touch_job(job)  # a client reading the partial output is following the job
+                    await send_body(send, chunk, True)
+                elif finishing:
+                    break
+                elif app.output_is_encoding(job, filename):
+                    await asyncio.sleep(app.PARTIAL_OUTPUT_POLL_SECONDS)
+                else:
+                    finishing = True  # drain whatever was written before the output was finished
+        await send_body(send)
+    finally:
+        app.metrics.observe('stage_seconds', time.perf_counter() - started, stage='serve_partial')
+        app.metrics.inc('bytes_out_total', sent)
+
+
+async def serve_output_video(request, send, filename):
+    """Async /outputs/<filename>: finished outputs with Range support, in-progress ones streamed as they grow."""
+    logging.info(f"Serving output file: {filename}")
+    app.ensure_output_sweeper()
+    path = safe_join(app.app.config['OUTPUT_FOLDER'], filename)
+    watcher = request.watch_disconnect()
+    try:
+        if path is not None and os.path.isfile(path):
+            await send_output_file(request, send, filename, path)
+            app.result_cache.touch(filename)  # least recently served outputs are evicted first
+            return
+
+        job = app.find_encoding_job(filename)
+        partial_path = app.partial_output_path(os.path.join(app.app.config['OUTPUT_FOLDER'], filename))
+        deadline = time.monotonic() + app.PARTIAL_OUTPUT_WAIT_SECONDS
+        while job is not None and not os.path.exists(partial_path) and app.output_is_announced(job, filename):
+            if time.monotonic() >= deadline:
+                await send_json(send, 503, {"error": "Output not started yet", "status": job["status"]},
+                                {"Retry-After": app.PARTIAL_OUTPUT_WAIT_SECONDS})
+                return
+            await asyncio.sleep(app.PARTIAL_OUTPUT_POLL_SECONDS)  # ffmpeg has not created the file yet
+        growing_file = None
+        if job is not None and app.output_is_encoding(job, filename):
+            try:
+                growing_file = open(partial_path, 'rb')
+            except FileNotFoundError:
+                pass  # renamed into place just now
+        if growing_file is not None:
+            logging.info(f"Streaming in-progress output {filename} (job {job['job_id']})")
+            await stream_growing_output(request, send, growing_file, job, filename)
+        elif path is not None and os.path.isfile(path):
+            await send_output_file(request, send, filename, path)
+            app.result_cache.touch(filename)
+        else:
+            logging.error(f"Requested output file not found: {filename}")
+            await send_json(send, 404, {"error": "File not found"})
+    finally:
+        watcher.cancel()
+
+
+async def health_check(request, send):
+    """Health check endpoint; ffmpeg -version runs as an asyncio subprocess."""
+    try:
+        process = await asyncio.create_subprocess_exec('ffmpeg', '-version', stdin=subprocess.DEVNULL,
+                                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            returncode = await asyncio.wait_for(process.wait(), HEALTH_CHECK_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+        if returncode == 0:
+            return await send_json(send, 200, {"status": "healthy", "ffmpeg": "available", **app.get_health_stats()})
+        await send_json(send, 500, {"status": "unhealthy", "error": "ffmpeg not available"})
+    except Exception as e:
+        await send_json(send, 500, {"status": "unhealthy", "error": str(e) or type(e).__name__})
+
+
+# --- WSGI Fallback ---
+
+def wsgi_environ(request, body, content_length):
+    """Builds the WSGI environ of a request whose body has been spooled to body."""
+    scope = request.scope
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': request.path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'SERVER_SOFTWARE': 'tin-eye-asgi',
+        'REMOTE_ADDR': request.remote_addr or '',
+        'CONTENT_LENGTH': str(content_length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in request.headers.items():
+        key = name.upper().replace('-', '_')
+        if key == 'CONTENT_LENGTH':
+            continue
+        if key != 'CONTENT_TYPE':
+            key = 'HTTP_' + key
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def call_flask(request, send):
+    """Runs a request through the Flask app on a worker thread (routes without an async handler)."""
+    with tempfile.SpooledTemporaryFile(max_size=WSGI_SPOOL_BYTES) as body:
+        content_length = 0
+        try:
+            async for chunk in request.iter_body():
+                body.write(chunk)
+                content_length += len(chunk)
+        except ClientDisconnected:
+            return
+        body.seek(0)
+
+        response = {}
+
+        def wsgi_start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+            return lambda data: None  # the write() callable is not used by Flask
+
+        environ = wsgi_environ(request, body, content_length)
+        iterable = await asyncio.to_thread(app.app.wsgi_app, environ, wsgi_start_response)
+        watcher = request.watch_disconnect()
+        try:
+            iterator = iter(iterable)
+            chunk = await asyncio.to_thread(next, iterator, None)
+            await send({'type': 'http.response.start', 'status': response['status'],
+                        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                    for name, value in response['headers']]})
+            while chunk is not None and not request.disconnected.is_set():
+                if chunk:
+                    await send_body(send, chunk, True)
+                chunk = await asyncio.to_thread(next, iterator, None)
+            await send_body(send)
+        finally:
+            watcher.cancel()
+            if hasattr(iterable, 'close'):
+                await asyncio.to_thread(iterable.close)
+
+
+# (methods, path pattern, handler); any other request goes to the Flask app
+ROUTES = [
+    ({'POST'}, re.compile(r'/compare$'), compare_videos),
+    ({'POST'}, re.compile(r'/compare_local$'), compare_local_videos),
+    ({'POST'}, re.compile(r'/batch$'), compare_batch),
+    ({'GET', 'HEAD'}, re.compile(r'/outputs/(?P<filename>[^/]+)$'), serve_output_video),
+    ({'GET'}, re.compile(r'/jobs/(?P<job_id>[^/]+)$'), job_status),
+    ({'GET'}, re.compile(r'/jobs/(?P<job_id>[^/]+)/events$'), job_events),
+    ({'GET'}, re.compile(r'/health$'), health_check),
+]
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            app.create_directories()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return  # no websocket routes
+
+    request = AsgiRequest(scope, receive)
+    for methods, pattern, handler in ROUTES:
+        match = pattern.match(request.path)
+        if match and request.method in methods:
+            return await handler(request, send, **match.groupdict())
+    await call_flask(request, send)
@@ -0,0 +1,434 @@
+"""
+Benchmarks the comparison filter graphs built by app.get_ffmpeg_command.
+
+Synthetic input pairs are generated locally with ffmpeg's testsrc/mandelbrot sources
+(the second input of each pair carries a filled box so the comparison has something
+to show), then every method x playback speed x output height combination is encoded
+and measured: wall time, CPU time, encode fps, peak RSS of the ffmpeg process and
+output bytes. Results are written as a JSON report; a report can be diffed against a
+baseline to catch filter graph performance regressions before deploying.
+
+    python benchmark.py run --output bench.json
+    python benchmark.py run --baseline bench.json --output bench-new.json
+    python benchmark.py diff bench.json bench-new.json
+    python benchmark.py segments --speeds 1,0.5
+    python benchmark.py backends
+
+The backends command renders the methods both backends implement with each of them and
+compares the first frame. The segments command checks segment-parallel encoding: each method is encoded
+losslessly once in a single pass and once as joined segments, and the framemd5 of
+both must match frame for frame.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import app
+
+REPORT_VERSION = 1
+DEFAULT_SOURCES = ['testsrc', 'mandelbrot']
+DEFAULT_SIZES = ['640x360', '1280x720']
+DEFAULT_DURATIONS = [5.0]
+DEFAULT_SPEEDS = [1.0, 0.5]
+DEFAULT_HEIGHTS = [app.TARGET_HEIGHT]
+INPUT_FRAME_RATE = 30
+# Relative increase of wall time / peak RSS (or drop in encode fps) reported as a regression
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+# Marks the second input of a pair so every method has a visible difference to render
+CANDIDATE_FILTER = 'drawbox=x=iw/4:y=ih/4:w=iw/8:h=ih/8:color=red@0.6:t=fill'
+
+
+def parse_list(value, cast=str):
+    """Parses a comma-separated command line value."""
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def ffmpeg_version():
+    """First line of 'ffmpeg -version', or None if ffmpeg is not available."""
+    try:
+        result = subprocess.run([app.FFMPEG_PATH, '-version'], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.splitlines()[0] if result.stdout else None
+
+
+def generate_input(source, size, duration, path, candidate=False, rate=INPUT_FRAME_RATE):
+    """Renders a synthetic lavfi source to path (skipped if it already exists)."""
+    if os.path.exists(path):
+        return path
+    if source == 'mandelbrot':
+        lavfi = f"mandelbrot=size={size}:rate={rate}"
+    else:
+        lavfi = f"{source}=size={size}:rate={rate}"
+    command = [app.FFMPEG_PATH, '-v', 'error', '-y', '-f', 'lavfi', '-i', lavfi, '-t', str(duration)]
+    if candidate:
+        command += ['-vf', CANDIDATE_FILTER]
+    command += ['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-an', path + '.part.mp4']
+    subprocess.run(command, check=True, stdin=subprocess.DEVNULL)
+    os.replace(path + '.part.mp4', path)
+    return path
+
+
+def measure_command(command):
+    """
+    Runs an ffmpeg command built with '-progress pipe:1' and reaps it with os.wait4 so
+    its own resource usage is captured. Returns wall/CPU seconds, frames, ffmpeg's
+    reported fps, peak RSS in bytes and the exit code.
+    """
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+    last = {}
+    try:
+        for snapshot in app.read_ffmpeg_progress(process.stdout):
+            last = snapshot
+    finally:
+        process.stdout.close()
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    wall_seconds = time.perf_counter() - started
+    return {
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "frames": last.get("frame", 0),
+        "ffmpeg_fps": last.get("fps", 0.0),
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        "peak_rss_bytes": usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024),
+        "returncode": process.returncode,
+    }
+
+
+def benchmark_case(case, input1, input2, work_dir, repeat=1, keep_outputs=False):
+    """Encodes one method/speed/height combination repeat times; returns the median run."""
+    output = os.path.join(work_dir, f"{case['id'].replace('/', '_')}.mp4")
+    command = app.get_ffmpeg_command(case["method"], input1, input2, output, case["target_height"], case["speed"])
+    runs = []
+    for _ in range(repeat):
+        run = measure_command(command)
+        run["output_bytes"] = os.path.getsize(output) if os.path.exists(output) else 0
+        runs.append(run)
+        if run["returncode"] != 0:
+            break
+    if not keep_outputs and os.path.exists(output):
+        os.remove(output)
+
+    run = sorted(runs, key=lambda item: item["wall_seconds"])[len(runs) // 2]
+    result = dict(case)
+    result.update(run)
+    result["runs"] = len(runs)
+    result["wall_seconds"] = round(run["wall_seconds"], 4)
+    result["cpu_seconds"] = round(run["cpu_seconds"], 4)
+    result["wall_seconds_stdev"] = round(statistics.stdev(r["wall_seconds"] for r in runs), 4) if len(runs) > 1 else 0.0
+    result["encode_fps"] = round(run["frames"] / run["wall_seconds"], 2) if run["wall_seconds"] > 0 else None
+    return result
+
+
+def run_benchmarks(args):
+    """Generates the inputs, runs every combination and returns the report dict."""
+    os.makedirs(args.work_dir, exist_ok=True)
+    methods = sorted(app.COMPARISON_METHODS) if args.methods == 'all' else parse_list(args.methods)
+    unknown = [method for method in methods if method not in app.COMPARISON_METHODS]
+    if unknown:
+        raise SystemExit(f"Unknown comparison method(s): {', '.join(unknown)}")
+
+    results = []
+    for source in parse_list(args.sources):
+        for size in parse_list(args.sizes):
+            for duration in parse_list(args.durations, float):
+                stem = os.path.join(args.work_dir, f"{source}_{size}_{duration:g}s")
+                input1 = generate_input(source, size, duration, stem + '_reference.mp4')
+                input2 = generate_input(source, size, duration, stem + '_candidate.mp4', candidate=True)
+                for height in parse_list(args.heights, int):
+                    for speed in parse_list(args.speeds, float):
+                        for method in methods:
+                            case = {
+                                "id": f"{source}/{size}/{duration:g}s/{height}p/{speed:g}x/{method}",
+                                "source": source, "size": size, "duration": duration,
+                                "target_height": height, "speed": speed, "method": method,
+                            }
+                            result = benchmark_case(case, input1, input2, args.work_dir, args.repeat, args.keep_outputs)
+                            results.append(result)
+                            print(f"{case['id']:<60} {result['wall_seconds']:8.2f}s {result['encode_fps'] or 0:8.1f} fps "
+                                  f"{result['peak_rss_bytes'] / 1024 ** 2:8.1f} MiB {result['output_bytes']:>12} B"
+                                  + ("" if result["returncode"] == 0 else f"  (exit {result['returncode']})"))
+
+    return {
+        "version": REPORT_VERSION,
+        "created_at": time.time(),
+        "ffmpeg": ffmpeg_version(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "encoder_settings": app.ENCODER_SETTINGS,
+        "results": results,
+    }
+
+
+def diff_reports(baseline, current, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    Compares two reports case by case. Returns a list of row dicts with the relative
+    change of wall time, encode fps, peak RSS and output bytes, and whether the case
+    regressed (slower, lower fps or more memory beyond threshold, or it now fails).
+    """
+    baseline_results = {result["id"]: result for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        before = baseline_results.get(result["id"])
+        if before is None:
+            continue
+
+        def change(key):
+            if not before.get(key) or result.get(key) is None:
+                return None
+            return round((result[key] - before[key]) / before[key], 4)
+
+        row = {
+            "id": result["id"],
+            "wall_seconds": change("wall_seconds"),
+            "encode_fps": change("encode_fps"),
+            "peak_rss_bytes": change("peak_rss_bytes"),
+            "output_bytes": change("output_bytes"),
+        }
+        row["regressed"] = bool(
+            (result["returncode"] != 0 and before["returncode"] == 0)
+            or (row["wall_seconds"] or 0) > threshold
+            or (row["encode_fps"] or 0) < -threshold
+            or (row["peak_rss_bytes"] or 0) > threshold
+        )
+        rows.append(row)
+    return rows
+
+
+def print_diff(rows):
+    """Prints a diff table and returns the number of regressed cases."""
+    def percent(value):
+        return "     n/a" if value is None else f"{value * 100:+7.1f}%"
+
+    print(f"{'case':<60} {'wall':>8} {'fps':>8} {'rss':>8} {'bytes':>8}")
+    for row in rows:
+        print(f"{row['id']:<60} {percent(row['wall_seconds'])} {percent(row['encode_fps'])} "
+              f"{percent(row['peak_rss_bytes'])} {percent(row['output_bytes'])}"
+              + ("  REGRESSION" if row["regressed"] else ""))
+    regressions = sum(row["regressed"] for row in rows)
+    print(f"{len(rows)} case(s) compared, {regressions} regression(s)")
+    return regressions
+
+
+def frame_hashes(path):
+    """Per-frame MD5s of a video's decoded frames (ffmpeg's framemd5 muxer), in order."""
+    result = subprocess.run([app.FFMPEG_PATH, '-v', 'error', '-i', path, '-map', '0:v', '-vsync', 'passthrough',
+                             '-f', 'framemd5', '-'], capture_output=True, text=True, check=True)
+    return [line.rsplit(',', 1)[1].strip() for line in result.stdout.splitlines()
+            if line.strip() and not line.startswith('#')]
+
+
+def check_segments(method, speed, input1, input2, duration, height, segment_count, work_dir, alignment=None,
+                   label='plain'):
+    """
+    Encodes one method losslessly as a single pass and as joined segments (the commands
+    the server runs, with the same alignment plan) and compares their framemd5.
+    Returns a result dict; "segmented" says whether the server would segment the case.
+    """
+    encoder_settings = app.ENCODE_PROFILES['lossless']
+    info = {"fps": float(INPUT_FRAME_RATE), "duration": duration}
+    segments = app.plan_segments(info, info, segment_count, duration / segment_count)
+    stem = os.path.join(work_dir, f"segments_{method}_{speed:g}x_{label.replace(' ', '_')}")
+    single_path = stem + '_single.mp4'
+    single_command = app.get_multi_ffmpeg_command([method], input1, input2, [single_path], height, speed,
+                                                  encoder_settings=encoder_settings, alignment=alignment)
+    subprocess.run(single_command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   stdin=subprocess.DEVNULL)
+
+    segment_paths = []
+    for index, segment in enumerate(segments):
+        segment_path = f"{stem}_{index:04d}.mp4"
+        command = app.get_segment_command([method], input1, input2, [segment_path], float(INPUT_FRAME_RATE), segment,
+                                          height, speed, encoder_settings=encoder_settings, alignment=alignment)
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       stdin=subprocess.DEVNULL)
+        segment_paths.append(segment_path)
+    concat_list_path = stem + '_segments.txt'
+    with open(concat_list_path, 'w') as concat_list:
+        concat_list.writelines(f"file '{os.path.abspath(path)}'\n" for path in segment_paths)
+    joined_path = stem + '_joined.mp4'
+    subprocess.run(app.get_concat_command(concat_list_path, joined_path), check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+
+    single, joined = frame_hashes(single_path), frame_hashes(joined_path)
+    mismatch = next((index for index, (a, b) in enumerate(zip(single, joined)) if a != b), None)
+    if mismatch is None and len(single) != len(joined):
+        mismatch = min(len(single), len(joined))
+    for path in [single_path, joined_path, concat_list_path] + segment_paths:
+        os.remove(path)
+    return {"method": method, "speed": speed, "label": label, "segments": len(segments),
+            "segmented": app.segments_match_single_pass(speed, alignment), "single_frames": len(single),
+            "joined_frames": len(joined), "first_mismatch": mismatch}
+
+
+def run_segment_checks(args):
+    """
+    Runs check_segments for every method and speed, on a plain pair and on pairs the
+    server aligns (a candidate at twice the frame rate, and a time offset). Returns
+    the number of mismatching cases the server would segment; mismatches of cases it
+    encodes in a single pass are only reported.
+    """
+    os.makedirs(args.work_dir, exist_ok=True)
+    methods = sorted(app.COMPARISON_METHODS) if args.methods == 'all' else parse_list(args.methods)
+    stem = os.path.join(args.work_dir, f"{args.source}_{args.size}_{args.duration:g}s")
+    input1 = generate_input(args.source, args.size, args.duration, stem + '_reference.mp4')
+    input2 = generate_input(args.source, args.size, args.duration, stem + '_candidate.mp4', candidate=True)
+    fast_input2 = generate_input(args.source, args.size, args.duration,
+                                 stem + f"_candidate_{2 * INPUT_FRAME_RATE}fps.mp4", candidate=True,
+                                 rate=2 * INPUT_FRAME_RATE)
+    infos = [{"fps": float(rate), "vfr": False, "start_delay": 0.0, "duration": args.duration}
+             for rate in (INPUT_FRAME_RATE, 2 * INPUT_FRAME_RATE)]
+    cases = [
+        ('plain', input2, None),
+        ('mixed fps', fast_input2, app.plan_alignment(infos[0], infos[1])),
+        ('offset', input2, app.plan_alignment(infos[0], infos[0], args.time_offset)),
+    ]
+    failures = 0
+    for speed in parse_list(args.speeds, float):
+        for label, candidate, alignment in cases:
+            for method in methods:
+                result = check_segments(method, speed, input1, candidate, args.duration, args.height, args.segments,
+                                        args.work_dir, alignment, label)
+                mismatched = result["first_mismatch"] is not None
+                failed = mismatched and result["segmented"]
+                failures += failed
+                print(f"{method:<20} {speed:>5g}x {label:<9} {result['segments']} segments "
+                      f"{result['single_frames']:>6} / {result['joined_frames']:<6} frames  "
+                      + (f"MISMATCH at frame {result['first_mismatch']}" if mismatched else "identical")
+                      + ("" if result["segmented"] else " (not segmented by the server)"))
+    print(f"{failures} mismatching case(s)")
+    return failures
+
+
+def first_frame_rgb(path, width, height):
+    """First decoded frame of a video as a (height, width, 3) rgb24 array."""
+    result = subprocess.run([app.FFMPEG_PATH, '-v', 'error', '-i', path, '-frames:v', '1', '-f', 'rawvideo',
+                             '-pix_fmt', 'rgb24', '-'], capture_output=True, check=True)
+    return app.np.frombuffer(result.stdout, app.np.uint8).reshape(height, width, 3)
+
+
+def compare_backends(method, input1, input2, size, height, work_dir):
+    """
+    Renders method losslessly with the filter graph and with the raw frame backend and
+    returns the largest per-channel difference of their first frames (0-255).
+    """
+    source_width, source_height = (int(value) for value in size.split('x'))
+    width, _ = app.raw_frame_size({"width": source_width, "height": source_height}, height)
+    encoder_settings = app.ENCODE_PROFILES['lossless']
+    filter_path = os.path.join(work_dir, f"backends_{method}_filter.mkv")
+    raw_path = os.path.join(work_dir, f"backends_{method}_numpy.mkv")
+    command = app.get_multi_ffmpeg_command([method], input1, input2, [filter_path], height,
+                                           encoder_settings=encoder_settings, output_options=['-frames:v', '1'])
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+    returncode, stderr_text = app.run_raw_frame_comparison([method], input1, input2, [raw_path], width, height,
+                                                           float(INPUT_FRAME_RATE), encoder_settings=encoder_settings)
+    if returncode != 0:
+        raise SystemExit(f"Raw frame backend failed for {method}: {stderr_text}")
+    frames = [first_frame_rgb(path, width, height).astype(app.np.int16) for path in (filter_path, raw_path)]
+    for path in (filter_path, raw_path):
+        os.remove(path)
+    return int(app.np.abs(frames[0] - frames[1]).max())
+
+
+def run_backend_checks(args):
+    """Runs compare_backends for every method both backends implement; returns the number of mismatches."""
+    if app.np is None:
+        raise SystemExit("NumPy is not installed; the raw frame backend is unavailable")
+    os.makedirs(args.work_dir, exist_ok=True)
+    stem = os.path.join(args.work_dir, f"{args.source}_{args.size}_{args.duration:g}s")
+    input1 = generate_input(args.source, args.size, args.duration, stem + '_reference.mp4')
+    input2 = generate_input(args.source, args.size, args.duration, stem + '_candidate.mp4', candidate=True)
+    failures = 0
+    for method in sorted(set(app.RAW_FRAME_KERNELS) - app.RAW_FRAME_METHODS):
+        difference = compare_backends(method, input1, input2, args.size, args.height, args.work_dir)
+        failed = difference > args.tolerance
+        failures += failed
+        print(f"{method:<20} max difference {difference:>3}  " + ("MISMATCH" if failed else "ok"))
+    print(f"{failures} mismatching method(s)")
+    return failures
+
+
+def load_report(path):
+    with open(path) as report_file:
+        report = json.load(report_file)
+    if report.get("version") != REPORT_VERSION:
+        raise SystemExit(f"{path}: unsupported report version {report.get('version')}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subcommands.add_parser('run', help='run the benchmark and write a JSON report')
+    run_parser.add_argument('--methods', default='all', help="comma-separated methods, or 'all' (default)")
+    run_parser.add_argument('--speeds', default=','.join(f"{speed:g}" for speed in DEFAULT_SPEEDS))
+    run_parser.add_argument('--heights', default=','.join(str(height) for height in DEFAULT_HEIGHTS),
+                            help='output target heights')
+    run_parser.add_argument('--sources', default=','.join(DEFAULT_SOURCES), help='lavfi sources for the inputs')
+    run_parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES), help='input resolutions (WxH)')
+    run_parser.add_argument('--durations', default=','.join(f"{duration:g}" for duration in DEFAULT_DURATIONS),
+                            help='input durations in seconds')
+    run_parser.add_argument('--repeat', type=int, default=1, help='runs per case; the median is reported')
+    run_parser.add_argument('--work-dir', default='benchmark_work', help='generated inputs and scratch outputs')
+    run_parser.add_argument('--keep-outputs', action='store_true', help='keep the encoded comparison videos')
+    run_parser.add_argument('--output', default='benchmark_report.json')
+    run_parser.add_argument('--baseline', help='report to diff the new results against')
+    run_parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+
+    diff_parser = subcommands.add_parser('diff', help='diff two reports')
+    diff_parser.add_argument('baseline')
+    diff_parser.add_argument('current')
+    diff_parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+
+    segments_parser = subcommands.add_parser('segments', help='check that segmented encodes match a single pass')
+    segments_parser.add_argument('--methods', default='all', help="comma-separated methods, or 'all' (default)")
+    segments_parser.add_argument('--speeds', default='1,0.5', help='playback speeds (1/n speeds are segmented)')
+    segments_parser.add_argument('--segments', type=int, default=4, help='segments per encode')
+    segments_parser.add_argument('--source', default=DEFAULT_SOURCES[0])
+    segments_parser.add_argument('--size', default=DEFAULT_SIZES[0])
+    segments_parser.add_argument('--duration', type=float, default=DEFAULT_DURATIONS[0])
+    segments_parser.add_argument('--height', type=int, default=360, help='comparison height')
+    segments_parser.add_argument('--time-offset', type=float, default=0.5,
+                                 help='seconds the candidate lags the reference in the offset case')
+    segments_parser.add_argument('--work-dir', default='benchmark_work')
+
+    backends_parser = subcommands.add_parser('backends', help='check that the raw frame backend matches the filter graph')
+    backends_parser.add_argument('--tolerance', type=int, default=2,
+                                 help='largest accepted per-channel difference (0-255) of the first frames')
+    backends_parser.add_argument('--source', default=DEFAULT_SOURCES[0])
+    backends_parser.add_argument('--size', default=DEFAULT_SIZES[0])
+    backends_parser.add_argument('--duration', type=float, default=1.0)
+    backends_parser.add_argument('--height', type=int, default=360, help='comparison height')
+    backends_parser.add_argument('--work-dir', default='benchmark_work')
+
+    args = parser.parse_args(argv)
+    if args.command == 'diff':
+        rows = diff_reports(load_report(args.baseline), load_report(args.current), args.threshold)
+        return 1 if print_diff(rows) else 0
+
+    if ffmpeg_version() is None:
+        raise SystemExit(f"{app.FFMPEG_PATH} is not available")
+    if args.command == 'segments':
+        return 1 if run_segment_checks(args) else 0
+    if args.command == 'backends':
+        return 1 if run_backend_checks(args) else 0
+    baseline = load_report(args.baseline) if args.baseline else None
+    report = run_benchmarks(args)
+    with open(args.output, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"Wrote {len(report['results'])} result(s) to {args.output}")
+    failures = sum(result["returncode"] != 0 for result in report["results"])
+    if baseline is not None:
+        return 1 if print_diff(diff_reports(baseline, report, args.threshold)) or failures else 0
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""
+Load test for the serving layer: holds many slow, long-lived connections open
+(downloads read at a throttled rate, or /jobs/<id>/events streams) while timing short
+probe requests, to compare how server configurations keep answering under connection
+pressure, e.g. gunicorn gthread (Dockerfile default) against uvicorn with asgi_app.
+
+    python loadtest.py --url http://localhost:8080 --path /outputs/<file>.mp4 --connections 200
+    python loadtest.py --url http://localhost:8080 --path /jobs/<id>/events --connections 500 --output uvicorn.json
+
+Slow connections that finish are reopened, so the given number stays open for the whole
+run. Only the standard library is used (raw asyncio streams, HTTP/1.1 with Connection: close).
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from urllib.parse import urlsplit
+
+READ_INTERVAL_SECONDS = 0.1
+DEFAULT_PROBE_TIMEOUT_SECONDS = 10.0
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list, or None if it is empty."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+async def open_request(host, port, path, method='GET'):
+    """Opens a connection, sends a request and reads the response head. Returns (status, reader, writer)."""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    return status, reader, writer
+
+
+async def close_writer(writer):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+
+
+async def hold_slow_connection(host, port, path, read_rate, stop, stats, delay):
+    """Keeps one connection open on path, reading read_rate bytes/s, reopening it whenever the response ends."""
+    await asyncio.sleep(delay)
+    read_size = max(1, int(read_rate * READ_INTERVAL_SECONDS))
+    while not stop.is_set():
+        writer = None
+        try:
+            status, reader, writer = await open_request(host, port, path)
+            stats["opened"] += 1
+            if status >= 400:
+                stats["errors"] += 1
+            while not stop.is_set():
+                chunk = await reader.read(read_size)
+                if not chunk:
+                    stats["completed"] += 1
+                    break
+                stats["bytes"] += len(chunk)
+                await asyncio.sleep(READ_INTERVAL_SECONDS)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            stats["errors"] += 1
+            await asyncio.sleep(1.0)  # do not spin on a refusing server
+        finally:
+            if writer is not None:
+                await close_writer(writer)
+
+
+async def probe(host, port, path, timeout):
+    """Times one complete request on a fresh connection. Returns (seconds, error or None)."""
+    started = time.perf_counter()
+    writer = None
+    try:
+        status, reader, writer = await asyncio.wait_for(open_request(host, port, path), timeout)
+        await asyncio.wait_for(reader.read(), timeout - (time.perf_counter() - started))
+        error = f"HTTP {status}" if status >= 400 else None
+    except asyncio.TimeoutError:
+        error = "timeout"
+    except (OSError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+        error = type(e).__name__
+    finally:
+        if writer is not None:
+            await close_writer(writer)
+    return time.perf_counter() - started, error
+
+
+async def run_load_test(args):
+    """Opens the slow connections, probes until the duration is over and returns the report dict."""
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    stop = asyncio.Event()
+    slow_stats = {"opened": 0, "completed": 0, "errors": 0, "bytes": 0}
+    holders = [asyncio.ensure_future(hold_slow_connection(host, port, args.path, args.read_rate, stop, slow_stats,
+                                                          index * args.ramp_seconds / max(1, args.connections)))
+               for index in range(args.connections)]
+
+    await asyncio.sleep(args.ramp_seconds)
+    latencies, errors = [], {}
+    started = time.perf_counter()
+    while time.perf_counter() - started < args.duration:
+        seconds, error = await probe(host, port, args.probe_path, args.probe_timeout)
+        if error is None:
+            latencies.append(seconds)
+        else:
+            errors[error] = errors.get(error, 0) + 1
+        await asyncio.sleep(max(0.0, args.probe_interval - seconds))
+
+    stop.set()
+    for holder in holders:
+        holder.cancel()
+    await asyncio.gather(*holders, return_exceptions=True)
+
+    latencies.sort()
+    return {
+        "url": args.url,
+        "slow_path": args.path,
+        "connections": args.connections,
+        "read_rate": args.read_rate,
+        "duration": args.duration,
+        "probe_path": args.probe_path,
+        "probes": len(latencies) + sum(errors.values()),
+        "probe_errors": errors,
+        "latency_seconds": {name: None if value is None else round(value, 4) for name, value in (
+            ("p50", percentile(latencies, 0.50)), ("p95", percentile(latencies, 0.95)),
+            ("p99", percentile(latencies, 0.99)), ("max", latencies[-1] if latencies else None))},
+        "slow_connections": slow_stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8080', help='server base URL')
+    parser.add_argument('--path', required=True, help='path held open by the slow connections')
+    parser.add_argument('--connections', type=int, default=100, help='slow connections to keep open')
+    parser.add_argument('--read-rate', type=float, default=16 * 1024, help='bytes/s read by each slow connection')
+    parser.add_argument('--ramp-seconds', type=float, default=5.0, help='time over which the connections are opened')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of probing after the ramp')
+    parser.add_argument('--probe-path', default='/health', help='path timed while the slow connections are open')
+    parser.add_argument('--probe-interval', type=float, default=0.2, help='seconds between probe requests')
+    parser.add_argument('--probe-timeout', type=float, default=DEFAULT_PROBE_TIMEOUT_SECONDS)
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_load_test(args))
+    latency = report["latency_seconds"]
+
+    def milliseconds(value):
+        return "n/a" if value is None else f"{value * 1000:.1f} ms"
+
+    print(f"{args.connections} slow connection(s) on {args.path}: {report['slow_connections']}")
+    print(f"{report['probes']} probe(s) of {args.probe_path}: p50 {milliseconds(latency['p50'])}, "
+          f"p95 {milliseconds(latency['p95'])}, p99 {milliseconds(latency['p99'])}, "
+          f"max {milliseconds(latency['max'])}, errors {report['probe_errors'] or 0}")
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"Wrote report to {args.output}")
+    return 1 if report["probe_errors"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# app.py and asgi_app.py live at the repository root and are imported as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def job_state(monkeypatch):
+    """Fresh job registry and queue, so tests never see (or start) each other's jobs."""
+    monkeypatch.setattr(app, 'jobs', {})
+    monkeypatch.setattr(app, 'inflight_results', {})
+    monkeypatch.setattr(app, 'job_queue', app.FairJobQueue(2, app.ADMISSION_MPIXEL_FRAMES_PER_SECOND))
+    return app.jobs
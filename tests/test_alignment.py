@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+import app
+
+
+def info(fps=30.0, vfr=False, start_delay=0.0):
+    return {"fps": fps, "vfr": vfr, "start_delay": start_delay}
+
+
+def test_matching_inputs_need_no_alignment():
+    alignment = app.plan_alignment(info(), info(30.001))
+
+    assert alignment == {"offsets": [0.0, 0.0], "fps": None, "reset_pts": False, "time_offset": 0.0}
+    assert app.alignment_is_identity(alignment)
+    assert app.alignment_is_identity(None)
+
+
+def test_mixed_frame_rates_resample_to_the_lower_rate():
+    alignment = app.plan_alignment(info(60.0), info(29.97))
+
+    assert alignment["fps"] == 29.97
+    assert alignment["reset_pts"]
+    assert not app.alignment_is_identity(alignment)
+
+
+def test_variable_frame_rate_is_resampled():
+    assert app.plan_alignment(info(30.0), info(30.0, vfr=True))["fps"] == 30.0
+
+
+@pytest.mark.parametrize("time_offset, offsets", [(1.5, [0.0, 1.5]), (-0.5, [0.5, 0.0])])
+def test_time_offset_seeks_the_later_input(time_offset, offsets):
+    alignment = app.plan_alignment(info(), info(), time_offset)
+
+    assert alignment["offsets"] == offsets
+    assert alignment["reset_pts"]
+
+
+def test_start_delays_reset_timestamps():
+    assert app.plan_alignment(info(), info(start_delay=0.2))["reset_pts"]
+
+
+def test_aligned_inputs_are_never_segmented():
+    assert app.segments_match_single_pass(1.0, app.plan_alignment(info(), info()))
+    assert not app.segments_match_single_pass(1.0, app.plan_alignment(info(60.0), info(30.0)))
+    assert not app.segments_match_single_pass(0.5, app.plan_alignment(info(), info(), 0.5))
+
+
+def signature(length, seed=7):
+    generator = random.Random(seed)
+    return [generator.uniform(16, 235) for _ in range(length)]
+
+
+@pytest.mark.parametrize("lag", [0, 12, -9])
+def test_estimate_time_offset_finds_the_lag(lag):
+    reference = signature(300)
+    # Input 2 shows frame i of input 1 at frame i + lag
+    candidate = [reference[frame - lag] if 0 <= frame - lag < len(reference) else 128.0 for frame in range(300)]
+    candidate = [value * 0.8 + 20 for value in candidate]  # brightness and contrast do not matter
+
+    time_offset, correlation = app.estimate_time_offset(reference, candidate, 30.0)
+
+    assert time_offset == pytest.approx(lag / 30.0)
+    assert correlation > 0.9
+
+
+def test_estimate_time_offset_ignores_weak_matches():
+    time_offset, correlation = app.estimate_time_offset(signature(300, seed=1), signature(300, seed=2), 30.0)
+
+    assert time_offset == 0.0
+    assert correlation < app.ALIGN_MIN_CORRELATION
+
+
+def test_estimate_time_offset_of_still_inputs():
+    assert app.estimate_time_offset([100.0] * 100, [100.0] * 100, 30.0) == (0.0, None)
@@ -0,0 +1,84 @@
+import pytest
+
+import app
+
+
+def box(box_type, payload_size=0):
+    return (8 + payload_size).to_bytes(4, 'big') + box_type + b'\0' * payload_size
+
+
+def write_mp4(tmp_path, data):
+    path = tmp_path / 'partial.mp4'
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_last_fragment_end_stops_at_the_last_complete_mdat(tmp_path):
+    head = box(b'ftyp', 16) + box(b'moov', 40)
+    fragment = box(b'moof', 24) + box(b'mdat', 100)
+    cut_off = box(b'moof', 24) + box(b'mdat', 100)[:50]
+
+    path = write_mp4(tmp_path, head + fragment * 2 + cut_off)
+
+    assert app.last_fragment_end(path) == len(head + fragment * 2)
+
+
+def test_last_fragment_end_without_a_complete_fragment(tmp_path):
+    path = write_mp4(tmp_path, box(b'ftyp', 16) + box(b'moov', 40) + box(b'moof', 24))
+
+    assert app.last_fragment_end(path) == 0
+
+
+def test_last_fragment_end_reads_64_bit_box_sizes(tmp_path):
+    large_mdat = (1).to_bytes(4, 'big') + b'mdat' + (16 + 64).to_bytes(8, 'big') + b'\0' * 64
+
+    path = write_mp4(tmp_path, box(b'moof', 24) + large_mdat + b'\0\0\0')
+
+    assert app.last_fragment_end(path) == 32 + len(large_mdat)
+
+
+def queued_job(followers):
+    job = app.create_job(['side_by_side'], 'a.mp4', 'b.mp4', '1.0')
+    job["followers"].update(followers)
+    app.job_queue.put(job["job_id"], 10.0, 'alice')
+    return job
+
+
+def test_cancel_detaches_followers_before_cancelling(job_state):
+    job = queued_job({"alice": 1, "bob": 1})
+
+    view = app.cancel_job(job["job_id"], "client", client="alice")
+    assert (view["status"], view["cancel_reason"], view["followers"]) == ("queued", None, 1)
+
+    view = app.cancel_job(job["job_id"], "client", client="bob")
+    assert (view["status"], view["cancel_reason"]) == ("cancelled", "client")
+    assert app.job_queue.qsize() == 0
+
+
+def test_cancel_by_a_client_that_does_not_follow_the_job_is_refused(job_state):
+    job = queued_job({"alice": 1})
+
+    with pytest.raises(app.CancelRefused):
+        app.cancel_job(job["job_id"], "client", client="mallory")
+
+    assert job["status"] == "queued" and job["followers"] == {"alice": 1}
+
+
+def test_internal_cancels_ignore_followers(job_state):
+    job = queued_job({"alice": 2})
+
+    view = app.cancel_job(job["job_id"], "abandoned")
+
+    assert (view["status"], view["error"]) == ("cancelled", app.CANCEL_MESSAGES["abandoned"])
+
+
+def test_delete_route_answers_403_for_strangers(job_state):
+    job = queued_job({"10.0.0.1": 1})
+    client = app.app.test_client()
+
+    response = client.delete(f"/jobs/{job['job_id']}", headers={"X-Forwarded-For": "10.0.0.2"})
+    assert response.status_code == 403
+
+    response = client.delete(f"/jobs/{job['job_id']}", headers={"X-Forwarded-For": "10.0.0.1"})
+    assert response.status_code == 200 and response.get_json()["status"] == "cancelled"
+    assert client.delete('/jobs/missing').status_code == 404
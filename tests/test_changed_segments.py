@@ -0,0 +1,43 @@
+import app
+
+
+def test_no_changes_means_no_ranges():
+    assert app.find_changed_ranges([0.5, 1.0, 2.0], 30.0, 2.0) == []
+
+
+def test_changed_frames_become_padded_ranges():
+    differences = [0.0] * 100
+    differences[50] = 8.0
+
+    ranges = app.find_changed_ranges(differences, 10.0, 2.0, padding_seconds=1.0)
+
+    assert ranges == [{"first_frame": 40, "frame_count": 21, "changed_frames": 1,
+                       "peak_difference": 8.0, "mean_difference": 8.0}]
+
+
+def test_ranges_touching_after_padding_are_merged():
+    differences = [0.0] * 100
+    differences[20], differences[30], differences[80] = 4.0, 6.0, 3.0
+
+    ranges = app.find_changed_ranges(differences, 10.0, 2.0, padding_seconds=0.5)
+
+    assert [(changed["first_frame"], changed["frame_count"]) for changed in ranges] == [(15, 21), (75, 11)]
+    assert ranges[0]["changed_frames"] == 2
+    assert ranges[0]["mean_difference"] == 5.0
+
+
+def test_padding_is_clipped_to_the_video():
+    ranges = app.find_changed_ranges([9.0, 0.0, 0.0, 9.0], 10.0, 2.0, padding_seconds=1.0)
+
+    assert [(changed["first_frame"], changed["frame_count"]) for changed in ranges] == [(0, 4)]
+
+
+def test_metrics_command_runs_one_filter_per_metric():
+    stats_files = {"psnr": "/tmp/psnr.log", "mad": "/tmp/mad.log"}
+
+    command = app.get_metrics_ffmpeg_command('a.mp4', 'b.mp4', stats_files, 144, 256)
+
+    graph = command[command.index('-filter_complex') + 1]
+    assert "scale=w=256:h=144" in graph
+    assert "[psnr_out]" in graph and "[mad_out]" in graph and "ssim" not in graph
+    assert command.count('null') == 2
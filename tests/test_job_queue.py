@@ -0,0 +1,87 @@
+import app
+
+
+def drain(queue):
+    return [queue.get() for _ in range(queue.qsize())]
+
+
+def test_short_jobs_overtake_long_ones():
+    queue = app.FairJobQueue(1, 100.0)
+    queue.put('long', 100.0, 'alice')
+    queue.put('short', 10.0, 'bob')
+
+    assert drain(queue) == ['short', 'long']
+
+
+def test_backlog_of_one_client_does_not_starve_another():
+    queue = app.FairJobQueue(1, 100.0)
+    for index in range(3):
+        queue.put(f'alice-{index}', 10.0, 'alice')
+    queue.put('bob-0', 10.0, 'bob')
+
+    assert drain(queue) == ['alice-0', 'bob-0', 'alice-1', 'alice-2']
+
+
+def test_new_clients_start_at_virtual_time():
+    queue = app.FairJobQueue(1, 100.0)
+    queue.put('alice-0', 50.0, 'alice')
+    queue.put('alice-1', 50.0, 'alice')
+    assert queue.get() == 'alice-0'
+
+    # bob's first job is tagged from virtual time 50, so it does not jump ahead of a job tagged 100
+    queue.put('bob-0', 60.0, 'bob')
+
+    assert drain(queue) == ['alice-1', 'bob-0']
+
+
+def test_discard_removes_only_queued_jobs():
+    queue = app.FairJobQueue(1, 100.0)
+    queue.put('a', 10.0, 'alice')
+    queue.put('b', 20.0, 'alice')
+
+    assert queue.discard('a')
+    assert not queue.discard('a')
+    assert drain(queue) == ['b']
+
+
+def test_done_recalibrates_throughput():
+    queue = app.FairJobQueue(1, 100.0)
+    queue.put('a', 10.0, 'alice')
+    queue.get()
+
+    queue.done('a', units=1000.0, run_seconds=5.0)
+
+    assert queue.mpixel_frames_per_second == 120.0
+    assert queue.cost_seconds(600.0) == 5.0
+    assert queue.cost_seconds(None) == app.ADMISSION_UNKNOWN_JOB_SECONDS
+
+
+def test_admission_limits_jobs_per_client(monkeypatch):
+    monkeypatch.setattr(app, 'ADMISSION_MAX_CLIENT_JOBS', 2)
+    queue = app.FairJobQueue(2, 100.0)
+    queue.put('a', 10.0, 'alice')
+    queue.put('b', 30.0, 'alice')
+
+    assert queue.admission_delay(10.0, 'alice') == ("client_limit", 5)
+    assert queue.admission_delay(10.0, 'bob') is None
+
+
+def test_admission_refuses_when_the_wait_is_too_long(monkeypatch):
+    monkeypatch.setattr(app, 'ADMISSION_MAX_WAIT_SECONDS', 30.0)
+    queue = app.FairJobQueue(1, 100.0)
+    queue.put('a', 100.0, 'alice')
+    assert queue.admission_delay(10.0, 'bob') is None  # a runner is free
+    queue.get()
+
+    assert queue.admission_delay(10.0, 'bob') == ("saturated", 70)
+
+
+def test_admission_control_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(app, 'ADMISSION_MAX_WAIT_SECONDS', 0)
+    monkeypatch.setattr(app, 'ADMISSION_MAX_CLIENT_JOBS', 1)
+    queue = app.FairJobQueue(1, 100.0)
+    queue.put('a', 1000.0, 'alice')
+    queue.get()
+    queue.put('b', 1000.0, 'alice')
+
+    assert queue.admission_delay(10.0, 'alice') is None
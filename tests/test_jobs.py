@@ -0,0 +1,36 @@
+import app
+
+
+def test_create_job_is_queued_and_visible(job_state):
+    job = app.create_job(['side_by_side'], 'a.mp4', 'b.mp4', '1.0', options={"encode_profile": "preview"})
+
+    view = app.get_job_status(job["job_id"])
+    assert view["status"] == "queued"
+    assert view["methods"] == ['side_by_side']
+    assert view["encode_profile"] == "preview"
+    assert view["followers"] == 0
+    assert "processes" not in view and "input1_path" not in view
+
+
+def test_get_job_status_of_unknown_job(job_state):
+    assert app.get_job_status('missing') is None
+
+
+def test_update_job_bumps_version(job_state):
+    job = app.create_job(['side_by_side'], 'a.mp4', 'b.mp4', '1.0')
+
+    app.update_job(job, status="running", progress=0.5)
+
+    assert job["version"] == 1
+    assert app.get_job_status(job["job_id"])["progress"] == 0.5
+
+
+def test_public_view_is_a_copy(job_state):
+    job = app.create_job(['side_by_side'], 'a.mp4', 'b.mp4', '1.0', options={"top_n": 3})
+
+    view = app.get_job_status(job["job_id"])
+    view["options"]["top_n"] = 10
+    view["methods"].append('interleave')
+
+    assert job["options"] == {"top_n": 3}
+    assert job["methods"] == ['side_by_side']
@@ -0,0 +1,118 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import app  # noqa: E402
+
+WIDTH, HEIGHT = 8, 4
+
+
+def frame(values, pix_fmt='yuv420p'):
+    """A frame whose three planes are filled from values (one scalar or array per plane)."""
+    return tuple(np.full(shape, value, np.uint8) if np.isscalar(value) else np.asarray(value, np.uint8).reshape(shape)
+                 for shape, value in zip(app.raw_plane_shapes(WIDTH, HEIGHT, pix_fmt), values))
+
+
+def run_kernel(method, a, b, options=None, pix_fmt='yuv420p'):
+    out = tuple(np.empty_like(plane) for plane in a)
+    app.RAW_FRAME_KERNELS[method](a, b, out, app.RawFrameScratch(WIDTH, HEIGHT, pix_fmt), options or {})
+    return out
+
+
+def test_plane_shapes():
+    assert app.raw_plane_shapes(WIDTH, HEIGHT) == [(4, 8), (2, 4), (2, 4)]
+    assert app.raw_plane_shapes(WIDTH, HEIGHT, 'gbrp') == [(4, 8), (4, 8), (4, 8)]
+    assert app.raw_frame_bytes(WIDTH, HEIGHT) == 48
+    assert app.raw_frame_bytes(WIDTH, HEIGHT, 'gbrp') == 96
+
+
+def test_frame_planes_split_stacked_slots():
+    # ffmpeg vstacks both inputs, so each plane holds slot 0's rows and then slot 1's
+    planes = [np.concatenate([np.full((rows, columns), slot * 10 + index, np.uint8) for slot in range(2)])
+              for index, (rows, columns) in enumerate(app.raw_plane_shapes(WIDTH, HEIGHT))]
+    buffer = bytearray(b''.join(plane.tobytes() for plane in planes))
+
+    slots = app.raw_frame_planes(buffer, WIDTH, HEIGHT, slots=2)
+
+    assert [[int(plane[0, 0]) for plane in slot] for slot in slots] == [[0, 1, 2], [10, 11, 12]]
+    assert [plane.shape for plane in slots[1]] == [(4, 8), (2, 4), (2, 4)]
+
+
+def test_average_rounds_down_without_overflow():
+    a, b = np.meshgrid(np.arange(256, dtype=np.uint8), np.arange(256, dtype=np.uint8))
+    out, scratch = np.empty_like(a), np.empty_like(a)
+
+    app._average(a, b, out, scratch)
+
+    assert np.array_equal(out, ((a.astype(np.int32) + b) // 2).astype(np.uint8))
+
+
+@pytest.mark.parametrize("pix_fmt", ['yuv420p', 'gbrp'])
+def test_identical_frames_have_no_difference(pix_fmt):
+    a = frame((200, 60, 180), pix_fmt)
+
+    for method in ('difference_blend', 'subtract_blend'):
+        assert all(not plane.any() for plane in run_kernel(method, a, a, pix_fmt=pix_fmt))
+    assert all(np.array_equal(out, plane) for out, plane in zip(run_kernel('opacity_blend', a, a, pix_fmt=pix_fmt), a))
+
+
+def test_difference_is_absolute_and_subtract_clips():
+    a, b = frame((100, 50, 200)), frame((130, 20, 200))
+
+    difference = run_kernel('difference_blend', a, b)
+    subtract = run_kernel('subtract_blend', a, b)
+
+    assert [int(plane[0, 0]) for plane in difference] == [30, 30, 0]
+    assert [int(plane[0, 0]) for plane in subtract] == [0, 30, 0]
+
+
+def test_channel_mix_takes_luma_from_a_and_v_from_b():
+    out = run_kernel('color_channel_mix', frame((100, 50, 20)), frame((200, 150, 220)))
+
+    assert [int(plane[0, 0]) for plane in out] == [100, 100, 220]
+
+
+def test_heatmap_of_identical_frames_is_black():
+    a = frame((120, 128, 128))
+
+    out = run_kernel('heatmap', a, a)
+
+    assert [int(plane[0, 0]) for plane in out] == [int(lut[0]) for lut in app.HEATMAP_LUT]
+    assert int(app.HEATMAP_LUT[0][0]) == 16
+
+
+def test_threshold_mask_paints_changed_pixels_red():
+    luma = np.full((HEIGHT, WIDTH), 100, np.uint8)
+    changed = luma.copy()
+    changed[0:2, 0:2] = 180  # one chroma block changes
+    a, b = frame((luma, 128, 128)), frame((changed, 128, 128))
+
+    out = run_kernel('threshold_mask', a, b, {"diff_threshold": 16})
+
+    assert out[0][0, 0] == app.MASK_YUV[0] and out[0][3, 7] == 100 // 2 + 8
+    assert (out[1][0, 0], out[2][0, 0]) == app.MASK_YUV[1:]
+    assert (out[1][1, 3], out[2][1, 3]) == (128, 128)
+
+
+def test_channel_difference_is_neutral_for_identical_frames():
+    a = frame((90, 100, 160))
+
+    out = run_kernel('channel_difference', a, a)
+
+    assert [int(plane[0, 0]) for plane in out] == [0, 128, 128]
+
+
+def test_channel_difference_doubles_chroma_shifts():
+    out = run_kernel('channel_difference', frame((100, 140, 100)), frame((90, 120, 130)))
+
+    assert [int(plane[0, 0]) for plane in out] == [40, 168, 68]
+
+
+def test_tinted_methods_run_on_rgb_planes():
+    assert app.raw_pixel_format(True) == 'gbrp' and app.raw_pixel_format(False) == 'yuv420p'
+    tinted = sorted(app.TINTING_METHODS & set(app.RAW_FRAME_KERNELS))
+    assert tinted
+    for method in tinted:
+        assert app.raw_frame_variant(method, 'numpy', {})["planes"] == 'gbrp'
+    assert app.raw_frame_variant('heatmap', 'numpy', {}) == {}
+    assert app.raw_frame_variant('difference_blend', 'ffmpeg', {}) == {}
@@ -0,0 +1,54 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import app
+
+
+def test_no_options():
+    assert app.parse_job_options({}) == ({}, None)
+
+
+def test_resolutions_from_json_list_form_string_and_repeated_fields():
+    expected = ({"resolutions": ['proxy', '480', '1080']}, None)
+
+    assert app.parse_job_options({"resolution": ['1080', 'proxy', '480']}) == expected
+    assert app.parse_job_options({"resolution": '480,proxy,1080,480'}) == expected
+    assert app.parse_job_options(MultiDict([('resolution', '1080'), ('resolution', 'proxy,480')])) == expected
+
+
+def test_options_are_parsed_and_clamped():
+    options, error = app.parse_job_options({
+        "top_n": '0', "encode_profile": 'lossless', "diff_threshold": '-3', "padding": '1.5',
+        "time_offset": '-0.25', "blink_period": '250ms', "thumbnails": 'true', "blink_vfr": 'off',
+    })
+
+    assert error is None
+    assert options == {"top_n": 1, "encode_profile": 'lossless', "diff_threshold": 0.0, "padding": 1.5,
+                       "time_offset": -0.25, "blink_period": {"ms": 250}, "thumbnails": True}
+
+
+def test_time_offset_may_be_detected():
+    assert app.parse_job_options({"time_offset": 'auto'}) == ({"time_offset": 'auto'}, None)
+
+
+def test_a_one_frame_blink_period_is_the_default():
+    assert app.parse_job_options({"blink_period": '1'}) == ({}, None)
+
+
+@pytest.mark.parametrize("values, message", [
+    ({"top_n": 'many'}, "Invalid top_n"),
+    ({"encode_profile": 'ultra'}, "Invalid encode_profile"),
+    ({"encode_mode": 'fast'}, "Invalid encode_mode"),
+    ({"diff_threshold": 'nan'}, "Invalid diff_threshold"),
+    ({"highlight_method": 'sepia'}, "Invalid highlight_method"),
+    ({"time_offset": 'inf'}, "Invalid time_offset"),
+    ({"backend": 'opencl'}, "Invalid backend"),
+    ({"blink_period": '0'}, "Invalid blink_period"),
+    ({"blink_period": 'soon'}, "Invalid blink_period"),
+    ({"resolution": '480,4k'}, "Invalid resolution: 4k"),
+])
+def test_invalid_options_are_reported(values, message):
+    options, error = app.parse_job_options(values)
+
+    assert options is None
+    assert error.startswith(message)
@@ -0,0 +1,136 @@
+import os
+import time
+
+import app
+
+
+def write_entry(folder, key, suffix='output.mp4', size=10, age_seconds=0.0):
+    """Writes a cache file of size bytes whose access and modification times are age_seconds ago."""
+    filename = f"{key}_{suffix}"
+    path = os.path.join(folder, filename)
+    with open(path, 'wb') as cache_file:
+        cache_file.write(b'x' * size)
+    moment = time.time() - age_seconds
+    os.utime(path, (moment, moment))
+    return filename
+
+
+def test_result_key_depends_on_every_parameter():
+    key = app.compute_result_key('a' * 64, 'b' * 64, 'side_by_side', '1.0', 480)
+
+    assert key == app.compute_result_key('a' * 64, 'b' * 64, 'side_by_side', 1, 480)
+    assert key != app.compute_result_key('b' * 64, 'a' * 64, 'side_by_side', '1.0', 480)
+    assert key != app.compute_result_key('a' * 64, 'b' * 64, 'difference_blend', '1.0', 480)
+    assert key != app.compute_result_key('a' * 64, 'b' * 64, 'side_by_side', '0.5', 480)
+    assert key != app.compute_result_key('a' * 64, 'b' * 64, 'side_by_side', '1.0', 720)
+    assert key != app.compute_result_key('a' * 64, 'b' * 64, 'side_by_side', '1.0', 480, variant={"top_n": 3})
+
+
+def test_get_counts_hits_and_misses(tmp_path):
+    cache = app.DiskLRUCache(str(tmp_path), 1000, 3600)
+    filename = write_entry(str(tmp_path), 'a' * 64)
+    cache.put('a' * 64, filename)
+
+    assert cache.get('a' * 64) == filename
+    assert cache.get('b' * 64) is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+def test_put_evicts_least_recently_used_over_budget(tmp_path):
+    cache = app.DiskLRUCache(str(tmp_path), 25, 3600)
+    for key in ('a' * 64, 'b' * 64):
+        cache.put(key, write_entry(str(tmp_path), key))
+    cache.get('a' * 64)  # b is now the least recently used
+
+    cache.put('c' * 64, write_entry(str(tmp_path), 'c' * 64))
+
+    assert cache.get('b' * 64) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), f"{'b' * 64}_output.mp4"))
+    assert cache.get('a' * 64) and cache.get('c' * 64)
+    assert cache.stats()["bytes"] == 20
+
+
+def test_put_evicts_expired_entries(tmp_path):
+    cache = app.DiskLRUCache(str(tmp_path), 1000, 60)
+    cache.put('a' * 64, write_entry(str(tmp_path), 'a' * 64))
+    cache.entries['a' * 64]["last_access"] -= 120
+
+    cache.put('b' * 64, write_entry(str(tmp_path), 'b' * 64))
+
+    assert list(cache.entries) == ['b' * 64]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_index_is_rebuilt_from_disk(tmp_path):
+    old = write_entry(str(tmp_path), 'a' * 64, age_seconds=100)
+    new = write_entry(str(tmp_path), 'b' * 64)
+    write_entry(str(tmp_path), 'c' * 64, suffix='output.part.mp4')
+
+    cache = app.DiskLRUCache(str(tmp_path), 1000, 3600)
+
+    assert cache.get('a' * 64) == old and cache.get('b' * 64) == new
+    assert cache.get('c' * 64) is None
+
+
+def test_lookup_drops_entries_deleted_from_disk(tmp_path):
+    cache = app.DiskLRUCache(str(tmp_path), 1000, 3600)
+    filename = write_entry(str(tmp_path), 'a' * 64)
+    cache.put('a' * 64, filename)
+    os.remove(os.path.join(str(tmp_path), filename))
+
+    assert cache.get('a' * 64) is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_sweep_removes_stale_leftovers_only(tmp_path):
+    folder = str(tmp_path)
+    cache = app.DiskLRUCache(folder, 1000, 3600)
+    cache.put('a' * 64, write_entry(folder, 'a' * 64))
+    stale_part = write_entry(folder, 'b' * 64, suffix='output.part.mp4', age_seconds=7200)
+    fresh_part = write_entry(folder, 'c' * 64, suffix='output.part.mp4')
+    stray = write_entry(folder, 'not-a-key', suffix='output.mp4', size=5, age_seconds=7200)
+    os.mkdir(os.path.join(folder, '.segments_crashed'))
+    os.utime(os.path.join(folder, '.segments_crashed'), (time.time() - 7200,) * 2)
+
+    reclaimed = cache.sweep(orphan_grace_seconds=3600)
+
+    assert reclaimed == 15
+    assert sorted(os.listdir(folder)) == sorted([f"{'a' * 64}_output.mp4", fresh_part])
+    assert stale_part not in os.listdir(folder) and stray not in os.listdir(folder)
+    assert cache.stats()["orphans_removed"] == 3
+
+
+def test_sweep_adopts_cache_files_written_by_another_process(tmp_path):
+    folder = str(tmp_path)
+    cache = app.DiskLRUCache(folder, 1000, 3600)
+    cache.put('a' * 64, write_entry(folder, 'a' * 64))
+    # Another worker sharing the folder finishes an output after this index was loaded
+    foreign = write_entry(folder, 'b' * 64, age_seconds=7200)
+
+    assert cache.sweep(orphan_grace_seconds=3600) == 0
+
+    assert os.path.exists(os.path.join(folder, foreign))
+    assert cache.get('b' * 64) == foreign
+    assert cache.stats()["bytes"] == 20
+
+
+def test_adopted_files_keep_their_recency(tmp_path):
+    folder = str(tmp_path)
+    cache = app.DiskLRUCache(folder, 25, 3600)
+    cache.put('a' * 64, write_entry(folder, 'a' * 64))
+    write_entry(folder, 'b' * 64, age_seconds=600)
+    cache.sweep(orphan_grace_seconds=3600)
+
+    cache.put('c' * 64, write_entry(folder, 'c' * 64))
+
+    # The adopted file was last used before a, so it is evicted first
+    assert list(cache.entries) == ['a' * 64, 'c' * 64]
+
+
+def test_sweep_enforces_bounds_without_new_entries(tmp_path):
+    cache = app.DiskLRUCache(str(tmp_path), 1000, 60)
+    cache.put('a' * 64, write_entry(str(tmp_path), 'a' * 64))
+    cache.entries['a' * 64]["last_access"] -= 120
+
+    assert cache.sweep() == 10
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,64 @@
+import pytest
+
+import app
+
+
+def info(duration, fps=30.0):
+    return {"fps": fps, "duration": duration}
+
+
+def test_plan_segments_splits_on_frame_boundaries():
+    segments = app.plan_segments(info(40.0), info(45.0), max_segments=4, min_segment_seconds=10)
+
+    assert segments == [(0, 300), (300, 300), (600, 300), (900, None)]
+
+
+def test_plan_segments_uses_the_shorter_input_and_first_frame_rate():
+    segments = app.plan_segments(info(30.0, fps=25.0), info(20.0, fps=60.0), max_segments=8, min_segment_seconds=5)
+
+    assert segments == [(0, 125), (125, 125), (250, 125), (375, None)]
+
+
+@pytest.mark.parametrize("info1, info2", [
+    (info(15.0), info(15.0)),  # shorter than two minimum segments
+    (None, info(60.0)),
+    ({"fps": None, "duration": 60.0}, info(60.0)),
+    (info(60.0), {"fps": 30.0, "duration": None}),
+])
+def test_plan_segments_declines(info1, info2):
+    assert app.plan_segments(info1, info2, max_segments=4, min_segment_seconds=10) is None
+
+
+@pytest.mark.parametrize("frame_count, speed, expected", [
+    (30, 1.0, 30),
+    (30, 0.5, 60),
+    (30, 0.25, 120),
+    (31, 2.0, 16),
+    (30, '0.5', 60),
+])
+def test_segment_output_frames(frame_count, speed, expected):
+    assert app.segment_output_frames(frame_count, speed) == expected
+
+
+@pytest.mark.parametrize("speed, expected", [
+    (1.0, True), (0.5, True), (0.25, True), ('0.5', True),
+    (2.0, False), (0.75, False), (1.5, False),
+])
+def test_segments_match_single_pass_only_at_reciprocal_speeds(speed, expected):
+    assert app.segments_match_single_pass(speed) is expected
+
+
+def test_segment_command_seeks_half_a_frame_early_and_counts_output_frames():
+    command = app.get_segment_command(['side_by_side'], 'a.mp4', 'b.mp4', ['out.mp4'], 30.0, (60, 30), 480, 0.5)
+
+    assert command.count('-ss') == 2
+    assert command[command.index('-ss') + 1] == f"{59.5 / 30:.6f}"
+    assert command[command.index('-frames:v') + 1] == '60'
+    assert 'setpts=PTS-STARTPTS' in command[command.index('-filter_complex') + 1]
+
+
+def test_first_segment_is_not_seeked():
+    command = app.get_segment_command(['side_by_side'], 'a.mp4', 'b.mp4', ['out.mp4'], 30.0, (0, 30), 480)
+
+    assert '-ss' not in command
+    assert command[command.index('-frames:v') + 1] == '30'
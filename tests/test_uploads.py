@@ -0,0 +1,77 @@
+import hashlib
+import io
+
+import pytest
+
+import app
+
+MP4_HEADER = b'\x00\x00\x00\x18ftypmp42'
+
+
+@pytest.fixture
+def upload_folder(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(app, 'probe_index', app.ProbeIndex(str(tmp_path / 'probe_index.sqlite3'), 100))
+    return tmp_path
+
+
+@pytest.mark.parametrize("header, expected", [
+    (MP4_HEADER, True),
+    (b'\x1a\x45\xdf\xa3' + b'\0' * 8, True),
+    (b'RIFF\0\0\0\0AVI ', True),
+    (b'RIFF\0\0\0\0WAVE', False),
+    (b'GIF89a' + b'\0' * 6, False),
+    (MP4_HEADER[:8], False),
+])
+def test_looks_like_video_header(header, expected):
+    assert app.looks_like_video_header(header) is expected
+
+
+def test_streaming_upload_hashes_while_writing(upload_folder):
+    data = MP4_HEADER + b'x' * 5000
+    upload = app.StreamingUpload(str(upload_folder / 'a.mp4'), 'clip.mp4')
+    for offset in range(0, len(data), 7):
+        upload.write(data[offset:offset + 7])
+
+    upload.finish_receive()
+    upload.close()
+
+    assert upload.sha256 == hashlib.sha256(data).hexdigest()
+    assert upload.bytes_written == len(data) and upload.filename == 'clip.mp4'
+    assert app.hash_file(upload.path) == upload.sha256
+
+
+def test_streaming_upload_rejects_other_content_early(upload_folder):
+    upload = app.StreamingUpload(str(upload_folder / 'a.mp4'))
+
+    with pytest.raises(app.UploadRejected):
+        upload.write(b'GIF89a' + b'x' * 100)
+
+    assert not (upload_folder / 'a.mp4').exists()
+
+
+def compare(files):
+    data = {'comparison_method': 'side_by_side', 'playback_speed': '1.0', **files}
+    return app.app.test_client().post('/compare', data=data, content_type='multipart/form-data')
+
+
+def test_empty_filename_is_reported_as_such(upload_folder):
+    response = compare({'video1': (io.BytesIO(b''), ''), 'video2': (io.BytesIO(MP4_HEADER), 'b.mp4')})
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "No selected file or empty filename"}
+
+
+def test_unsupported_extension_is_rejected(upload_folder):
+    response = compare({'video1': (io.BytesIO(MP4_HEADER), 'a.gif'), 'video2': (io.BytesIO(MP4_HEADER), 'b.mp4')})
+
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith("Invalid file type")
+
+
+def test_rejected_uploads_leave_nothing_behind(upload_folder):
+    response = compare({'video1': (io.BytesIO(b'GIF89a' + b'x' * 100), 'a.mp4'),
+                        'video2': (io.BytesIO(MP4_HEADER), 'b.mp4')})
+
+    assert response.status_code == 400
+    assert [path.name for path in upload_folder.iterdir() if path.suffix == '.mp4'] == []